@@ -0,0 +1,119 @@
+'''
+What each user has done on other users' posts
+
+The store only links downward, from users to posts to comments and
+likes, so finding everything one user liked or commented used to mean
+scanning every post. UserActivity keeps the reverse: for each user id
+the posts and comments they liked and the comments they wrote. Deleting
+a user can then remove all of it in time proportional to their own
+activity, and "posts this user liked" is a lookup.
+
+Like the other indexes over the store it's built the first time it's
+needed and kept up to date through the store's notifications.
+'''
+
+
+def is_comment(text):
+    # comments know the post they're on, posts don't have one
+    return hasattr(text, 'post')
+
+
+class UserActivity:
+
+    def __init__(self, blog):
+        self.blog = blog
+        self.built = False
+
+        # user id -> {post or comment: None}, dicts keep the order
+        # things were liked or written in
+        self.liked_posts = {}
+        self.liked_comments = {}
+        self.comments = {}
+
+        blog.add_observer(self)
+
+    def build(self):
+        self.built = True
+
+        for user in self.blog.users:
+            for post in user.posts:
+                self.add_likes(post)
+
+                for comment in post.comments:
+                    self.comment_added(comment)
+                    self.add_likes(comment)
+
+    def add_likes(self, text):
+        for user, _ in text.likes.rows():
+            self.like_added(text, user)
+
+    def liked(self, text):
+        return self.liked_comments if is_comment(text) else self.liked_posts
+
+    # store notifications, ignored until the index is first built
+
+    def like_added(self, text, user):
+        if self.built:
+            self.liked(text).setdefault(user.id, {})[text] = None
+
+    def like_deleted(self, text, user_id):
+        if self.built:
+            self.liked(text).get(user_id, {}).pop(text, None)
+
+    def comment_added(self, comment):
+        if self.built:
+            self.comments.setdefault(comment.user.id, {})[comment] = None
+
+    def comment_deleted(self, comment):
+        if not self.built:
+            return
+
+        self.comments.get(comment.user.id, {}).pop(comment, None)
+        for user, _ in comment.likes.rows():
+            self.liked_comments.get(user.id, {}).pop(comment, None)
+
+    def post_deleted(self, post):
+        if not self.built:
+            return
+
+        for user, _ in post.likes.rows():
+            self.liked_posts.get(user.id, {}).pop(post, None)
+
+        for comment in post.comments:
+            self.comment_deleted(comment)
+
+    def user_deleted(self, user):
+        # by now remove_activity has taken their likes and comments
+        # off everyone else's posts, what's left is their own posts
+        if not self.built:
+            return
+
+        for post in user.posts:
+            self.post_deleted(post)
+
+        self.liked_posts.pop(user.id, None)
+        self.liked_comments.pop(user.id, None)
+        self.comments.pop(user.id, None)
+
+    def remove_activity(self, user):
+        '''
+        Deletes every like and comment user made
+
+        Each delete goes through the models, so every other index
+        hears about it as if it had been deleted through the API
+        '''
+        if not self.built:
+            self.build()
+
+        for text in list(self.liked_posts.get(user.id, ())):
+            text.delete_like(user.id)
+        for text in list(self.liked_comments.get(user.id, ())):
+            text.delete_like(user.id)
+        for comment in list(self.comments.get(user.id, ())):
+            comment.post.delete_comment(comment.id)
+
+    def posts_liked_by(self, user_id):
+        if not self.built:
+            self.build()
+
+        return list(self.liked_posts.get(user_id, ()))
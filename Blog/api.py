@@ -1,14 +1,274 @@
-from flask import Flask, jsonify, make_response, request
+import os
+import sys
+from functools import wraps
+
+from flask import Flask, current_app, request
 from flask_restful import Resource, Api
-from models import BlogUsers
+from flask_restful.utils import unpack
+from werkzeug.local import LocalProxy
+from werkzeug.wrappers import Response as ResponseBase
+
+# the modules both APIs share are in shared/, at the top of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from encoding import dumps, encode_list, json_response, output_json
+from shared.pagination import page_args, page_headers, parse_limit
+from shared import bulk
+from shared import expand
+from shared import fields
+from shared import metrics
+from shared.fields import Nested
+from models import (COMMENT_FIELDS, LIKE_FIELDS, POST_FIELDS, USER_FIELDS,
+                    COMMENT_RELATIONS, POST_RELATIONS, USER_RELATIONS)
+from store import DEFAULTS, BlogStore, config_from_env
+from timeline import PastTimeline, post_key
+
+api = Api()
+
+
+@api.representation('application/json')
+def output_fields(data, code, headers=None):
+    # dicts returned straight from a Resource, cut down to fields=
+    tree = fields.requested()
+
+    if tree is not None:
+        data = fields.project(data, tree)
+    return output_json(data, code, headers)
 
-app = Flask(__name__)
-api = Api(app)
 
 api_url = '/blogr/api/v1/'
 
-# loads the global object used to access the backend
-blog_data = BlogUsers('users.json', 'posts.json')
+
+def create_app(config=None):
+    '''
+    Builds an app over its own store, config overrides store.DEFAULTS
+
+    Nothing is read until the store loads, see shared/startup.py
+    '''
+    app = Flask(__name__)
+    app.config.update(DEFAULTS)
+    app.config.update(config or {})
+
+    store = BlogStore(app.config)
+    app.extensions['blog'] = store
+
+    api.init_app(app)
+
+    # installed first so requests held back while loading are timed too
+    app.extensions['metrics'] = metrics.from_config(app.config)
+    app.extensions['metrics'].install(app)
+    store.startup.ungated.update(metrics.Metrics.endpoints)
+
+    fields.install(app)
+    expand.install(app)
+
+    store.startup.install(app, api_url)
+    return app
+
+
+def from_store(name):
+    # the object called name in the current app's BlogStore
+    return LocalProxy(lambda: getattr(current_app.extensions['blog'], name))
+
+
+# the global objects used to access the backend
+blog_data = from_store('blog')
+journal = from_store('journal')
+search_index = from_store('search')
+timeline = from_store('timeline')
+leaderboards = from_store('leaderboards')
+responses = from_store('responses')
+user_activity = LocalProxy(lambda: blog_data.activity)
+
+
+'''
+Requests can be served from many threads at once, each one locks what it
+touches (see shared/locking.py). A request under users/<user_id> locks
+that user's subtree: the user, their posts, and the comments and likes
+on them, whoever wrote those. Anything else locks the whole store for
+writes, reads of the indexes over the whole store lock those.
+
+Every write bumps the versions of what it changed before unlocking,
+and GETs are answered with ETags and from the response cache (see
+shared/cache.py), with what they read locked.
+'''
+
+
+def subtree(kwargs):
+    # the path a request under users/<user_id> reads or writes
+    if kwargs.get('user_id') is None:
+        return ()
+    if 'post_id' not in kwargs:
+        return (kwargs['user_id'],)
+    return (kwargs['user_id'], kwargs['post_id'])
+
+
+def reads(func):
+    @wraps(func)
+    def locked(*args, **kwargs):
+        with blog_data.locks.reading(kwargs.get('user_id')):
+            return func(*args, **kwargs)
+    return locked
+
+
+def writes(func, shared=False):
+    @wraps(func)
+    def locked(*args, **kwargs):
+        with blog_data.locks.writing(kwargs.get('user_id')):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                responses.versions.bump(subtree(kwargs), shared)
+    return locked
+
+
+def writes_user(func):
+    # a user's name and picture are in everything they wrote or liked,
+    # under anyone's posts
+    return writes(func, shared=True)
+
+
+def writes_all(func):
+    # for changes that reach outside one user's subtree
+    @wraps(func)
+    def locked(*args, **kwargs):
+        with blog_data.locks.writing():
+            try:
+                return func(*args, **kwargs)
+            finally:
+                responses.versions.bump(shared=True)
+    return locked
+
+
+def reads_index(index):
+    # for reads of an index over the whole store
+    def decorator(func):
+        @wraps(func)
+        def locked(*args, **kwargs):
+            with blog_data.locks.index(index):
+                return func(*args, **kwargs)
+        return locked
+    return decorator
+
+
+def as_response(result):
+    # what a Resource returned, as flask_restful would send it
+    if isinstance(result, ResponseBase):
+        return result
+
+    data, code, headers = unpack(result)
+    return api.make_response(data, code, headers=headers)
+
+
+def cached(path):
+    # for GETs reading what's under the path returned for their kwargs,
+    # they go before the lock decorator so they run with it held
+    def decorator(func):
+        @wraps(func)
+        def get(*args, **kwargs):
+            return responses.serve(
+                path(kwargs),
+                lambda: as_response(func(*args, **kwargs)))
+        return get
+    return decorator
+
+
+# reads of the whole store or an index over it depend on every write
+cached_subtree = cached(subtree)
+cached_index = cached(lambda kwargs: ())
+
+
+def index_reads(index):
+    return {'get': [cached_index, reads_index(index)]}
+
+
+subtree_locks = {'get': [cached_subtree, reads], 'post': [writes],
+                 'put': [writes], 'patch': [writes], 'delete': [writes]}
+
+
+def takes_batch(func):
+    # parses a bulk write's objects before its subtree is locked,
+    # they're passed on as batch (see shared/bulk.py)
+    @wraps(func)
+    def parsed(*args, **kwargs):
+        try:
+            batch = bulk.items()
+        except ValueError as error:
+            return json_response(dumps({'error': str(error)}), 400)
+        return func(*args, batch=batch, **kwargs)
+    return parsed
+
+
+bulk_writes = {'post': [writes, takes_batch]}
+
+
+def create_json(model):
+    return model.create_json()
+
+
+def shaped(table, whole=create_json, relations=None):
+    '''
+    How a list endpoint encodes each model for this request, whole
+    (by default its memoized JSON) or just the keys fields= asks for
+
+    Endpoints that pass the models' relations table also embed what
+    expand= asks for, they must hold the lock of the subtree it's in
+    '''
+    tree = fields.requested()
+    embed = expand.requested() if relations else None
+
+    if embed is not None:
+        embedder = expand.Embedder(embed, relations)
+
+        if tree is None:
+            return lambda model: dumps(embedder(model))
+        return lambda model: dumps(fields.project(embedder(model), tree))
+
+    if tree is None:
+        return whole
+
+    build = fields.compile(tree, table)
+    return lambda model: dumps(build(model))
+
+
+def bulk_rejected(results):
+    return json_response(dumps(results), 400)
+
+
+def bulk_created(models, table):
+    # each model as the single object endpoint would have sent it
+    encode = shaped(table)
+    return json_response(encode_list(
+        b'{"item":' + encode(model) + b',"status":201}' for model in models),
+        201)
+
+
+def checks_likes(liked):
+    # checks bulk likes of liked, which each user can only like once
+    seen = set()
+
+    def check(data):
+        user_id = data.get('userID')
+
+        # bools are ints to isinstance, True would like it as user 1
+        if type(user_id) is not int:
+            return 'userID is required'
+        if not blog_data.find_user(user_id):
+            return 'user {} not found'.format(user_id)
+        if user_id in seen or liked.find_like(user_id):
+            return 'user {} already likes it'.format(user_id)
+
+        seen.add(user_id)
+    return check
+
+
+def embedded(model, relations):
+    # a single model's dict, with what expand= asks for embedded in it
+    embed = expand.requested()
+
+    if embed is None:
+        return model.create_dict()
+    return expand.Embedder(embed, relations)(model)
 
 
 '''
@@ -21,9 +281,20 @@ It is assumed the dev knows the interface for each object but not the internals
 
 
 class UsersResource(Resource):
+    method_decorators = subtree_locks
+
     def get(self):
-        user_dicts = map(lambda user: user.create_dict(), blog_data.users)
-        return make_response(jsonify(list(user_dicts)), 200)
+        try:
+            after, limit = page_args(request.args)
+        except ValueError:
+            return None, 400
+
+        # a shard only lists the users it owns, not its replicas
+        users, next_id = blog_data.users.page(
+            after, limit, lambda user: blog_data.owns(user.id))
+
+        users = map(shaped(USER_FIELDS), users)
+        return json_response(encode_list(users), 200, page_headers(next_id))
 
     def post(self):
         data = request.get_json()
@@ -35,6 +306,8 @@ class UsersResource(Resource):
         # create a new user
         new_user = blog_data.add_user(
             data['name'], data['about'], data['profileImage'])
+        entries = [('add_user', data['name'], data['about'],
+                    data['profileImage'])]
 
         # socialMedia is optional when creating a new user
         if data.get('socialMedia'):
@@ -43,6 +316,11 @@ class UsersResource(Resource):
                     social['network'],
                     social['url'],
                     social['icon'])
+                entries.append(('add_social', new_user.id, social['network'],
+                                social['url'], social['icon']))
+
+        # one fsync for the user and all their social medias
+        journal.record_many(entries)
 
         return new_user.create_dict(), 201
 
@@ -51,19 +329,23 @@ api.add_resource(UsersResource, api_url + 'users')
 
 
 class SingleUserResource(Resource):
+    # deleting a user also deletes their likes and comments elsewhere
+    method_decorators = dict(subtree_locks, put=[writes_user],
+                             patch=[writes_user], delete=[writes_all])
+
     def get(self, user_id):
         user = blog_data.find_user(user_id)
 
         if not user:
             return None, 404
 
-        return user.create_dict(), 200
+        return embedded(user, USER_RELATIONS), 200
 
     def put(self, user_id):
         # verify ALL inputs
         data = request.get_json()
 
-        if not blog_data.verify_json(data, is_update=True):
+        if not blog_data.verify_json(data):
             return None, 400
 
         user = blog_data.update_user(
@@ -72,13 +354,24 @@ class SingleUserResource(Resource):
             data['about'],
             data['profileImage'])
 
+        if not user:
+            return None, 404
+
+        entries = [('update_user', user_id, data['name'], data['about'],
+                    data['profileImage'])]
+
         if data.get('socialMedia'):
             for social in data['socialMedia']:
-                user.update_social(
-                    social['id'],
-                    social['network'],
-                    social['url'],
-                    social['icon'])
+                if user.update_social(
+                        social['id'],
+                        social['network'],
+                        social['url'],
+                        social['icon']):
+                    entries.append(('update_social', user_id, social['id'],
+                                    social['network'], social['url'],
+                                    social['icon']))
+
+        journal.record_many(entries)
 
         return user.create_dict(), 200
 
@@ -91,19 +384,30 @@ class SingleUserResource(Resource):
             data.get('about'),
             data.get('profileImage'))
 
+        if not user:
+            return None, 404
+
+        entries = [('update_user', user_id, data.get('name'),
+                    data.get('about'), data.get('profileImage'))]
+
         if data.get('socialMedia'):
             for social in data['socialMedia']:
-                if social.get('id') is not None:
-                    user.update_social(
+                if social.get('id') is not None and user.update_social(
                         social['id'],
                         social.get('network'),
                         social.get('url'),
-                        social.get('icon'))
+                        social.get('icon')):
+                    entries.append(('update_social', user_id, social['id'],
+                                    social.get('network'), social.get('url'),
+                                    social.get('icon')))
+
+        journal.record_many(entries)
 
         return user.create_dict(), 200
 
     def delete(self, user_id):
         if blog_data.delete_user(user_id):
+            journal.record('delete_user', user_id)
             return None, 204
         return None, 404
 
@@ -112,41 +416,37 @@ api.add_resource(SingleUserResource, api_url + 'users/<int:user_id>')
 
 
 class PostsResource(Resource):
+    method_decorators = subtree_locks
+
     def get(self, user_id):
         user = blog_data.find_user(user_id)
 
         if not user:
             return None, 404
 
-        posts = user.posts
-
-        # allow for searching by post title in query params
-        if request.args.get('title'):
-            posts = filter(lambda post: post.title == request.args['title'],
-                           posts)
-
-        # support pagination
-        if request.args.get('lastPostID'):
-            last_post_index = None
+        try:
+            after, limit = page_args(request.args)
 
-            # find the post right after the last one sent
-            for i in range(len(posts)):
-                if int(request.args['lastPostID']) == posts[i].id:
-                    last_post_index = i + 1
-                    break
+            # lastPostID and numPosts are the original way of paging
+            if request.args.get('lastPostID'):
+                after = int(request.args['lastPostID'])
+            if request.args.get('numPosts'):
+                limit = parse_limit(request.args['numPosts'])
+        except ValueError:
+            return None, 400
 
-            # check if there are any posts left to send
-            if last_post_index == None or last_post_index == len(posts):
-                return None, 400
+        # allow for searching by post title in query params
+        title = request.args.get('title')
+        where = (lambda post: post.title == title) if title else None
 
-            posts = posts[last_post_index:]
+        posts, next_id = user.posts.page(after, limit, where)
 
-        # support user requesting only a certain number of pages
-        if request.args.get('numPosts'):
-            posts = posts[:int(request.args.get('numPosts'))]
+        # there has to be something left to send after lastPostID
+        if request.args.get('lastPostID') and not posts:
+            return None, 400
 
-        posts = map(lambda post: post.create_dict(), posts)
-        return make_response(jsonify(list(posts)), 200)
+        posts = map(shaped(POST_FIELDS, relations=POST_RELATIONS), posts)
+        return json_response(encode_list(posts), 200, page_headers(next_id))
 
     def post(self, user_id):
         data = request.get_json()
@@ -160,6 +460,8 @@ class PostsResource(Resource):
             return None, 404
 
         new_post = author.add_post(data['content'], data['title'])
+        journal.record('add_post', user_id, data['content'], data['title'],
+                       new_post.date_posted)
 
         return new_post.create_dict(), 201
 
@@ -167,7 +469,213 @@ class PostsResource(Resource):
 api.add_resource(PostsResource, api_url + 'users/<int:user_id>/posts')
 
 
+class BulkPostsResource(Resource):
+    method_decorators = bulk_writes
+
+    def post(self, user_id, batch):
+        author = blog_data.find_user(user_id)
+
+        if not author:
+            return None, 404
+
+        results = bulk.rejected(
+            batch, lambda data: 'content and title are required'
+            if blog_data.is_invalid_post(data) else None)
+
+        if results:
+            return bulk_rejected(results)
+
+        posts = [author.add_post(data['content'], data['title'])
+                 for data in batch]
+        journal.record_many(
+            ('add_post', user_id, post.content, post.title, post.date_posted)
+            for post in posts)
+
+        return bulk_created(posts, POST_FIELDS)
+
+
+api.add_resource(BulkPostsResource, api_url + 'users/<int:user_id>/posts/bulk')
+
+
+class LikedPostsResource(Resource):
+    method_decorators = index_reads(user_activity)
+
+    def get(self, user_id):
+        # every user's posts this user liked, in the order they liked them
+        if not blog_data.find_user(user_id):
+            return None, 404
+
+        # the cursor is how many posts have been sent so far
+        try:
+            offset, limit = page_args(request.args)
+        except ValueError:
+            return None, 400
+
+        offset = offset or 0
+        posts = user_activity.posts_liked_by(user_id)
+
+        end = offset + limit if limit else len(posts)
+        next_offset = end if end < len(posts) else None
+
+        posts = map(shaped(POST_FIELDS), posts[offset:end])
+        return json_response(encode_list(posts), 200,
+                             page_headers(next_offset))
+
+
+api.add_resource(LikedPostsResource, api_url + 'users/<int:user_id>/liked')
+
+
+class SearchResource(Resource):
+    method_decorators = index_reads(search_index)
+
+    def get(self):
+        # searches every user's posts, best matches first
+        query = request.args.get('q')
+
+        if not query:
+            return None, 400
+
+        # the cursor is how many results have been sent so far
+        try:
+            offset, limit = page_args(request.args)
+        except ValueError:
+            return None, 400
+
+        offset = offset or 0
+        limit = limit or 20
+
+        # one extra result says whether there's another page
+        posts = search_index.search(query, offset, limit + 1)
+        next_offset = offset + limit if len(posts) > limit else None
+
+        posts = map(shaped(POST_FIELDS), posts[:limit])
+        return json_response(encode_list(posts), 200,
+                             page_headers(next_offset))
+
+
+api.add_resource(SearchResource, api_url + 'posts/search')
+
+
+class TimelineResource(Resource):
+    method_decorators = index_reads(timeline)
+
+    def get(self):
+        # the newest posts from every user, newest first
+        try:
+            before, limit = page_args(request.args, size=3)
+        except ValueError:
+            return None, 400
+
+        try:
+            posts, next_key = timeline.latest(limit or 20, before)
+        except PastTimeline as e:
+            return {'message': str(e)}, 400
+
+        posts = map(shaped(POST_FIELDS), posts)
+        return json_response(encode_list(posts), 200, page_headers(next_key))
+
+
+api.add_resource(TimelineResource, api_url + 'timeline')
+
+
+class TimelineKeysResource(Resource):
+    # only called by router.py, which merges every shard's timeline on
+    # the keys, the dates in the posts are local time
+    method_decorators = index_reads(timeline)
+
+    def get(self):
+        try:
+            before, limit = page_args(request.args, size=3)
+        except ValueError:
+            return None, 400
+
+        try:
+            posts, next_key = timeline.latest(limit or 20, before)
+        except PastTimeline as e:
+            return {'message': str(e)}, 400
+
+        entries = (b'{"key":' + dumps(post_key(post)) +
+                   b',"post":' + post.create_json() + b'}' for post in posts)
+        return json_response(encode_list(entries), 200,
+                             page_headers(next_key))
+
+
+api.add_resource(TimelineKeysResource, api_url + 'internal/timeline')
+
+
+def leaderboard_limit():
+    # how many of the top posts or comments to send, ValueError if bad
+    limit = int(request.args.get('limit', 10))
+
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, 1000)
+
+
+# a comment's dict doesn't say which post it's on, so each entry does
+TOP_COMMENT_FIELDS = {
+    'comment': Nested(lambda comment: comment, COMMENT_FIELDS,
+                      lambda comment: comment.create_dict()),
+    'postID': lambda comment: comment.post.id,
+    'userID': lambda comment: comment.post.user.id,
+}
+
+
+def top_comment_json(comment):
+    return (b'{"comment":' + comment.create_json() +
+            b',"postID":' + str(comment.post.id).encode() +
+            b',"userID":' + str(comment.post.user.id).encode() + b'}')
+
+
+class TopPostsResource(Resource):
+    method_decorators = index_reads(leaderboards)
+
+    def get(self, user_id=None):
+        # the most liked posts, overall or by one user
+        if user_id is not None and not blog_data.find_user(user_id):
+            return None, 404
+
+        try:
+            limit = leaderboard_limit()
+        except ValueError:
+            return None, 400
+
+        posts = leaderboards.top_posts(limit, user_id)
+
+        posts = map(shaped(POST_FIELDS), posts)
+        return json_response(encode_list(posts), 200)
+
+
+api.add_resource(TopPostsResource, api_url + 'leaderboard/posts',
+                 api_url + 'users/<int:user_id>/leaderboard/posts')
+
+
+class TopCommentsResource(Resource):
+    method_decorators = index_reads(leaderboards)
+
+    def get(self, user_id=None):
+        # the most liked comments, overall or by one user
+        if user_id is not None and not blog_data.find_user(user_id):
+            return None, 404
+
+        try:
+            limit = leaderboard_limit()
+        except ValueError:
+            return None, 400
+
+        comments = leaderboards.top_comments(limit, user_id)
+        comments = map(shaped(TOP_COMMENT_FIELDS, top_comment_json),
+                       comments)
+        return json_response(encode_list(comments), 200)
+
+
+api.add_resource(TopCommentsResource, api_url + 'leaderboard/comments',
+                 api_url + 'users/<int:user_id>/leaderboard/comments')
+
+
 class SinglePostResource(Resource):
+    method_decorators = subtree_locks
+
     def get(self, user_id, post_id):
 
         post = blog_data.find_post(user_id, post_id)
@@ -175,7 +683,7 @@ class SinglePostResource(Resource):
         if not post:
             return None, 404
 
-        return post.create_dict(), 200
+        return embedded(post, POST_RELATIONS), 200
 
     def put(self, user_id, post_id):
         data = request.get_json()
@@ -196,6 +704,9 @@ class SinglePostResource(Resource):
         if not post:
             return None, 404
 
+        journal.record('update_post', user_id, post_id, data['title'],
+                       data['content'])
+
         return post.create_dict(), 201
 
     def patch(self, user_id, post_id):
@@ -211,6 +722,12 @@ class SinglePostResource(Resource):
             content=data.get('content'),
             title=data.get('title'))
 
+        if not post:
+            return None, 404
+
+        journal.record('update_post', user_id, post_id, data.get('title'),
+                       data.get('content'))
+
         return post.create_dict(), 201
 
     def delete(self, user_id, post_id):
@@ -220,6 +737,7 @@ class SinglePostResource(Resource):
             return None, 404
 
         if user.delete_post(post_id):
+            journal.record('delete_post', user_id, post_id)
             return None, 204
         return None, 404
 
@@ -229,14 +747,23 @@ api.add_resource(SinglePostResource, api_url +
 
 
 class PostLikesResource(Resource):
+    method_decorators = subtree_locks
+
     def get(self, user_id, post_id):
         post = blog_data.find_post(user_id, post_id)
 
         if not post:
             return None, 404
 
-        likes = map(lambda like: like.create_dict(), post.likes)
-        return make_response(jsonify(list(likes)), 200)
+        try:
+            after, limit = page_args(request.args, size=2)
+        except ValueError:
+            return None, 400
+
+        likes, next_key = post.likes.page(after, limit)
+
+        likes = map(shaped(LIKE_FIELDS), likes)
+        return json_response(encode_list(likes), 200, page_headers(next_key))
 
     def post(self, user_id, post_id):
         data = request.get_json()
@@ -259,6 +786,9 @@ class PostLikesResource(Resource):
         if not new_like:
             return None, 400
 
+        journal.record('add_like', user_id, post_id, None, like_user.id,
+                       new_like.date_posted)
+
         return new_like.create_dict(), 201
 
 
@@ -266,7 +796,36 @@ api.add_resource(PostLikesResource, api_url +
                  'users/<int:user_id>/posts/<int:post_id>/likes')
 
 
+class BulkPostLikesResource(Resource):
+    method_decorators = bulk_writes
+
+    def post(self, user_id, post_id, batch):
+        post = blog_data.find_post(user_id, post_id)
+
+        if not post:
+            return None, 404
+
+        results = bulk.rejected(batch, checks_likes(post))
+
+        if results:
+            return bulk_rejected(results)
+
+        likes = [post.add_like(blog_data.find_user(data['userID']))
+                 for data in batch]
+        journal.record_many(
+            ('add_like', user_id, post_id, None, like.user.id,
+             like.date_posted) for like in likes)
+
+        return bulk_created(likes, LIKE_FIELDS)
+
+
+api.add_resource(BulkPostLikesResource, api_url +
+                 'users/<int:user_id>/posts/<int:post_id>/likes/bulk')
+
+
 class SinglePostLikeResource(Resource):
+    method_decorators = subtree_locks
+
     def get(self, user_id, post_id, like_user_id):
         post = blog_data.find_post(user_id, post_id)
 
@@ -287,6 +846,8 @@ class SinglePostLikeResource(Resource):
             return "Blog post not found", 404
 
         if post.delete_like(like_user_id):
+            journal.record('delete_like', user_id, post_id, None,
+                           like_user_id)
             return None, 204
         return None, 404
 
@@ -298,15 +859,25 @@ api.add_resource(
 
 
 class CommentsResource(Resource):
+    method_decorators = subtree_locks
+
     def get(self, user_id, post_id):
         post = blog_data.find_post(user_id, post_id)
 
         if not post:
             return None, 404
 
-        comments = map(lambda comment: comment.create_dict(), post.comments)
+        try:
+            after, limit = page_args(request.args)
+        except ValueError:
+            return None, 400
 
-        return make_response(jsonify(list(comments)), 200)
+        comments, next_id = post.comments.page(after, limit)
+
+        comments = map(shaped(COMMENT_FIELDS, relations=COMMENT_RELATIONS),
+                       comments)
+        return json_response(encode_list(comments), 200,
+                             page_headers(next_id))
 
     def post(self, user_id, post_id):
         data = request.get_json()
@@ -325,6 +896,8 @@ class CommentsResource(Resource):
             return None, 400
 
         new_comment = post.add_comment(comment_author, data['content'])
+        journal.record('add_comment', user_id, post_id, comment_author.id,
+                       data['content'], new_comment.date_posted)
 
         return new_comment.create_dict(), 201
 
@@ -333,14 +906,51 @@ api.add_resource(CommentsResource, api_url +
                  'users/<int:user_id>/posts/<int:post_id>/comments')
 
 
+def check_comment(data):
+    if 'content' not in data or 'userID' not in data:
+        return 'content and userID are required'
+    if not blog_data.find_user(data['userID']):
+        return 'user {} not found'.format(data['userID'])
+
+
+class BulkCommentsResource(Resource):
+    method_decorators = bulk_writes
+
+    def post(self, user_id, post_id, batch):
+        post = blog_data.find_post(user_id, post_id)
+
+        if not post:
+            return None, 404
+
+        results = bulk.rejected(batch, check_comment)
+
+        if results:
+            return bulk_rejected(results)
+
+        comments = [post.add_comment(blog_data.find_user(data['userID']),
+                                     data['content'])
+                    for data in batch]
+        journal.record_many(
+            ('add_comment', user_id, post_id, comment.user.id,
+             comment.content, comment.date_posted) for comment in comments)
+
+        return bulk_created(comments, COMMENT_FIELDS)
+
+
+api.add_resource(BulkCommentsResource, api_url +
+                 'users/<int:user_id>/posts/<int:post_id>/comments/bulk')
+
+
 class SingleCommentResource(Resource):
+    method_decorators = subtree_locks
+
     def get(self, user_id, post_id, comment_id):
         comment = blog_data.find_comment(user_id, post_id, comment_id)
 
         if not comment:
             return None, 404
 
-        return comment.create_dict(), 200
+        return embedded(comment, COMMENT_RELATIONS), 200
 
     def put(self, user_id, post_id, comment_id):
         data = request.get_json()
@@ -353,7 +963,9 @@ class SingleCommentResource(Resource):
         if not comment:
             return None, 404
 
-        comment.content = data['content']
+        comment.update_comment(data['content'])
+        journal.record('update_comment', user_id, post_id, comment_id,
+                       data['content'])
         return comment.create_dict(), 200
 
     def patch(self, user_id, post_id, comment_id):
@@ -365,7 +977,9 @@ class SingleCommentResource(Resource):
             return None, 404
 
         if data.get('comment') is not None:
-            comment.content = data['content']
+            comment.update_comment(data['content'])
+            journal.record('update_comment', user_id, post_id, comment_id,
+                           data['content'])
 
         return comment.create_dict(), 200
 
@@ -376,6 +990,7 @@ class SingleCommentResource(Resource):
             return None, 404
 
         if post.delete_comment(comment_id):
+            journal.record('delete_comment', user_id, post_id, comment_id)
             return None, 204
         return None, 404
 
@@ -387,15 +1002,23 @@ api.add_resource(
 
 
 class CommentLikesResource(Resource):
+    method_decorators = subtree_locks
+
     def get(self, user_id, post_id, comment_id):
         comment = blog_data.find_comment(user_id, post_id, comment_id)
 
         if not comment:
             return None, 404
 
-        likes = map(lambda like: like.create_dict(), comment.likes)
+        try:
+            after, limit = page_args(request.args, size=2)
+        except ValueError:
+            return None, 400
+
+        likes, next_key = comment.likes.page(after, limit)
 
-        return make_response(jsonify(list(likes)), 200)
+        likes = map(shaped(LIKE_FIELDS), likes)
+        return json_response(encode_list(likes), 200, page_headers(next_key))
 
     def post(self, user_id, post_id, comment_id):
         data = request.get_json()
@@ -415,6 +1038,12 @@ class CommentLikesResource(Resource):
 
         new_like = comment.add_like(like_author)
 
+        if not new_like:
+            return None, 400
+
+        journal.record('add_like', user_id, post_id, comment_id,
+                       like_author.id, new_like.date_posted)
+
         return new_like.create_dict(), 201
 
 
@@ -424,7 +1053,38 @@ api.add_resource(
     'users/<int:user_id>/posts/<int:post_id>/comments/<int:comment_id>/likes')
 
 
+class BulkCommentLikesResource(Resource):
+    method_decorators = bulk_writes
+
+    def post(self, user_id, post_id, comment_id, batch):
+        comment = blog_data.find_comment(user_id, post_id, comment_id)
+
+        if not comment:
+            return None, 404
+
+        results = bulk.rejected(batch, checks_likes(comment))
+
+        if results:
+            return bulk_rejected(results)
+
+        likes = [comment.add_like(blog_data.find_user(data['userID']))
+                 for data in batch]
+        journal.record_many(
+            ('add_like', user_id, post_id, comment_id, like.user.id,
+             like.date_posted) for like in likes)
+
+        return bulk_created(likes, LIKE_FIELDS)
+
+
+api.add_resource(
+    BulkCommentLikesResource,
+    api_url +
+    'users/<int:user_id>/posts/<int:post_id>/comments/<int:comment_id>/likes/bulk')
+
+
 class SingleCommentLikeResource(Resource):
+    method_decorators = subtree_locks
+
     def get(self, user_id, post_id, comment_id, like_user_id):
         comment = blog_data.find_comment(user_id, post_id, comment_id)
 
@@ -445,6 +1105,8 @@ class SingleCommentLikeResource(Resource):
             return None, 404
 
         if comment.delete_like(like_user_id):
+            journal.record('delete_like', user_id, post_id, comment_id,
+                           like_user_id)
             return None, 204
         return None, 404
 
@@ -455,4 +1117,39 @@ api.add_resource(
     'users/<int:user_id>/posts/<int:post_id>/comments/<int:comment_id>/likes/<int:like_user_id>')
 
 
-app.run(debug=True)
+class ReplicaResource(Resource):
+    # only called by router.py, to copy users between shards
+    method_decorators = {'put': [writes_all], 'delete': [writes_all]}
+
+    def put(self, user_id):
+        if blog_data.num_shards == 1:
+            return None, 404
+
+        data = request.get_json()
+
+        blog_data.put_replica(user_id, data['name'], data['about'],
+                              data['profileImage'])
+        journal.record('put_replica', user_id, data['name'], data['about'],
+                       data['profileImage'])
+        return None, 204
+
+    def delete(self, user_id):
+        if blog_data.num_shards == 1:
+            return None, 404
+
+        # takes the user's likes and comments on this shard with them
+        if blog_data.delete_user(user_id):
+            journal.record('delete_user', user_id)
+        return None, 204
+
+
+api.add_resource(ReplicaResource, api_url + 'internal/replicas/<int:user_id>')
+
+
+if __name__ == '__main__':
+    config = config_from_env(BLOG_LOAD='background')
+    port = int(os.environ.get('BLOG_PORT', 5000))
+
+    # the reloader would start a second copy of every shard
+    create_app(config).run(debug=config['BLOG_SHARDS'] == 1, port=port,
+                           threaded=True)
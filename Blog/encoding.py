@@ -0,0 +1,35 @@
+from flask import Response
+
+from shared.encoding import dumps, loads, output_json  # noqa: F401
+
+'''
+Response encoding for the API
+
+Everything the API sends goes through dumps (see shared/encoding.py),
+which uses orjson when it's installed and the standard library
+otherwise.
+
+Models also hand out already encoded JSON (see create_json in
+models.py) that list endpoints splice together with encode_list
+instead of encoding every object again on every request.
+'''
+
+
+def encode_list(fragments):
+    # fragments are already encoded JSON values
+    return b'[' + b','.join(fragments) + b']'
+
+
+def with_user(info, user_json):
+    # encodes info with the encoded user dict spliced in under 'user'
+    # 'user' sorts after every other key of the dicts it's used for
+    encoded = dumps(info)
+
+    if encoded == b'{}':
+        return b'{"user":' + user_json + b'}'
+    return encoded[:-1] + b',"user":' + user_json + b'}'
+
+
+def json_response(body, status=200, headers=None):
+    return Response(body + b'\n', status=status, headers=headers,
+                    mimetype='application/json')
@@ -0,0 +1,331 @@
+import json
+import os
+import threading
+
+from snapshot import load_snapshot, write_snapshot
+
+'''
+Durable storage for the blog
+
+Every change the API makes to blog_data is also appended to a journal
+file as one JSON line: [seq, op, args...]. On startup the latest
+snapshot is loaded and then any journal entries newer than it are
+replayed, which rebuilds exactly the state the last process had.
+
+Writes use group commit. The first writer to need its entry on disk
+writes every pending entry and fsyncs once, writers that arrive while
+that is happening just wait for the next batch. Under load one fsync
+covers many requests instead of one each.
+
+Every compact_every entries the whole store is written out as a new
+binary snapshot (see snapshot.py) and the journal is truncated, so
+replay time stays bounded. The snapshot has to match the journal
+exactly, so it's written from a background thread that first locks the
+whole store (see shared/locking.py), the writer that finds it due is
+holding a lock on its own subtree and can't wait for that itself.
+'''
+
+
+class Journal:
+
+    def __init__(self, blog, path, snapshot_path, compact_every=10000):
+        self.blog = blog
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.compact_every = compact_every
+
+        self.lock = threading.Lock()
+        self.flushed = threading.Condition(self.lock)
+        self.pending = []
+        self.flushing = False
+        self.compacting = False
+        self.file = None
+
+        # seq of the last entry handed out, and the last one on disk
+        self.seq = 0
+        self.durable_seq = 0
+        self.snapshot_seq = 0
+
+        # when False record returns straight away and the caller has
+        # to wait_durable before acknowledging the change, which is
+        # how serve_async.py keeps the disk off the event loop. It
+        # finds what to wait for with take_recorded
+        self.wait_for_disk = True
+        self.recorded = threading.local()
+
+        # why a flush failed, after which nothing more is acknowledged
+        self.error = None
+
+    def recover(self):
+        '''
+        Rebuilds blog from the snapshot and journal
+
+        Returns False if neither exists, i.e. this is a fresh store
+        '''
+        found = False
+
+        if os.path.exists(self.snapshot_path):
+            self.snapshot_seq = load_snapshot(self.blog, self.snapshot_path)
+            found = True
+
+        self.seq = self.snapshot_seq
+
+        if os.path.exists(self.path):
+            end = 0
+
+            for seq, op, args, end in self.read_entries():
+                # entries up to the snapshot are already in it
+                if seq <= self.snapshot_seq:
+                    continue
+                REPLAY[op](self.blog, *args)
+                self.seq = seq
+
+            # new entries go after the last whole one, not glued onto
+            # a torn one where the next replay would stop
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+            found = True
+
+        self.durable_seq = self.seq
+        self.file = open(self.path, 'a')
+        return found
+
+    def read_entries(self):
+        # (seq, op, args, offset just past the entry) for each entry
+        end = 0
+
+        with open(self.path, 'rb') as f:
+            for line in f:
+                # a torn write from a crash can only be the last line,
+                # and it was never acknowledged
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+
+                end += len(line)
+                yield entry[0], entry[1], entry[2:], end
+
+    def record(self, op, *args):
+        '''
+        Appends an entry and returns once it is on disk
+        '''
+        return self.record_many([(op,) + args])
+
+    def record_many(self, entries):
+        '''
+        Appends (op, args...) entries and returns once they're all on
+        disk, in the same batch so they cost one fsync between them
+        '''
+        with self.lock:
+            for entry in entries:
+                self.seq += 1
+                self.pending.append(json.dumps([self.seq] + list(entry)) +
+                                    '\n')
+            seq = self.seq
+            self.recorded.seq = seq
+
+            if self.wait_for_disk:
+                self._wait_durable(seq)
+
+            if (self.seq - self.snapshot_seq >= self.compact_every and
+                    not self.compacting):
+                self.compacting = True
+                threading.Thread(target=self.compact, daemon=True).start()
+
+        return seq
+
+    def take_recorded(self):
+        # the seq of the last entries this thread recorded since it
+        # last asked, None if it hasn't recorded any
+        seq = getattr(self.recorded, 'seq', None)
+        self.recorded.seq = None
+        return seq
+
+    def wait_durable(self, seq):
+        # returns once every entry up to seq is on disk
+        with self.lock:
+            self._wait_durable(seq)
+
+    def _wait_durable(self, seq):
+        while self.durable_seq < seq:
+            if self.error is not None:
+                raise OSError('the journal write failed') from self.error
+            if self.flushing:
+                # someone else is writing, our entry goes next batch
+                self.flushed.wait()
+                continue
+
+            self._flush()
+
+    def compact(self):
+        # nothing can change the store while it's locked, so the
+        # snapshot matches the last entry recorded
+        try:
+            with self.blog.locks.writing():
+                self.snapshot()
+        finally:
+            with self.lock:
+                self.compacting = False
+
+    def _flush(self):
+        '''
+        Called with the lock held, releases it around the disk write so
+        other writers can queue up behind this batch
+
+        If the write fails there's no telling how much of the batch
+        reached the file, so its entries and every later one are
+        never reported durable, their writers get the error instead.
+        Recovery drops a torn last line on the next start.
+        '''
+        if self.error is not None:
+            raise OSError('the journal write failed') from self.error
+
+        batch = self.pending
+        last_seq = self.seq
+        self.pending = []
+        self.flushing = True
+        error = None
+
+        self.lock.release()
+        try:
+            self.file.write(''.join(batch))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except Exception as e:
+            error = e
+        finally:
+            self.lock.acquire()
+            self.flushing = False
+
+            if error is None:
+                self.durable_seq = last_seq
+            else:
+                self.error = error
+            self.flushed.notify_all()
+
+        if error is not None:
+            raise OSError('the journal write failed') from error
+
+    def snapshot(self):
+        # can't swap journal files under another writer's batch
+        with self.lock:
+            while self.flushing:
+                self.flushed.wait()
+            if self.pending:
+                self._flush()
+            self._compact()
+
+    def _compact(self):
+        write_snapshot(self.blog, self.snapshot_path, self.seq)
+        self.snapshot_seq = self.seq
+
+        # if we crash before this the old entries are skipped on replay
+        self.file.close()
+        self.file = open(self.path, 'w')
+
+    def close(self):
+        with self.lock:
+            while self.flushing:
+                self.flushed.wait()
+            if self.pending and self.error is None:
+                self._flush()
+            self.file.close()
+
+
+'''
+Replay functions, one per journal op
+
+Each one repeats the change the API made. IDs are handed out by
+counters, so replaying in order gives every object the same id it
+had originally. Timestamps are recorded with the entry and restored.
+'''
+
+
+def find_text(blog, user_id, post_id, comment_id):
+    if comment_id is None:
+        return blog.find_post(user_id, post_id)
+    return blog.find_comment(user_id, post_id, comment_id)
+
+
+def replay_add_user(blog, name, about, profile_image):
+    blog.add_user(name, about, profile_image)
+
+
+def replay_update_user(blog, user_id, name, about, profile_image):
+    blog.update_user(user_id, name, about, profile_image)
+
+
+def replay_delete_user(blog, user_id):
+    blog.delete_user(user_id)
+
+
+def replay_put_replica(blog, user_id, name, about, profile_image):
+    blog.put_replica(user_id, name, about, profile_image)
+
+
+def replay_add_social(blog, user_id, network, url, icon):
+    blog.find_user(user_id).add_social(network, url, icon)
+
+
+def replay_update_social(blog, user_id, social_id, network, url, icon):
+    blog.find_user(user_id).update_social(social_id, network, url, icon)
+
+
+def replay_add_post(blog, user_id, content, title, date_posted):
+    post = blog.find_user(user_id).add_post(content, title)
+    post.date_posted = date_posted
+
+
+def replay_update_post(blog, user_id, post_id, title, content):
+    blog.find_user(user_id).update_post(post_id, title=title,
+                                        content=content)
+
+
+def replay_delete_post(blog, user_id, post_id):
+    blog.find_user(user_id).delete_post(post_id)
+
+
+def replay_add_comment(blog, user_id, post_id, author_id, content,
+                       date_posted):
+    post = blog.find_post(user_id, post_id)
+    comment = post.add_comment(blog.find_user(author_id), content)
+    comment.date_posted = date_posted
+
+
+def replay_update_comment(blog, user_id, post_id, comment_id, content):
+    blog.find_comment(user_id, post_id, comment_id).update_comment(content)
+
+
+def replay_delete_comment(blog, user_id, post_id, comment_id):
+    blog.find_post(user_id, post_id).delete_comment(comment_id)
+
+
+def replay_add_like(blog, user_id, post_id, comment_id, like_user_id,
+                    date_posted):
+    text = find_text(blog, user_id, post_id, comment_id)
+    text.add_like(blog.find_user(like_user_id), date_posted)
+
+
+def replay_delete_like(blog, user_id, post_id, comment_id, like_user_id):
+    find_text(blog, user_id, post_id, comment_id).delete_like(like_user_id)
+
+
+REPLAY = {
+    'add_user': replay_add_user,
+    'update_user': replay_update_user,
+    'delete_user': replay_delete_user,
+    'put_replica': replay_put_replica,
+    'add_social': replay_add_social,
+    'update_social': replay_update_social,
+    'add_post': replay_add_post,
+    'update_post': replay_update_post,
+    'delete_post': replay_delete_post,
+    'add_comment': replay_add_comment,
+    'update_comment': replay_update_comment,
+    'delete_comment': replay_delete_comment,
+    'add_like': replay_add_like,
+    'delete_like': replay_delete_like,
+}
@@ -0,0 +1,167 @@
+from bisect import bisect_left, insort
+
+from models import Comment
+
+'''
+Most liked posts and comments
+
+A Leaderboard keeps its items in buckets by like count, plus a sorted
+list of the counts that have a bucket. A like only moves its post or
+comment to the next bucket up (or down), so it costs a couple of dict
+operations and a binary search, and reading the top K just walks the
+buckets from the top, O(K) however many items there are.
+
+Likes keeps a global board for posts and one for comments, plus the
+same pair for every user over what they wrote. The boards are built
+from the store the first time they're read and kept up to date after
+that through its like_added, like_deleted, post_deleted,
+comment_deleted and user_deleted notifications.
+'''
+
+
+class Leaderboard:
+
+    def __init__(self):
+        self.counts = {}
+        self.buckets = {}
+        self.sorted_counts = []
+
+    def set(self, item, count):
+        old_count = self.counts.get(item, 0)
+
+        if old_count == count:
+            return
+
+        if old_count:
+            bucket = self.buckets[old_count]
+            del bucket[item]
+
+            if not bucket:
+                del self.buckets[old_count]
+                del self.sorted_counts[bisect_left(self.sorted_counts,
+                                                   old_count)]
+
+        # items without likes aren't on the board
+        if not count:
+            self.counts.pop(item, None)
+            return
+
+        self.counts[item] = count
+
+        if count not in self.buckets:
+            self.buckets[count] = {}
+            insort(self.sorted_counts, count)
+        self.buckets[count][item] = None
+
+    def remove(self, item):
+        self.set(item, 0)
+
+    def top(self, k):
+        # within a count, whatever got there first ranks higher
+        items = []
+
+        for count in reversed(self.sorted_counts):
+            for item in self.buckets[count]:
+                if len(items) == k:
+                    return items
+                items.append(item)
+
+        return items
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class LikesLeaderboards:
+
+    def __init__(self, blog):
+        self.blog = blog
+        self.built = False
+
+        self.posts = Leaderboard()
+        self.comments = Leaderboard()
+
+        # user id -> (posts board, comments board) over what they wrote
+        self.by_user = {}
+
+        blog.add_observer(self)
+
+    def build(self):
+        self.built = True
+
+        for user in self.blog.users:
+            for post in user.posts:
+                self.likes_changed(post)
+
+                for comment in post.comments:
+                    self.likes_changed(comment)
+
+    def user_boards(self, user_id):
+        if user_id not in self.by_user:
+            self.by_user[user_id] = (Leaderboard(), Leaderboard())
+        return self.by_user[user_id]
+
+    def boards(self, text):
+        user_posts, user_comments = self.user_boards(text.user.id)
+
+        if isinstance(text, Comment):
+            return self.comments, user_comments
+        return self.posts, user_posts
+
+    def likes_changed(self, text):
+        count = len(text.likes)
+        for board in self.boards(text):
+            board.set(text, count)
+
+    def like_added(self, text, user):
+        if self.built:
+            self.likes_changed(text)
+
+    def like_deleted(self, text, user_id):
+        if self.built:
+            self.likes_changed(text)
+
+    def remove(self, text):
+        for board in self.boards(text):
+            board.remove(text)
+
+    def post_deleted(self, post):
+        if not self.built:
+            return
+
+        self.remove(post)
+        for comment in post.comments:
+            self.remove(comment)
+
+    def comment_deleted(self, comment):
+        if self.built:
+            self.remove(comment)
+
+    def user_deleted(self, user):
+        if not self.built:
+            return
+
+        # their comments elsewhere were already deleted one by one
+        for post in user.posts:
+            self.post_deleted(post)
+
+        self.by_user.pop(user.id, None)
+
+    def top_posts(self, k, user_id=None):
+        return self.top(0, k, user_id)
+
+    def top_comments(self, k, user_id=None):
+        return self.top(1, k, user_id)
+
+    def top(self, which, k, user_id):
+        if not self.built:
+            self.build()
+
+        if user_id is None:
+            board = (self.posts, self.comments)[which]
+        elif user_id in self.by_user:
+            board = self.by_user[user_id][which]
+        else:
+            return []
+
+        return board.top(k)
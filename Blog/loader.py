@@ -0,0 +1,161 @@
+import json
+import os
+import time
+
+'''
+Streaming reader for the users.json and posts.json exports
+
+json.load reads the whole file and builds every object before the
+first one can be used, so a big export needs several times its size
+in memory. iter_json_array reads the file in chunks and yields the
+elements of the top level array one at a time, so only the element
+being decoded (and one chunk of text) is held at once.
+
+An element longer than a chunk is decoded again each time more of it
+is read, so the buffer at least doubles on every read, keeping that
+linear in the element's size.
+'''
+
+CHUNK_SIZE = 1 << 16
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+_delimiters = _whitespace + ',]'
+
+# the longest literal a decode error can point into, when it's cut off
+# by the end of the buffer, like -Infinity or a \uXXXX escape
+_longest_literal = len('-Infinity')
+
+
+def _skip(buffer, pos, chars):
+    while pos < len(buffer) and buffer[pos] in chars:
+        pos += 1
+    return pos
+
+
+def _truncated(error, buffer):
+    # whether more text could make the element the error is in decode,
+    # a string runs to the end of the buffer when it's unterminated
+    return (error.pos + _longest_literal >= len(buffer) or
+            error.msg.startswith('Unterminated string'))
+
+
+def iter_json_array(f, chunk_size=CHUNK_SIZE):
+    '''
+    Yields each element of the JSON array in the file object f
+
+    Raises ValueError if the file isn't a JSON array
+    '''
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def fill(size=chunk_size):
+        nonlocal buffer, pos, eof
+        chunk = f.read(max(size, chunk_size))
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    # find the opening bracket
+    while True:
+        pos = _skip(buffer, pos, _whitespace)
+        if pos < len(buffer) or eof:
+            break
+        fill()
+
+    if pos == len(buffer) or buffer[pos] != '[':
+        raise ValueError('expected a JSON array')
+    pos += 1
+
+    expect_element = True
+    after_comma = False
+    while True:
+        pos = _skip(buffer, pos, _whitespace)
+
+        if pos == len(buffer):
+            if eof:
+                raise ValueError('unterminated JSON array')
+            fill()
+            continue
+
+        if buffer[pos] == ']':
+            if after_comma:
+                raise ValueError('expected an element after ,')
+            return
+
+        if not expect_element:
+            if buffer[pos] != ',':
+                raise ValueError('expected , between array elements')
+            pos += 1
+            expect_element = after_comma = True
+            continue
+
+        try:
+            element, end = _decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as error:
+            # the element runs past the end of the buffer, read more
+            if eof or not _truncated(error, buffer):
+                raise
+            fill(len(buffer) - pos)
+            continue
+
+        # a number cut off by the chunk boundary decodes "successfully",
+        # 1 from "1." or "1e+", a complete element is always followed
+        # by a delimiter
+        if not eof and (end == len(buffer) or
+                        (end + 2 >= len(buffer) and
+                         buffer[end] not in _delimiters)):
+            fill(len(buffer) - pos)
+            continue
+
+        pos = end
+        expect_element = after_comma = False
+        yield element
+
+
+class LoadProgress:
+    '''
+    Tracks how far through a file the loader is
+
+    callback is called with (filename, bytes_read, total_bytes,
+    elements_loaded) every report_every elements and once at the end
+    of each file. elapsed holds the total load time once loading
+    finishes.
+    '''
+
+    def __init__(self, callback=None, report_every=10000):
+        self.callback = callback
+        self.report_every = report_every
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.counts = {}
+
+    def iter_file(self, path):
+        total = os.path.getsize(path)
+        count = 0
+
+        with open(path) as f:
+            for element in iter_json_array(f):
+                yield element
+                count += 1
+
+                if self.callback and count % self.report_every == 0:
+                    self.callback(path, self._tell(f), total, count)
+
+        self.counts[path] = count
+        if self.callback:
+            self.callback(path, total, total, count)
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self.elapsed
+
+    def _tell(self, f):
+        # text files can't always report their position mid-read
+        try:
+            return f.buffer.tell()
+        except (AttributeError, OSError):
+            return 0
+
@@ -1,6 +1,18 @@
-import json
+import threading
+import time
+from array import array
 from datetime import datetime
+from operator import attrgetter
+from functools import lru_cache
 from abc import ABC, abstractmethod
+from bisect import bisect_right, insort
+from loader import LoadProgress
+from activity import UserActivity
+from shared.locking import StoreLocks
+from shared.metrics import counts_lookup
+from shared.fields import Nested
+from shared.expand import Relation
+from encoding import dumps, with_user
 
 '''
 A note on object IDs:
@@ -10,7 +22,328 @@ This is only done to make testing with Postman easy and quick
 '''
 
 def create_timestamp():
-    return datetime.now().isoformat()
+    # timestamps are stored as integer microseconds since the epoch
+    # and only turned into ISO strings when they're serialized
+    return time.time_ns() // 1000
+
+
+def format_timestamp(timestamp):
+    # the same string datetime.isoformat() gives, with the slow part
+    # cached since likes on a busy post share the same few seconds
+    seconds, microseconds = divmod(timestamp, 1000000)
+
+    if microseconds:
+        return '{}.{:06d}'.format(format_seconds(seconds), microseconds)
+    return format_seconds(seconds)
+
+
+@lru_cache(maxsize=4096)
+def format_seconds(seconds):
+    return datetime.fromtimestamp(seconds).isoformat()
+
+
+# held while a lazily loaded collection loads, so readers in other
+# threads wait for it instead of seeing it half loaded
+LOAD_LOCK = threading.RLock()
+
+
+class IndexedCollection:
+    '''
+    An ordered collection of objects indexed by id
+
+    Iterating yields the objects in insertion order, which is what the
+    listing endpoints return. Lookups and deletes go through the index
+    so they don't depend on how many objects are stored.
+
+    A collection read from a snapshot starts out unloaded, loader
+    decodes its objects the first time they're needed. length is
+    how many it will have, so counting doesn't force a load.
+    '''
+
+    __slots__ = ('index', 'order', 'loader', 'length')
+
+    def __init__(self, loader=None, length=0):
+        self.index = {}
+        self.order = array('q')
+        self.loader = loader
+        self.length = length
+
+    def load(self):
+        if self.loader:
+            with LOAD_LOCK:
+                if self.loader:
+                    for obj in self.loader():
+                        self.index[obj.id] = obj
+                        self.order.append(obj.id)
+
+                    self.loader = None
+
+    def append(self, obj):
+        self.load()
+        self.index[obj.id] = obj
+        self.order.append(obj.id)
+
+    def insert(self, obj):
+        # for an id that may be lower than ones already stored, order
+        # has to stay sorted for page
+        self.load()
+
+        if self.order and obj.id < self.order[-1]:
+            self.index[obj.id] = obj
+            insort(self.order, obj.id)
+        else:
+            self.append(obj)
+
+    def find(self, obj_id):
+        self.load()
+        return self.index.get(obj_id)
+
+    def remove(self, obj_id):
+        self.load()
+
+        if self.index.pop(obj_id, None) is None:
+            return False
+
+        # deleted ids stay in order until they're most of it, the
+        # index isn't in id order once insert has added to it
+        if len(self.order) > 2 * len(self.index) + 16:
+            self.order = array('q', sorted(self.index))
+        return True
+
+    def page(self, after=None, limit=None, where=None):
+        '''
+        Returns up to limit objs with ids after the id after, and
+        the id to continue from, or None if this was the last page
+
+        ids only ever go up, so order is sorted and finding where a
+        page starts is a binary search, however deep the page is.
+        where optionally filters which objs count.
+        '''
+        self.load()
+
+        # compacting replaces order, a reader keeps the one it started on
+        order = self.order
+        start = 0 if after is None else bisect_right(order, after)
+        page = []
+
+        for i in range(start, len(order)):
+            obj = self.index.get(order[i])
+
+            if obj is None or (where and not where(obj)):
+                continue
+            if limit is not None and len(page) == limit:
+                # a limit of 0 leaves nothing to continue from
+                return page, page[-1].id if page else after
+
+            page.append(obj)
+
+        return page, None
+
+    def newest_first(self):
+        # iterates from the most recently added object back
+        self.load()
+        order = self.order
+
+        for i in range(len(order) - 1, -1, -1):
+            obj = self.index.get(order[i])
+
+            if obj is not None:
+                yield obj
+
+    def __contains__(self, obj_id):
+        self.load()
+        return obj_id in self.index
+
+    def __iter__(self):
+        self.load()
+        return iter(self.index.values())
+
+    def __len__(self):
+        if self.loader:
+            return self.length
+        return len(self.index)
+
+
+# shared by every LikeColumns that hasn't been liked yet, never modified
+EMPTY = {}
+
+
+class LikeColumns:
+    '''
+    The likes on a post or comment, stored as columns
+
+    A popular post can have millions of likes, so instead of a Like
+    object each one is a row across parallel columns: the user, an
+    integer timestamp and a sequence number. positions maps a user id
+    to its row, which makes "has this user liked it" and deleting
+    O(1). Like objects are only built when a like is returned to the
+    client.
+
+    The users column holds the User objects rather than an array of
+    ids. A reference takes the same 8 bytes as an id would, and a Like
+    needs its User to be serialized, which from an id would mean a
+    lookup in the store, one the columns don't have, for every like
+    sent. positions is a dict rather than a bitset because user ids
+    are sparse once the store is sharded.
+
+    Sequence numbers count up from 0 for each post or comment, so
+    unlike timestamps, which follow the wall clock and can repeat or
+    go backwards, they're unique and in row order, and pages
+    continue from one.
+
+    Deleting leaves a hole so the remaining likes keep their order,
+    the columns are compacted once most of the rows are holes. Most
+    comments are never liked, so the columns are only created for the
+    first like.
+
+    Like IndexedCollection, likes read from a snapshot start out
+    unloaded, loader returns (user, timestamp, sequence number) rows.
+    '''
+
+    __slots__ = ('text', 'users', 'timestamps', 'seqs', 'next_seq',
+                 'positions', 'loader', 'length')
+
+    def __init__(self, text, loader=None, length=0, next_seq=0):
+        self.text = text
+        self.users = ()
+        self.timestamps = ()
+        self.seqs = ()
+        self.next_seq = next_seq
+        self.positions = EMPTY
+        self.loader = loader
+        self.length = length
+
+    def load(self):
+        if self.loader:
+            with LOAD_LOCK:
+                if self.loader:
+                    for user, timestamp, seq in self.loader():
+                        self.insert(user, timestamp, seq)
+
+                    self.loader = None
+
+    def add(self, user, timestamp):
+        # checking and inserting happen together, so with the post's
+        # subtree locked two requests can't both add the same like
+        self.load()
+
+        if user.id in self.positions:
+            return False
+
+        self.insert(user, timestamp)
+        return True
+
+    def insert(self, user, timestamp, seq=None):
+        if not self.users:
+            self.users = []
+            self.timestamps = array('q')
+            self.seqs = array('I')
+            self.positions = {}
+
+        # a new like takes the next number, a loaded one keeps its own
+        if seq is None:
+            seq = self.next_seq
+            self.next_seq += 1
+
+        self.positions[user.id] = len(self.users)
+        self.users.append(user)
+        self.timestamps.append(timestamp)
+        self.seqs.append(seq)
+
+    def remove(self, user_id):
+        self.load()
+        position = self.positions.pop(user_id, None)
+
+        if position is None:
+            return False
+
+        self.users[position] = None
+        if len(self.users) > 2 * len(self.positions) + 16:
+            self.compact()
+        return True
+
+    def compact(self):
+        # sequence numbers are kept, so cursors stay valid
+        kept = [i for i, user in enumerate(self.users) if user is not None]
+        self.users = [self.users[i] for i in kept]
+        self.timestamps = array('q', [self.timestamps[i] for i in kept])
+        self.seqs = array('I', [self.seqs[i] for i in kept])
+        self.positions = {user.id: i for i, user in enumerate(self.users)}
+
+    def find(self, user_id):
+        self.load()
+        position = self.positions.get(user_id)
+
+        if position is None:
+            return None
+        return Like(self.users[position], self.text,
+                    self.timestamps[position])
+
+    def rows(self):
+        # (user, timestamp) for every like, in the order they were made
+        self.load()
+        for user, timestamp in zip(self.users, self.timestamps):
+            if user is not None:
+                yield user, timestamp
+
+    def numbered_rows(self):
+        # rows with their sequence numbers, for snapshots
+        self.load()
+        for user, timestamp, seq in zip(self.users, self.timestamps,
+                                        self.seqs):
+            if user is not None:
+                yield user, timestamp, seq
+
+    def page(self, after=None, limit=None):
+        '''
+        Returns up to limit likes after the like after, and the
+        (user id, sequence number) to continue from, or None if this
+        was the last page
+
+        The row of the last like sent is found through positions, if
+        it has been deleted since, or unliked and liked again, rows are
+        in sequence order so the next one is found with a binary search.
+        '''
+        self.load()
+        start = 0
+
+        if after is not None:
+            user_id, seq = after
+            start = self.positions.get(user_id)
+
+            if start is not None and self.seqs[start] == seq:
+                start += 1
+            else:
+                start = bisect_right(self.seqs, seq)
+
+        page = []
+
+        for i in range(start, len(self.users)):
+            user = self.users[i]
+
+            if user is None:
+                continue
+            if limit is not None and len(page) == limit:
+                last = page[-1]
+                return page, (last.user.id, self.seqs[last_row])
+
+            page.append(Like(user, self.text, self.timestamps[i]))
+            last_row = i
+
+        return page, None
+
+    def __contains__(self, user_id):
+        self.load()
+        return user_id in self.positions
+
+    def __iter__(self):
+        for user, timestamp in self.rows():
+            yield Like(user, self.text, timestamp)
+
+    def __len__(self):
+        if self.loader:
+            return self.length
+        return len(self.positions)
 
 
 class BlogUsers:
@@ -23,30 +356,54 @@ class BlogUsers:
     will be loaded through JSON
     '''
 
-    def __init__(self, users_json, posts_json):
+    def __init__(self, users_json=None, posts_json=None, progress=None):
         self.next_user_id = 0
-        self.users = []
-        self.load_users(users_json, posts_json)
-
-    def load_users(self, users, posts):
-        # loads users and posts from JSON files
-        with open(users) as f:
-            users = json.load(f)
-
-        # load in users
-        for user in users:
+        self.users = IndexedCollection()
+
+        # when the store is split across processes (see router.py) this
+        # one owns the users whose id % num_shards is shard, the other
+        # users it has are replicas, kept so they can like and comment
+        self.shard = 0
+        self.num_shards = 1
+        self.load_time = None
+
+        # set when the store is mapped from a binary snapshot
+        self.snapshot_reader = None
+
+        # indexes over the whole store (search, timelines, etc.) are
+        # kept up to date by being told about every change, see notify
+        self.observers = []
+
+        # who liked and commented what, so deleting a user can take
+        # their likes and comments with them
+        self.activity = UserActivity(self)
+
+        # what a request locks, a user's subtree is keyed by their id
+        # see shared/locking.py
+        self.locks = StoreLocks()
+
+        # an empty store is handy for benchmarks and scripts
+        if users_json and posts_json:
+            self.load_users(users_json, posts_json, progress)
+
+    def load_users(self, users, posts, progress=None):
+        # streams users and posts from JSON files one element at a time
+        # so memory stays bounded no matter how big the export is
+        if progress is None:
+            progress = LoadProgress()
+
+        # load in users, ids are their position in the file
+        for user_id, user in enumerate(progress.iter_file(users)):
             new_user = self.add_user(
-                user['name'], user['about'], user['profileImage'])
+                user['name'], user['about'], user['profileImage'], user_id)
 
             for media in user['socialMedia']:
                 new_user.add_social(
                     media['network'], media['url'], media['icon'])
 
-        with open(posts) as f:
-            posts = json.load(f)
-
         # load posts and associate them with their users
-        for post in posts:
+        # every user is already indexed, so each reference is O(1)
+        for post in progress.iter_file(posts):
             user = self.find_user(post['userID'])
             new_post = user.add_post(post['content'], post['title'])
 
@@ -66,26 +423,77 @@ class BlogUsers:
                     comment_like_user = self.find_user(comment_like['userID'])
                     new_comment.add_like(comment_like_user)
 
-    def add_user(self, name, about, profile_image):
-        new_user = User(name, about, profile_image, self.next_user_id)
-        self.next_user_id += 1
+        self.load_time = progress.finish()
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def notify(self, event, *args):
+        # calls the method named event on every observer that has one
+        # writers to different subtrees can get here at the same time
+        with self.locks.indexes:
+            for observer in self.observers:
+                handler = getattr(observer, event, None)
+
+                if handler:
+                    handler(*args)
+
+    def add_user(self, name, about, profile_image, user_id=None):
+        if user_id is None:
+            user_id = self.next_user_id
+
+        new_user = User(name, about, profile_image, user_id, self)
+        self.next_user_id = max(self.next_user_id,
+                                self.next_owned_id(user_id))
         self.users.append(new_user)
         return new_user
 
+    def set_shard(self, shard, num_shards):
+        self.shard = shard
+        self.num_shards = num_shards
+        self.next_user_id = self.next_owned_id(self.next_user_id - 1)
+
+    def owns(self, user_id):
+        return user_id % self.num_shards == self.shard
+
+    def next_owned_id(self, user_id):
+        # the first id after user_id that this shard hands out
+        return user_id + 1 + (self.shard - user_id - 1) % self.num_shards
+
+    def drop_other_shards(self):
+        # after loading everything from the JSON files, turns the users
+        # other shards own into replicas, their posts live over there
+        for user in self.users:
+            if not self.owns(user.id):
+                user.posts = IndexedCollection()
+
+    def put_replica(self, user_id, name, about, profile_image):
+        # adds or updates the copy of a user another shard owns
+        user = self.find_user(user_id)
+
+        if user:
+            return self.update_user(user_id, name, about, profile_image)
+
+        replica = User(name, about, profile_image, user_id, self)
+        self.users.insert(replica)
+        return replica
+
     def delete_user(self, user_id):
-        for i in range(len(self.users)):
-            if self.users[i].id == user_id:
-                del self.users[i]
-                return True
+        user = self.find_user(user_id)
 
-        return False
+        if not user:
+            return False
 
-    def find_user(self, user_id):
-        for i in range(len(self.users)):
-            if self.users[i].id == user_id:
-                return self.users[i]
+        # their likes and comments go too, not just their posts
+        self.activity.remove_activity(user)
 
-        return None
+        self.users.remove(user_id)
+        self.notify('user_deleted', user)
+        return True
+
+    @counts_lookup
+    def find_user(self, user_id):
+        return self.users.find(user_id)
 
     def update_user(self, user_id, name=None, about=None, profile_image=None):
         user = self.find_user(user_id)
@@ -100,6 +508,7 @@ class BlogUsers:
         if profile_image:
             user.profile_image = profile_image
 
+        user.touch()
         return user
 
     def verify_json(self, data):
@@ -153,12 +562,52 @@ class JSONReturnable(ABC):
     def create_dict(self, simple=False):
         pass
 
+    # Serializing the same unchanged object over and over is wasted
+    # work, so objects remember the dict they last built. Every method
+    # that changes an object calls touch(), and the memo is only reused
+    # while the versions it was built from haven't moved. The returned
+    # dicts are shared, so callers must not modify them.
+    #
+    # Every model uses __slots__ to keep per-object overhead down, so
+    # the version and memo attributes are declared by each subclass
+    __slots__ = ()
+
+    def init_memo(self):
+        self.version = 0
+        self.memo_key = None
+        self.memo_dict = None
+        self.json_key = None
+        self.json_bytes = None
+
+    def touch(self):
+        self.version += 1
+
+    def memo(self, key, build):
+        if self.memo_key != key:
+            self.memo_dict = build()
+            self.memo_key = key
+
+        return self.memo_dict
+
+    # The encoded form is memoized the same way, list endpoints
+    # splice these bytes together without encoding anything again
+    def create_json(self):
+        return dumps(self.create_dict())
+
+    def memo_json(self, key, build):
+        if self.json_key != key:
+            self.json_bytes = build()
+            self.json_key = key
+
+        return self.json_bytes
+
 '''
 Most of the following objects follow a similar pattern
 
 If they have a 1 to many relationship, the 1 contains the many
-as a list. In a real codebase, this would be handled using a
-database like MySQL instead of creating lists on each object.
+as an IndexedCollection (an ordered dict keyed by id). In a real
+codebase, this would be handled using a database like MySQL instead
+of creating collections on each object.
 
 Because this I'm loading data in from JSON for this practice,
 I chose to keep it simple. I designed the rest of the system around
@@ -174,17 +623,57 @@ quickly it has done it's job.
 
 class User(JSONReturnable):
 
-    def __init__(self, name, about, profile_image, id):
+    __slots__ = ('name', 'about', 'profile_image', 'social_medias', 'posts',
+                 'id', 'next_social_id', 'next_post_id', 'blog',
+                 'version', 'memo_key', 'memo_dict', 'json_key', 'json_bytes',
+                 'simple_key', 'simple_dict', 'simple_json_key',
+                 'simple_json_bytes')
+
+    def __init__(self, name, about, profile_image, id, blog=None):
+        self.init_memo()
+        self.simple_key = None
+        self.simple_dict = None
+        self.simple_json_key = None
+        self.simple_json_bytes = None
+
         self.name = name
         self.about = about
         self.profile_image = profile_image
-        self.social_medias = []
-        self.posts = []
+        self.social_medias = IndexedCollection()
+        self.posts = IndexedCollection()
         self.id = id
         self.next_social_id = 0
         self.next_post_id = 0
 
+        # the store this user belongs to, changes are reported to it
+        self.blog = blog
+
+    def notify(self, event, *args):
+        if self.blog:
+            self.blog.notify(event, *args)
+
+    # the simple dict is embedded in every post, comment and like,
+    # so it gets its own memo instead of sharing one with the full dict
     def create_dict(self, simple=False):
+        if simple:
+            if self.simple_key != self.version:
+                self.simple_dict = self.build_dict(simple=True)
+                self.simple_key = self.version
+            return self.simple_dict
+
+        return self.memo(self.version, self.build_dict)
+
+    def create_json(self, simple=False):
+        if simple:
+            if self.simple_json_key != self.version:
+                self.simple_json_bytes = dumps(self.create_dict(simple=True))
+                self.simple_json_key = self.version
+            return self.simple_json_bytes
+
+        return self.memo_json(self.version,
+                              lambda: dumps(self.create_dict()))
+
+    def build_dict(self, simple=False):
         info = {}
 
         info['name'] = self.name
@@ -202,22 +691,17 @@ class User(JSONReturnable):
         new_social = SocialMedia(network, url, icon, self.next_social_id)
         self.next_social_id += 1
         self.social_medias.append(new_social)
+        self.touch()
         return new_social
 
     def delete_social(self, social_id):
-        for i in range(len(self.social_medias)):
-            if self.social_medias[i].id == social_id:
-                del self.social_medias[i]
-                return True
-
+        if self.social_medias.remove(social_id):
+            self.touch()
+            return True
         return False
 
     def find_social(self, social_id):
-        for i in range(len(self.social_medias)):
-            if self.social_medias[i].id == social_id:
-                return self.social_medias[i]
-
-        return None
+        return self.social_medias.find(social_id)
 
     def update_social(self, social_id, network=None, url=None, icon=None):
         social = self.find_social(social_id)
@@ -232,28 +716,30 @@ class User(JSONReturnable):
         if icon:
             social.icon = icon
 
+        # the user's dict embeds its social medias
+        self.touch()
         return social
 
     def add_post(self, content, title):
         new_post = Post(self, content, title, self.next_post_id)
         self.next_post_id += 1
         self.posts.append(new_post)
+        self.notify('post_added', new_post)
         return new_post
 
     def delete_post(self, post_id):
-        for i in range(len(self.posts)):
-            if self.posts[i].id == post_id:
-                del self.posts[i]
-                return True
+        post = self.find_post(post_id)
 
-        return False
+        if not post:
+            return False
 
-    def find_post(self, post_id):
-        for i in range(len(self.posts)):
-            if self.posts[i].id == post_id:
-                return self.posts[i]
+        self.posts.remove(post_id)
+        self.notify('post_deleted', post)
+        return True
 
-        return None
+    @counts_lookup
+    def find_post(self, post_id):
+        return self.posts.find(post_id)
 
     def update_post(self, post_id, title=None, content=None, date_posted=None):
         post = self.find_post(post_id)
@@ -264,6 +750,7 @@ class User(JSONReturnable):
         if title:
             post.title = title
         self.update_text(post, content=content, date_posted=date_posted)
+        self.notify('post_updated', post)
 
         return post
 
@@ -273,9 +760,13 @@ class User(JSONReturnable):
         if date_posted:
             text.date_posted = date_posted
 
+        text.touch()
+
 
 class SocialMedia(JSONReturnable):
 
+    __slots__ = ('network', 'url', 'icon', 'id')
+
     def __init__(self, network, url, icon, id):
         self.network = network
         self.url = url
@@ -283,15 +774,9 @@ class SocialMedia(JSONReturnable):
         self.id = id
 
     def create_dict(self):
-        # Python allows you to return a dict of
-        # all attributes and their values
-
-        # this only works for SocialMedia objects
-        # because their standard JSON attribute names
-        # are the same as their python ones
-        # Other objects use snake_case and JSON
-        # is typically in camelCase
-        return self.__dict__
+        # the JSON attribute names are the same as the python ones,
+        # but slotted objects don't have a __dict__ to return
+        return {name: getattr(self, name) for name in self.__slots__}
 
 
 '''
@@ -302,111 +787,238 @@ both objects can be liked and share similar attributes.
 '''
 class Text(ABC):
 
+    __slots__ = ('user', 'date_posted', 'likes', 'content', 'id',
+                 'version', 'memo_key', 'memo_dict', 'json_key', 'json_bytes')
+
     def __init__(self, user, content, id):
+        self.init_memo()
         self.user = user
         self.date_posted = create_timestamp()
-        self.likes = []
+        self.likes = LikeColumns(self)
         self.content = content
         self.id = id
 
-    def add_like(self, user):
+    def add_like(self, user, date_posted=None):
         # likes are unique!
         # a user can't double like a post
 
         # unlike other add_{object} methods, this one
         # can return None
-        if self.find_like(user.id):
+        if date_posted is None:
+            date_posted = create_timestamp()
+
+        if not self.likes.add(user, date_posted):
             return None
 
-        new_like = Like(user, self)
-        self.likes.append(new_like)
-        return new_like
+        self.touch()
+        self.user.notify('like_added', self, user)
+        return Like(user, self, date_posted)
 
     def delete_like(self, user_id):
-        for i in range(len(self.likes)):
-            if self.likes[i].user.id == user_id:
-                del self.likes[i]
-                return True
-
+        if self.likes.remove(user_id):
+            self.touch()
+            self.user.notify('like_deleted', self, user_id)
+            return True
         return False
 
     def find_like(self, user_id):
-        for i in range(len(self.likes)):
-            if self.likes[i].user.id == user_id:
-                return self.likes[i]
-
-        return None
+        return self.likes.find(user_id)
 
 
 class Like(JSONReturnable):
-    def __init__(self, user, text):
+
+    # likes are stored in LikeColumns, these are only built to be
+    # serialized, so there's nothing worth memoizing on them
+    __slots__ = ('user', 'date_posted', 'text_id')
+
+    def __init__(self, user, text, date_posted):
         self.user = user
-        self.date_posted = create_timestamp()
+        self.date_posted = date_posted
         self.text_id = text.id
 
     def create_dict(self):
+        return self.build_dict()
+
+    def build_dict(self):
         info = {}
         info['user'] = self.user.create_dict(simple=True)
-        info['datePosted'] = self.date_posted
+        info['datePosted'] = format_timestamp(self.date_posted)
 
         return info
 
+    def create_json(self):
+        # splicing in the user's encoded dict is most of the work
+        return with_user({'datePosted': format_timestamp(self.date_posted)},
+                         self.user.create_json(simple=True))
+
 
 class Post(Text, JSONReturnable):
 
+    __slots__ = ('title', 'comments', 'next_comment_id')
+
     def __init__(self, user, content, title, id):
         super().__init__(user, content, id)
         self.title = title
-        self.comments = []
+        self.comments = IndexedCollection()
         self.next_comment_id = 0
 
     def create_dict(self):
+        return self.memo((self.version, self.user.version), self.build_dict)
+
+    def build_dict(self):
         info = {}
 
         info['user'] = self.user.create_dict(simple=True)
         info['title'] = self.title
         info['content'] = self.content
-        info['datePosted'] = self.date_posted
+        info['datePosted'] = format_timestamp(self.date_posted)
         info['numLikes'] = len(self.likes)
         info['numComments'] = len(self.comments)
         info['postID'] = self.id
 
         return info
 
+    def create_json(self):
+        return self.memo_json((self.version, self.user.version),
+                              self.build_json)
+
+    def build_json(self):
+        info = dict(self.create_dict())
+        del info['user']
+        return with_user(info, self.user.create_json(simple=True))
+
     def add_comment(self, user, comment):
-        new_comment = Comment(user, comment, self.next_comment_id)
+        new_comment = Comment(user, comment, self.next_comment_id, self)
         self.next_comment_id += 1
         self.comments.append(new_comment)
+        self.touch()
+        self.user.notify('comment_added', new_comment)
         return new_comment
 
     def delete_comment(self, comment_id):
-        for i in range(len(self.comments)):
-            if self.comments[i].id == comment_id:
-                del self.comments[i]
-                return True
+        comment = self.find_comment(comment_id)
 
-        return False
+        if not comment:
+            return False
 
-    def find_comment(self, comment_id):
-        for i in range(len(self.comments)):
-            if self.comments[i].id == comment_id:
-                return self.comments[i]
+        self.comments.remove(comment_id)
+        self.touch()
+        self.user.notify('comment_deleted', comment)
+        return True
 
-        return None
+    @counts_lookup
+    def find_comment(self, comment_id):
+        return self.comments.find(comment_id)
 
 
 class Comment(Text, JSONReturnable):
 
-    def __init__(self, user, content, id):
+    __slots__ = ('post',)
+
+    def __init__(self, user, content, id, post=None):
         super().__init__(user, content, id)
 
+        # the post this comment is on, user is who wrote it
+        self.post = post
+
     def create_dict(self):
+        return self.memo((self.version, self.user.version), self.build_dict)
+
+    def build_dict(self):
         info = {}
 
         info['user'] = self.user.create_dict(simple=True)
         info['content'] = self.content
-        info['datePosted'] = self.date_posted
+        info['datePosted'] = format_timestamp(self.date_posted)
         info['numLikes'] = len(self.likes)
         info['commentID'] = self.id
 
         return info
+
+    def create_json(self):
+        return self.memo_json((self.version, self.user.version),
+                              self.build_json)
+
+    def build_json(self):
+        info = dict(self.create_dict())
+        del info['user']
+        return with_user(info, self.user.create_json(simple=True))
+
+    def update_comment(self, content):
+        self.content = content
+        self.touch()
+
+
+'''
+The keys of each model's JSON, key -> function building its value
+
+A request with fields= builds only the keys it asks for from these
+(see shared/fields.py). They must give what build_dict does, which
+builds every key by hand since that's much faster for whole objects.
+'''
+
+
+def date_posted(text):
+    return format_timestamp(text.date_posted)
+
+
+SIMPLE_USER_FIELDS = {
+    'name': attrgetter('name'),
+    'about': attrgetter('about'),
+    'id': attrgetter('id'),
+}
+
+SOCIAL_FIELDS = {
+    'network': attrgetter('network'),
+    'url': attrgetter('url'),
+    'icon': attrgetter('icon'),
+    'id': attrgetter('id'),
+}
+
+USER_FIELDS = dict(
+    SIMPLE_USER_FIELDS,
+    profileImage=attrgetter('profile_image'),
+    socialMedia=Nested(attrgetter('social_medias'), SOCIAL_FIELDS,
+                       SocialMedia.create_dict, many=True),
+)
+
+AUTHOR = Nested(attrgetter('user'), SIMPLE_USER_FIELDS,
+                lambda user: user.create_dict(simple=True))
+
+LIKE_FIELDS = {
+    'user': AUTHOR,
+    'datePosted': date_posted,
+}
+
+POST_FIELDS = {
+    'user': AUTHOR,
+    'title': attrgetter('title'),
+    'content': attrgetter('content'),
+    'datePosted': date_posted,
+    'numLikes': lambda post: len(post.likes),
+    'numComments': lambda post: len(post.comments),
+    'postID': attrgetter('id'),
+}
+
+COMMENT_FIELDS = {
+    'user': AUTHOR,
+    'content': attrgetter('content'),
+    'datePosted': date_posted,
+    'numLikes': lambda comment: len(comment.likes),
+    'commentID': attrgetter('id'),
+}
+
+
+# what expand= can embed in each model (see shared/expand.py)
+COMMENT_RELATIONS = {
+    'likes': Relation(attrgetter('likes')),
+}
+
+POST_RELATIONS = {
+    'comments': Relation(attrgetter('comments'), COMMENT_RELATIONS),
+    'likes': Relation(attrgetter('likes')),
+}
+
+USER_RELATIONS = {
+    'posts': Relation(attrgetter('posts'), POST_RELATIONS),
+}
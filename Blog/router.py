@@ -0,0 +1,517 @@
+import http.client
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from heapq import merge
+from urllib.parse import urlencode
+
+from flask import Flask, request
+
+# the modules both APIs share are in shared/, at the top of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared import fields
+from encoding import dumps, json_response
+from shared.pagination import CURSOR_HEADER, page_args, page_headers
+from shared.metrics import Metrics
+
+'''
+Runs the blog as several processes, one shard of the users each
+
+Every URL in api.py is rooted at users/<user_id>, so each shard runs
+api.py owning the users whose id % num_shards is its number, with
+their posts, comments and likes, and its own journal and snapshot.
+This router sits in front and forwards each request to the shard that
+owns the user in its URL, so requests for different users are served
+by different cores.
+
+Liking or commenting on a post touches two users who can be on
+different shards. To keep that a single shard operation every shard
+also has a replica of every other user, which the router keeps up to
+date when a user is created, updated or deleted. Deleting a user
+deletes their replicas too, which takes their likes and comments on
+every other shard with them. By then the owner has made the change,
+so a shard that can't be reached doesn't fail the request, its replica
+is repaired in the background (see Repairs).
+
+The few URLs that aren't about one user's posts (the user list,
+search, the timeline, the leaderboards and what a user liked or
+commented) are sent to every shard and the answers merged.
+
+Run from the Blog directory with the number of shards:
+    python router.py 4
+
+The router listens on port 5000 and the shards on the ports after it.
+'''
+
+API_URL = '/blogr/api/v1/'
+METHODS = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+
+# methods a shard can be sent twice without changing what they do
+IDEMPOTENT = {'GET', 'HEAD', 'PUT', 'DELETE'}
+
+# what a response sent back to the client keeps from a shard's
+PASSED_HEADERS = ['Content-Type', 'Retry-After', 'ETag', CURSOR_HEADER]
+
+# and what a request forwarded to one shard keeps from the client's
+FORWARDED_HEADERS = ['Content-Type', 'If-None-Match']
+
+# seconds between attempts at repairing replicas that are behind
+REPAIR_EVERY = 1.0
+
+
+class Repairs:
+    '''
+    Replica writes that didn't reach their shard, retried until they do
+
+    Replica writes are PUTs and DELETEs of the whole replica, so only
+    the newest write to each replica matters, pending holds it keyed
+    by (shard, path). While a replica has one pending, newer writes to
+    it replace it rather than being sent, so they can't be overtaken
+    by the older one being retried.
+    '''
+
+    def __init__(self, shards):
+        self.shards = shards
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.wake = threading.Event()
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def queue(self, shard, method, path, body):
+        # returns whether the write waits behind one already pending
+        with self.lock:
+            waiting = (shard, path) in self.pending
+            self.pending[shard, path] = (method, body)
+
+        self.wake.set()
+        return waiting
+
+    def is_pending(self, shard, path):
+        return (shard, path) in self.pending
+
+    def run(self):
+        while True:
+            self.wake.wait()
+            time.sleep(REPAIR_EVERY)
+
+            with self.lock:
+                pending = list(self.pending.items())
+
+            for (shard, path), write in pending:
+                if not self.shards.send_replica(shard, write[0], path,
+                                                write[1]):
+                    continue
+
+                with self.lock:
+                    # unless a newer write replaced it meanwhile
+                    if self.pending.get((shard, path)) is write:
+                        del self.pending[shard, path]
+
+            with self.lock:
+                if not self.pending:
+                    self.wake.clear()
+
+
+class Shards:
+
+    def __init__(self, ports, host='127.0.0.1'):
+        self.ports = ports
+        self.host = host
+
+        # one connection per shard per thread, kept open between requests
+        self.local = threading.local()
+        self.pool = ThreadPoolExecutor(max_workers=4 * len(ports))
+
+        # new users are spread over the shards in turn
+        self.turn = itertools.count()
+
+        self.repairs = Repairs(self)
+
+    def __len__(self):
+        return len(self.ports)
+
+    def owner(self, user_id):
+        return user_id % len(self.ports)
+
+    def next_shard(self):
+        return next(self.turn) % len(self.ports)
+
+    def connection(self, shard, fresh=False):
+        if not hasattr(self.local, 'connections'):
+            self.local.connections = {}
+
+        connection = self.local.connections.get(shard)
+
+        if connection is None or fresh:
+            if connection is not None:
+                connection.close()
+            connection = http.client.HTTPConnection(self.host,
+                                                    self.ports[shard])
+            self.local.connections[shard] = connection
+
+        return connection
+
+    def send(self, shard, method, path, body=None, headers=None):
+        '''
+        Sends a request to one shard, returns (status, headers, body)
+        '''
+        headers = dict(headers or {})
+
+        if body:
+            headers.setdefault('Content-Type', 'application/json')
+
+        # a kept open connection may have been closed by the shard,
+        # that's retried once on a fresh one. Once a request is sent
+        # the shard may have acted on it, so then only a request that
+        # can safely be repeated is
+        for fresh in (False, True):
+            connection = self.connection(shard, fresh)
+            sent = False
+
+            try:
+                connection.request(method, API_URL + path, body, headers)
+                sent = True
+                response = connection.getresponse()
+                return response.status, response.headers, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                if fresh or (sent and method not in IDEMPOTENT):
+                    # the next request reconnects
+                    connection.close()
+                    raise
+
+    def send_all(self, method, path, body=None, skip=None):
+        # sends the same request to every shard but skip, in parallel
+        shards = [shard for shard in range(len(self)) if shard != skip]
+        return list(self.pool.map(
+            lambda shard: self.send(shard, method, path, body), shards))
+
+    def send_replica(self, shard, method, path, body=None):
+        # returns whether the shard's replica took the write
+        try:
+            status, _, _ = self.send(shard, method, path, body)
+        except (OSError, http.client.HTTPException):
+            return False
+        return status == 204
+
+    def replicate(self, method, path, body=None, skip=None):
+        '''
+        Sends a replica write to every shard but skip, in parallel, a
+        shard that doesn't take it gets it again later, see Repairs
+        '''
+        def send(shard):
+            if self.repairs.is_pending(shard, path):
+                self.repairs.queue(shard, method, path, body)
+            elif not self.send_replica(shard, method, path, body):
+                if not self.repairs.queue(shard, method, path, body):
+                    print(' * Shard {} missed {} {}, repairing it'.format(
+                        shard, method, path), file=sys.stderr)
+
+        shards = [shard for shard in range(len(self)) if shard != skip]
+        list(self.pool.map(send, shards))
+
+    def wait_until_up(self, timeout=60):
+        deadline = time.monotonic() + timeout
+
+        for port in self.ports:
+            while True:
+                try:
+                    socket.create_connection((self.host, port), 1).close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.1)
+
+
+def with_query(path, args):
+    return path + '?' + urlencode(args) if args else path
+
+
+def timeline_key(entry):
+    # timeline.post_key, as the shard sent it with the post
+    return tuple(entry['key'])
+
+
+def create_router(shards):
+    app = Flask(__name__)
+
+    # each shard serves its own /metrics, the router's are the times
+    # including the hop to the shards
+    Metrics().install(app)
+
+    def passed_on(response):
+        status, headers, body = response
+        kept = {name: headers[name] for name in PASSED_HEADERS
+                if name in headers}
+        return body, status, kept
+
+    def forward(shard, whole=False):
+        # whole leaves out fields=, for a body the router needs all of
+        if whole:
+            path = with_query(request.path[len(API_URL):],
+                              [(key, value) for key, value
+                               in request.args.items(multi=True)
+                               if key != fields.ARG])
+        else:
+            path = request.full_path[len(API_URL):].rstrip('?')
+        headers = {name: request.headers[name] for name in FORWARDED_HEADERS
+                   if name in request.headers}
+        return shards.send(shard, request.method, path,
+                           request.get_data() or None, headers)
+
+    def gather(path, args):
+        '''
+        Sends a GET to every shard, returns each one's decoded list
+        and whether any had more pages, or the first error
+        '''
+        # the merge needs whole objects, they're cut down after it
+        args = {key: value for key, value in args.items()
+                if key != fields.ARG}
+        responses = shards.send_all('GET', with_query(path, args))
+
+        for response in responses:
+            if response[0] != 200:
+                return None, None, passed_on(response)
+
+        results = [json.loads(body) for _, _, body in responses]
+        more = any(CURSOR_HEADER in headers for _, headers, _ in responses)
+        return results, more, None
+
+    def merged_response(merged, headers=None):
+        value = request.args.get(fields.ARG)
+
+        if value is not None:
+            merged = fields.project(merged, fields.parse(value))
+        return json_response(dumps(merged), 200, headers)
+
+    def replicate(user):
+        body = dumps({'name': user['name'], 'about': user['about'],
+                      'profileImage': user['profileImage']})
+        shards.replicate('PUT', 'internal/replicas/{}'.format(user['id']),
+                         body, skip=shards.owner(user['id']))
+
+    def users():
+        if request.method == 'POST':
+            response = shards.send(shards.next_shard(), 'POST', 'users',
+                                   request.get_data())
+            if response[0] == 201:
+                replicate(json.loads(response[2]))
+            return passed_on(response)
+
+        if request.method != 'GET':
+            return '', 405
+
+        # every shard pages through its users by id, so the next page
+        # of all of them starts after the last id sent
+        _, limit = page_args(request.args)
+        results, more, error = gather('users', request.args)
+
+        if error:
+            return error
+
+        merged = list(merge(*results, key=lambda user: user['id']))
+        more = more or (limit is not None and len(merged) > limit)
+        merged = merged[:limit]
+
+        next_id = merged[-1]['id'] if more and merged else None
+        return merged_response(merged, page_headers(next_id))
+
+    def single_user(user_id):
+        owner = shards.owner(user_id)
+        updates = request.method in ('PUT', 'PATCH')
+
+        # the replicas need the whole user, it's cut down after
+        response = forward(owner, whole=updates)
+        status, _, body = response
+
+        if updates and status == 200:
+            user = json.loads(body)
+            replicate(user)
+            return merged_response(user)
+        elif request.method == 'DELETE' and status == 204:
+            shards.replicate('DELETE', 'internal/replicas/{}'.format(user_id),
+                             skip=owner)
+
+        return passed_on(response)
+
+    def timeline():
+        before, limit = page_args(request.args, size=3)
+        limit = limit or 20
+
+        results, more, error = gather('internal/timeline', request.args)
+
+        if error:
+            return error
+
+        merged = list(merge(*results, key=timeline_key, reverse=True))
+        more = more or len(merged) > limit
+        merged = merged[:limit]
+
+        next_key = timeline_key(merged[-1]) if more and merged else None
+        return merged_response([entry['post'] for entry in merged],
+                               page_headers(next_key))
+
+    def ready():
+        # ready once every shard is, a shard that's down isn't
+        def status(shard):
+            try:
+                code, _, body = shards.send(shard, 'GET', 'ready')
+                return code, json.loads(body)
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                return 503, {'ready': False, 'error': str(e)}
+
+        statuses = list(shards.pool.map(status, range(len(shards))))
+        codes = [code for code, _ in statuses]
+
+        if all(code == 200 for code in codes):
+            code = 200
+        else:
+            code = 500 if 500 in codes else 503
+
+        return json_response(dumps({
+            'ready': code == 200,
+            'shards': [shard_status for _, shard_status in statuses],
+            'replicasRepairing': len(shards.repairs),
+        }), code)
+
+    def most_liked(path, likes):
+        # each shard's top K, the overall top K is among them
+        results, _, error = gather(path, request.args)
+
+        if error:
+            return error
+
+        limit = min(int(request.args.get('limit', 10)), 1000)
+        merged = merge(*results, key=likes, reverse=True)
+        return merged_response(list(merged)[:limit])
+
+    def offset_pages(path, args, combine, default_limit=None):
+        '''
+        For lists paged by offset: every shard sends everything up to
+        the end of the page and combine turns their lists into one
+        '''
+        offset, limit = page_args(request.args)
+        offset = offset or 0
+        limit = limit or default_limit
+
+        if limit is not None:
+            args = dict(args, limit=offset + limit)
+
+        results, more, error = gather(path, args)
+
+        if error:
+            return error
+
+        combined = combine(results)
+        end = len(combined) if limit is None else offset + limit
+        more = more or len(combined) > end
+
+        return merged_response(combined[offset:end],
+                               page_headers(end if more else None))
+
+    def search():
+        # each shard's scores only compare with its own, so results are
+        # taken from the shards in turn, best first from each
+        def interleave(results):
+            return [post for rank in itertools.zip_longest(*results)
+                    for post in rank if post is not None]
+
+        return offset_pages('posts/search', {'q': request.args.get('q', '')},
+                            interleave, default_limit=20)
+
+    def liked(user_id):
+        # a user's likes are on the shards of the posts they liked
+        def concatenate(results):
+            return [post for result in results for post in result]
+
+        return offset_pages('users/{}/liked'.format(user_id), {},
+                            concatenate)
+
+    def comment_likes(entry):
+        return entry['comment']['numLikes']
+
+    def post_likes(post):
+        return post['numLikes']
+
+    @app.route(API_URL + '<path:path>', methods=METHODS)
+    def route(path):
+        parts = path.split('/')
+
+        try:
+            if path == 'ready' and request.method == 'GET':
+                return ready()
+            if path == 'users':
+                return users()
+
+            if parts[0] == 'users' and len(parts) > 1 and parts[1].isdigit():
+                user_id = int(parts[1])
+                rest = parts[2:]
+
+                if not rest:
+                    return single_user(user_id)
+                if request.method == 'GET' and rest == ['liked']:
+                    return liked(user_id)
+                if (request.method == 'GET' and
+                        rest == ['leaderboard', 'comments']):
+                    # their comments are on other users' posts
+                    return most_liked(path, comment_likes)
+
+                return passed_on(forward(shards.owner(user_id)))
+
+            if request.method == 'GET':
+                if path == 'posts/search':
+                    return search()
+                if path == 'timeline':
+                    return timeline()
+                if path == 'leaderboard/posts':
+                    return most_liked(path, post_likes)
+                if path == 'leaderboard/comments':
+                    return most_liked(path, comment_likes)
+        except ValueError:
+            return '', 400
+
+        return '', 404
+
+    return app
+
+
+def main():
+    if len(sys.argv) != 2:
+        print('usage: python router.py num_shards')
+        sys.exit(1)
+
+    num_shards = int(sys.argv[1])
+    port = int(os.environ.get('BLOG_PORT', 5000))
+    ports = [port + 1 + shard for shard in range(num_shards)]
+
+    workers = [
+        subprocess.Popen(
+            [sys.executable, 'api.py'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=dict(os.environ, BLOG_SHARD=str(shard),
+                     BLOG_SHARDS=str(num_shards),
+                     BLOG_PORT=str(shard_port)))
+        for shard, shard_port in enumerate(ports)]
+
+    try:
+        shards = Shards(ports)
+        shards.wait_until_up()
+        create_router(shards).run(port=port, threaded=True)
+    finally:
+        for worker in workers:
+            worker.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import heapq
+import math
+import re
+
+'''
+Full-text search over every post's title and content
+
+An inverted index maps each word to the posts it appears in and how
+often. A query only looks at the posts containing every one of its
+words, starting from the rarest word, and ranks them with BM25 so
+posts where the words are frequent (and short posts) come first.
+Words in the title count twice.
+
+The index is built from the whole store the first time it's searched
+and kept up to date after that through the store's post_added,
+post_updated, post_deleted and user_deleted notifications. Building
+lazily keeps startup, and snapshot loading, as fast as before.
+'''
+
+TOKEN = re.compile(r'\w+')
+TITLE_WEIGHT = 2
+
+# BM25 parameters, these are the usual defaults
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+
+class SearchIndex:
+
+    def __init__(self, blog):
+        self.blog = blog
+        self.built = False
+
+        # word -> {post key: count}, a post key is (user id, post id)
+        self.postings = {}
+
+        # post key -> (post, {word: count}, length)
+        self.docs = {}
+        self.total_length = 0
+
+        blog.add_observer(self)
+
+    def build(self):
+        self.built = True
+
+        for user in self.blog.users:
+            for post in user.posts:
+                self.add(post)
+
+    def add(self, post):
+        counts = {}
+
+        for word in tokenize(post.title):
+            counts[word] = counts.get(word, 0) + TITLE_WEIGHT
+        for word in tokenize(post.content):
+            counts[word] = counts.get(word, 0) + 1
+
+        key = (post.user.id, post.id)
+        length = sum(counts.values())
+
+        for word, count in counts.items():
+            self.postings.setdefault(word, {})[key] = count
+
+        self.docs[key] = (post, counts, length)
+        self.total_length += length
+
+    def remove(self, key):
+        doc = self.docs.pop(key, None)
+
+        if not doc:
+            return
+
+        _, counts, length = doc
+        self.total_length -= length
+
+        for word in counts:
+            posting = self.postings[word]
+            del posting[key]
+
+            if not posting:
+                del self.postings[word]
+
+    # store notifications, ignored until the index is first built
+
+    def post_added(self, post):
+        if self.built:
+            self.add(post)
+
+    def post_updated(self, post):
+        if self.built:
+            self.remove((post.user.id, post.id))
+            self.add(post)
+
+    def post_deleted(self, post):
+        if self.built:
+            self.remove((post.user.id, post.id))
+
+    def user_deleted(self, user):
+        if self.built:
+            for post in user.posts:
+                self.remove((user.id, post.id))
+
+    def search(self, query, offset=0, limit=20):
+        '''
+        Returns up to limit posts matching every word in query, best
+        match first, skipping the first offset matches
+        '''
+        if not self.built:
+            self.build()
+
+        words = set(tokenize(query))
+        postings = [self.postings.get(word) for word in words]
+
+        if not words or not all(postings):
+            return []
+
+        # check candidates from the rarest word against the others
+        postings.sort(key=len)
+        rarest, others = postings[0], postings[1:]
+        candidates = [key for key in rarest
+                      if all(key in posting for posting in others)]
+
+        num_docs = len(self.docs)
+        average_length = self.total_length / num_docs
+        weights = [math.log(1 + (num_docs - len(posting) + 0.5) /
+                            (len(posting) + 0.5))
+                   for posting in postings]
+
+        def score(key):
+            length = self.docs[key][2]
+            norm = K1 * (1 - B + B * length / average_length)
+            total = 0
+
+            for weight, posting in zip(weights, postings):
+                count = posting[key]
+                total += weight * count * (K1 + 1) / (count + norm)
+
+            # ties go to the oldest post so pages stay stable
+            return total, -key[0], -key[1]
+
+        best = heapq.nlargest(offset + limit, candidates, key=score)
+        return [self.docs[key][0] for key in best[offset:]]
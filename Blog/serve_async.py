@@ -0,0 +1,113 @@
+import asyncio
+import os
+import sys
+
+# the modules both APIs share are in shared/, at the top of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api import create_app
+from shared.asgi import ASGIApp, serve
+from store import config_from_env
+
+'''
+Serves the blog API from asyncio instead of a thread per connection
+
+    python serve_async.py
+
+or with any ASGI server, e.g. uvicorn serve_async:application
+
+Requests are run on worker threads and connections wait on the event
+loop (see shared/asgi.py). Journal entries are still on disk before a
+change is acknowledged, but a request's worker doesn't wait for the
+disk: record only queues the entry, and a request that recorded any
+waits on a DurableWait on the loop once its worker is done. Requests
+that didn't, like every GET, answer straight away. One flush at a time
+runs on another thread, and every request that arrives during a flush
+goes into the next one, the same group commit journal.py does for
+threads. If a flush fails, the requests waiting on it get a 500.
+'''
+
+# where a request's worker leaves the seq of what it recorded
+RECORDED = 'blog.journal_seq'
+
+
+class DurableWait:
+
+    def __init__(self, journal, wsgi_app):
+        self.journal = journal
+        self.app = wsgi_app
+        self.waiters = []
+        self.flushing = False
+
+    def wsgi_app(self, environ, start_response):
+        # runs on the request's worker thread, where it recorded
+        self.journal.take_recorded()
+
+        try:
+            return self.app(environ, start_response)
+        finally:
+            environ[RECORDED] = self.journal.take_recorded()
+
+    async def after_request(self, environ):
+        seq = environ.get(RECORDED)
+
+        if seq is None or self.journal.durable_seq >= seq:
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+
+        if not self.flushing:
+            asyncio.create_task(self.flush())
+
+        await waiter
+
+    async def flush(self):
+        loop = asyncio.get_running_loop()
+        self.flushing = True
+
+        try:
+            while self.waiters:
+                # everyone waiting now has their entries at or below seq
+                waiters, self.waiters = self.waiters, []
+                seq = self.journal.seq
+
+                try:
+                    await loop.run_in_executor(None, self.journal.wait_durable,
+                                               seq)
+                except Exception as e:
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(e)
+                else:
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_result(None)
+        finally:
+            self.flushing = False
+
+
+app = create_app(config_from_env())
+store = app.extensions['blog']
+
+durable = DurableWait(store.journal, app.wsgi_app)
+store.journal.wait_for_disk = False
+
+
+async def startup():
+    # loads on a worker thread, requests get a 503 until it's done
+    store.startup.start()
+
+
+async def shutdown():
+    if store.startup.ready.is_set():
+        await asyncio.get_running_loop().run_in_executor(
+            None, store.journal.close)
+
+
+application = ASGIApp(durable.wsgi_app, after_request=durable.after_request,
+                      startup=startup, shutdown=shutdown)
+
+
+if __name__ == '__main__':
+    serve(application, port=int(os.environ.get('BLOG_PORT', 5000)))
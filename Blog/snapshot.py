@@ -0,0 +1,312 @@
+import mmap
+import os
+import struct
+import sys
+
+# the modules both APIs share are in shared/, at the top of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import BlogUsers, User, Post, Comment, SocialMedia, \
+    IndexedCollection, LikeColumns
+
+'''
+Binary snapshots of the blog
+
+Parsing users.json and posts.json means building every object before
+the API can answer anything. A snapshot is the same data in a compact
+binary layout that is memory mapped on startup instead. Loading only
+reads the header, the users, a user's posts, a post's comments and
+every set of likes are decoded the first time something touches them.
+
+All numbers are little endian, strings are a u32 byte length followed
+by UTF-8. Children are written before their parents so each parent
+can store the offsets of its children:
+
+    header   magic, u64 journal seq, u32 next user id,
+             u32 user count, u64 offset of the user table
+    users    u32 count + u64 offset per user, in id order
+    user     u32 id, name, about, profile image, u32 next social id,
+             u32 next post id, u32 count + socials (u32 id, network,
+             url, icon), u32 count + u64 offset per post
+    post     u32 id, title, content, u64 date posted,
+             u32 next comment id, likes, u32 count + u64 offset per comment
+    comment  u32 id, u32 author id, content, u64 date posted, likes
+    likes    u32 count, u32 next sequence number +
+             (u32 user id, u64 date posted, u32 sequence number) per like
+
+Dates are the models' integer timestamps. Sequence numbers are kept so
+that like cursors handed out before a restart still work after it.
+
+Convert the JSON files with:
+    python snapshot.py users.json posts.json blog.snapshot
+'''
+
+MAGIC = b'BLOGSNP3'
+
+HEADER = struct.Struct('<8sQIIQ')
+U32 = struct.Struct('<I')
+U64 = struct.Struct('<Q')
+LIKE = struct.Struct('<IQI')
+
+
+class SnapshotWriter:
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.offset += len(data)
+
+    def u32(self, value):
+        self.write(U32.pack(value))
+
+    def u64(self, value):
+        self.write(U64.pack(value))
+
+    def str(self, value):
+        data = value.encode('utf-8')
+        self.u32(len(data))
+        self.write(data)
+
+    def offsets(self, offsets):
+        self.u32(len(offsets))
+        for offset in offsets:
+            self.u64(offset)
+
+
+class SnapshotReader:
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def u32(self, offset):
+        return U32.unpack_from(self.map, offset)[0], offset + 4
+
+    def u64(self, offset):
+        return U64.unpack_from(self.map, offset)[0], offset + 8
+
+    def str(self, offset):
+        length, offset = self.u32(offset)
+        end = offset + length
+        return self.map[offset:end].decode('utf-8'), end
+
+    def offsets(self, offset):
+        count, offset = self.u32(offset)
+        end = offset + 8 * count
+        return struct.unpack_from('<{}Q'.format(count), self.map,
+                                  offset), end
+
+
+def write_snapshot(blog, path, seq=0):
+    # written to a temp file and renamed, so a crash never leaves
+    # a half written snapshot and a mapped old one stays valid
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'wb') as f:
+        out = SnapshotWriter(f)
+        out.write(bytes(HEADER.size))
+
+        # replicas (see router.py) can be added out of id order
+        users = sorted(blog.users, key=lambda user: user.id)
+        user_offsets = [write_user(out, user) for user in users]
+        users_offset = out.offset
+        out.offsets(user_offsets)
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, seq, blog.next_user_id,
+                            len(user_offsets), users_offset))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+
+def write_user(out, user):
+    post_offsets = [write_post(out, post) for post in user.posts]
+
+    offset = out.offset
+    out.u32(user.id)
+    out.str(user.name)
+    out.str(user.about)
+    out.str(user.profile_image)
+    out.u32(user.next_social_id)
+    out.u32(user.next_post_id)
+
+    out.u32(len(user.social_medias))
+    for social in user.social_medias:
+        out.u32(social.id)
+        out.str(social.network)
+        out.str(social.url)
+        out.str(social.icon)
+
+    out.offsets(post_offsets)
+    return offset
+
+
+def write_post(out, post):
+    comment_offsets = [write_comment(out, comment)
+                       for comment in post.comments]
+
+    offset = out.offset
+    out.u32(post.id)
+    out.str(post.title)
+    out.str(post.content)
+    out.u64(post.date_posted)
+    out.u32(post.next_comment_id)
+    write_likes(out, post)
+    out.offsets(comment_offsets)
+    return offset
+
+
+def write_comment(out, comment):
+    offset = out.offset
+    out.u32(comment.id)
+    out.u32(comment.user.id)
+    out.str(comment.content)
+    out.u64(comment.date_posted)
+    write_likes(out, comment)
+    return offset
+
+
+def write_likes(out, text):
+    # counted as written, the length of likes that haven't been loaded
+    # yet still counts those of users deleted since
+    rows = [LIKE.pack(user.id, date_posted, seq)
+            for user, date_posted, seq in text.likes.numbered_rows()]
+
+    out.u32(len(rows))
+    out.u32(text.likes.next_seq)
+    out.write(b''.join(rows))
+
+
+def is_snapshot(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_snapshot(blog, path):
+    '''
+    Maps the snapshot at path into blog, returns its journal seq
+
+    Nothing past the header is decoded until it's used
+    '''
+    reader = SnapshotReader(path)
+    magic, seq, next_user_id, num_users, users_offset = \
+        HEADER.unpack_from(reader.map, 0)
+
+    if magic != MAGIC:
+        raise ValueError('{} is not a blog snapshot'.format(path))
+
+    # keeps the mapping alive for as long as the store is
+    blog.snapshot_reader = reader
+    blog.next_user_id = next_user_id
+
+    user_offsets, _ = reader.offsets(users_offset)
+    blog.users = IndexedCollection(
+        loader=lambda: [read_user(reader, blog, offset)
+                        for offset in user_offsets],
+        length=num_users)
+
+    return seq
+
+
+def read_user(reader, blog, offset):
+    user_id, offset = reader.u32(offset)
+    name, offset = reader.str(offset)
+    about, offset = reader.str(offset)
+    profile_image, offset = reader.str(offset)
+
+    user = User(name, about, profile_image, user_id, blog)
+    user.next_social_id, offset = reader.u32(offset)
+    user.next_post_id, offset = reader.u32(offset)
+
+    num_socials, offset = reader.u32(offset)
+    for _ in range(num_socials):
+        social_id, offset = reader.u32(offset)
+        network, offset = reader.str(offset)
+        url, offset = reader.str(offset)
+        icon, offset = reader.str(offset)
+        user.social_medias.append(SocialMedia(network, url, icon, social_id))
+
+    post_offsets, _ = reader.offsets(offset)
+    user.posts = IndexedCollection(
+        loader=lambda: [read_post(reader, blog, user, post_offset)
+                        for post_offset in post_offsets],
+        length=len(post_offsets))
+
+    return user
+
+
+def read_post(reader, blog, user, offset):
+    post_id, offset = reader.u32(offset)
+    title, offset = reader.str(offset)
+    content, offset = reader.str(offset)
+    date_posted, offset = reader.u64(offset)
+
+    post = Post(user, content, title, post_id)
+    post.date_posted = date_posted
+    post.next_comment_id, offset = reader.u32(offset)
+
+    offset = read_likes(reader, blog, post, offset)
+
+    comment_offsets, _ = reader.offsets(offset)
+    post.comments = IndexedCollection(
+        loader=lambda: filter(None, (
+            read_comment(reader, blog, post, comment_offset)
+            for comment_offset in comment_offsets)),
+        length=len(comment_offsets))
+
+    return post
+
+
+def read_comment(reader, blog, post, offset):
+    comment_id, offset = reader.u32(offset)
+    author_id, offset = reader.u32(offset)
+    content, offset = reader.str(offset)
+    date_posted, offset = reader.u64(offset)
+
+    author = blog.find_user(author_id)
+
+    # skip anything left behind by a deleted user
+    if not author:
+        return None
+
+    comment = Comment(author, content, comment_id, post)
+    comment.date_posted = date_posted
+    read_likes(reader, blog, comment, offset)
+    return comment
+
+
+def read_likes(reader, blog, text, offset):
+    # only the count is read now, returns the offset past the likes
+    # which are fixed size, so they can be skipped without decoding
+    num_likes, offset = reader.u32(offset)
+    next_seq, start = reader.u32(offset)
+
+    def load_likes():
+        for user_id, date_posted, seq in LIKE.iter_unpack(
+                reader.map[start:start + LIKE.size * num_likes]):
+            user = blog.find_user(user_id)
+
+            if user:
+                yield user, date_posted, seq
+
+    text.likes = LikeColumns(text, loader=load_likes, length=num_likes,
+                             next_seq=next_seq)
+    return start + LIKE.size * num_likes
+
+
+def convert(users_json, posts_json, path):
+    blog = BlogUsers(users_json, posts_json)
+    write_snapshot(blog, path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        print('usage: python snapshot.py users.json posts.json out.snapshot')
+        sys.exit(1)
+
+    convert(*sys.argv[1:])
@@ -0,0 +1,114 @@
+import os
+
+from models import BlogUsers
+from loader import LoadProgress
+from journal import Journal
+from search import SearchIndex
+from timeline import Timeline
+from leaderboard import LikesLeaderboards
+from shared.startup import Startup
+from shared import cache
+
+'''
+Everything one app serves: the store, its journal and the indexes
+
+Building a BlogStore doesn't read anything, load does, on a background
+thread (see shared/startup.py). The data is restored from the binary snapshot
+when there is one, which maps the file instead of reading it, so
+workers forked from one server share its pages through the OS page
+cache. The JSON files are only read to seed a brand new store.
+'''
+
+DEFAULTS = {
+    'BLOG_USERS': 'users.json',
+    'BLOG_POSTS': 'posts.json',
+    'BLOG_JOURNAL': 'blog.journal',
+    'BLOG_SNAPSHOT': 'blog.snapshot',
+    'BLOG_SHARD': 0,
+    'BLOG_SHARDS': 1,
+    'BLOG_LOAD': 'lazy',
+    'METRICS_PROFILE': '',
+    'METRICS_PROFILE_EVERY': 100,
+    'RESPONSE_CACHE_ENTRIES': 4096,
+    'RESPONSE_CACHE_BYTES': 64 * 1024 * 1024,
+}
+
+
+def config_from_env(**overrides):
+    '''
+    Reads the BLOG_* environment variables router.py sets for each
+    shard, each shard gets its own journal and snapshot
+    '''
+    config = dict(DEFAULTS, **overrides)
+
+    for key in DEFAULTS:
+        if key in os.environ:
+            config[key] = os.environ[key]
+
+    config['BLOG_SHARD'] = int(config['BLOG_SHARD'])
+    config['BLOG_SHARDS'] = int(config['BLOG_SHARDS'])
+
+    if config['BLOG_SHARDS'] > 1:
+        name = 'blog-{}'.format(config['BLOG_SHARD'])
+        config['BLOG_JOURNAL'] = name + '.journal'
+        config['BLOG_SNAPSHOT'] = name + '.snapshot'
+
+    return config
+
+
+class BlogStore:
+
+    def __init__(self, config):
+        self.config = config
+
+        self.blog = BlogUsers()
+        self.blog.set_shard(config['BLOG_SHARD'], config['BLOG_SHARDS'])
+
+        # every change is journaled, so the store is rebuilt from the
+        # snapshot and journal on restart and only seeded from the
+        # JSON once
+        self.journal = Journal(self.blog, config['BLOG_JOURNAL'],
+                               config['BLOG_SNAPSHOT'])
+
+        # full-text search over every post, built on the first search
+        self.search = SearchIndex(self.blog)
+
+        # the newest posts across every user
+        self.timeline = Timeline(self.blog)
+
+        # the most liked posts and comments, overall and per user
+        self.leaderboards = LikesLeaderboards(self.blog)
+
+        # ETags and encoded GET responses, kept current by every write
+        self.responses = cache.from_config(config)
+
+        self.startup = Startup(self.load, config['BLOG_LOAD'])
+
+    @property
+    def num_shards(self):
+        return self.blog.num_shards
+
+    def load(self, startup):
+        with startup.phase('recover'):
+            recovered = self.journal.recover()
+
+        if recovered:
+            return
+
+        def report(path, read, total, count):
+            startup.report(file=os.path.basename(path), read=read,
+                           size=total, loaded=count)
+
+        progress = LoadProgress(report)
+        with startup.phase('seed'):
+            self.blog.load_users(self.config['BLOG_USERS'],
+                                 self.config['BLOG_POSTS'], progress)
+            self.blog.drop_other_shards()
+
+        print(' * Seeded {} from JSON in {:.2f}s'.format(
+            ', '.join('{} {}'.format(count, os.path.basename(path))
+                      for path, count in progress.counts.items()),
+            progress.elapsed))
+
+        with startup.phase('snapshot'):
+            self.journal.snapshot()
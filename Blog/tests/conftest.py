@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+# the blog's modules import each other from the Blog directory
+blog_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, blog_dir)
+
+from api import api_url, create_app  # noqa: E402
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    '''
+    Builds apps over one store in tmp_path, seeded from the sample
+    JSON, building another one restarts the store
+    '''
+    apps = []
+
+    def make(**config):
+        app = create_app(dict({
+            'BLOG_USERS': os.path.join(blog_dir, 'users.json'),
+            'BLOG_POSTS': os.path.join(blog_dir, 'posts.json'),
+            'BLOG_JOURNAL': str(tmp_path / 'blog.journal'),
+            'BLOG_SNAPSHOT': str(tmp_path / 'blog.snapshot'),
+            'BLOG_LOAD': 'eager',
+        }, **config))
+        apps.append(app)
+        return app
+
+    yield make
+
+    for app in apps:
+        app.extensions['blog'].journal.close()
+
+
+@pytest.fixture
+def url():
+    def make(path, *args):
+        return api_url + path.format(*args)
+    return make
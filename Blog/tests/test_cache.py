@@ -0,0 +1,31 @@
+'''
+ETags: a 304 while nothing has changed, and a new body after a write
+'''
+
+
+def test_write_invalidates_the_etag(make_app, url):
+    client = make_app().test_client()
+    post = url('users/0/posts/0')
+    timeline = url('timeline')
+
+    first = client.get(post)
+    etag = first.headers['ETag']
+    timeline_etag = client.get(timeline).headers['ETag']
+
+    polled = client.get(post, headers={'If-None-Match': etag})
+    assert polled.status_code == 304
+    assert polled.data == b''
+
+    assert client.patch(post, json={'title': 'changed'}).status_code == 201
+
+    changed = client.get(post, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.get_json()['title'] == 'changed'
+    assert changed.headers['ETag'] != etag
+
+    # the timeline lists the post, so it changed too
+    assert client.get(timeline, headers={
+        'If-None-Match': timeline_etag}).status_code == 200
+
+    assert client.get(post, headers={
+        'If-None-Match': changed.headers['ETag']}).status_code == 304
@@ -0,0 +1,46 @@
+'''
+Replaying the journal after a crash that tore its last entry
+'''
+
+
+def like_user_ids(client, url, post_id):
+    return [like['user']['id'] for like in
+            client.get(url('users/1/posts/{}/likes', post_id)).get_json()]
+
+
+def top_post_ids(client, url):
+    return [post['postID'] for post in
+            client.get(url('leaderboard/posts')).get_json()]
+
+
+def test_replay_drops_a_torn_tail(make_app, url, tmp_path):
+    client = make_app().test_client()
+
+    post_id = client.post(url('users/1/posts'),
+                          json={'title': 'new', 'content': 'post'}
+                          ).get_json()['postID']
+    # the post's owner is the one who likes it
+    assert client.post(url('users/1/posts/{}/likes', post_id),
+                       json={'userID': 1}).status_code == 201
+    top = top_post_ids(client, url)
+    assert post_id in top
+
+    # a crash part way through appending the next entry
+    with open(tmp_path / 'blog.journal', 'a') as f:
+        f.write('[3, "delete_like", 1, ')
+
+    client = make_app().test_client()
+
+    assert like_user_ids(client, url, post_id) == [1]
+    assert top_post_ids(client, url) == top
+
+    # the torn entry was cut off, so the next one isn't glued onto it
+    assert client.delete(url('users/1/posts/{}/likes/1',
+                             post_id)).status_code == 204
+    with open(tmp_path / 'blog.journal') as f:
+        assert f.read().endswith('\n')
+
+    client = make_app().test_client()
+
+    assert like_user_ids(client, url, post_id) == []
+    assert post_id not in top_post_ids(client, url)
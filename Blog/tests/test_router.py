@@ -0,0 +1,91 @@
+'''
+A like and a comment across shards, and deleting the user who made them
+'''
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from router import Shards, create_router
+
+blog_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def router(tmp_path):
+    ports = [free_port(), free_port()]
+
+    # each shard writes its journal and snapshot to tmp_path
+    workers = [
+        subprocess.Popen(
+            [sys.executable, os.path.join(blog_dir, 'api.py')],
+            cwd=str(tmp_path),
+            env=dict(os.environ, BLOG_SHARD=str(shard), BLOG_SHARDS='2',
+                     BLOG_PORT=str(port),
+                     BLOG_USERS=os.path.join(blog_dir, 'users.json'),
+                     BLOG_POSTS=os.path.join(blog_dir, 'posts.json')),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for shard, port in enumerate(ports)]
+
+    try:
+        shards = Shards(ports)
+        shards.wait_until_up()
+        client = create_router(shards).test_client()
+
+        deadline = time.monotonic() + 30
+        while client.get('/blogr/api/v1/ready').status_code != 200:
+            assert time.monotonic() < deadline, 'the shards never loaded'
+            time.sleep(0.1)
+
+        yield shards, client
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+
+
+def test_deleting_a_user_takes_their_likes_on_other_shards(router, url):
+    shards, client = router
+
+    user_id = client.post(url('users'), json={
+        'name': 'liker', 'about': 'likes things', 'profileImage': 'image',
+        'socialMedia': []}).get_json()['id']
+
+    # a post owned by a user on the other shard
+    owner_id = next(owner for owner in (0, 1)
+                    if shards.owner(owner) != shards.owner(user_id))
+    post_id = client.get(url('users/{}/posts', owner_id)).get_json()[0][
+        'postID']
+
+    assert client.post(url('users/{}/posts/{}/likes/bulk', owner_id, post_id),
+                       json=[{'userID': user_id}]).status_code == 201
+    assert client.post(url('users/{}/posts/{}/comments', owner_id, post_id),
+                       json={'userID': user_id,
+                             'content': 'from the other shard'}
+                       ).status_code == 201
+
+    def likers():
+        return [like['user']['id'] for like in client.get(
+            url('users/{}/posts/{}/likes', owner_id, post_id)).get_json()]
+
+    def commenters():
+        return [comment['user']['id'] for comment in client.get(
+            url('users/{}/posts/{}/comments', owner_id, post_id)).get_json()]
+
+    assert user_id in likers() and user_id in commenters()
+    liked = client.get(url('users/{}/liked', user_id)).get_json()
+    assert [post['postID'] for post in liked] == [post_id]
+
+    assert client.delete(url('users/{}', user_id)).status_code == 204
+
+    assert user_id not in likers() and user_id not in commenters()
+    assert client.get(url('users/{}', user_id)).status_code == 404
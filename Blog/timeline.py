@@ -0,0 +1,100 @@
+import heapq
+from collections import deque
+
+'''
+The home timeline, the newest posts across every user
+
+The newest capacity posts are kept in a ring buffer that the store
+updates through its post_added notification, so reading the first
+pages never has to look at every user. Deleted posts are skipped when
+read rather than searched for in the ring.
+
+The ring is filled on the first read with a k-way merge over every
+user's posts, newest first. The timeline only goes as far back as the
+ring, going deeper would mean a merge over every user's posts for each
+page, so once the ring is full a cursor past its oldest post is
+refused with a PastTimeline error.
+'''
+
+
+class PastTimeline(ValueError):
+    pass
+
+
+def post_key(post):
+    # posts are ordered by date, then by who posted them for ties
+    return post.date_posted, post.user.id, post.id
+
+
+class Timeline:
+
+    def __init__(self, blog, capacity=1000):
+        self.blog = blog
+        self.capacity = capacity
+        self.recent = None
+
+        blog.add_observer(self)
+
+    @property
+    def built(self):
+        return self.recent is not None
+
+    def build(self):
+        self.recent = deque(maxlen=self.capacity)
+
+        newest = []
+        for post in self.merged():
+            newest.append(post)
+            if len(newest) == self.capacity:
+                break
+
+        # the ring is oldest on the left, newest on the right
+        self.recent.extend(reversed(newest))
+
+    def merged(self):
+        # each user's posts are already newest first, merging them
+        # only looks as far into each user as the page needs
+        return heapq.merge(*(user.posts.newest_first()
+                             for user in self.blog.users),
+                           key=post_key, reverse=True)
+
+    def post_added(self, post):
+        if self.recent is not None:
+            self.recent.append(post)
+
+    def is_live(self, post):
+        return (self.blog.find_user(post.user.id) is post.user and
+                post.user.find_post(post.id) is post)
+
+    def latest(self, limit, before=None):
+        '''
+        Returns up to limit of the newest posts older than the key
+        before, and the key to continue from, or None at the end
+        '''
+        if self.recent is None:
+            self.build()
+
+        page = []
+
+        # one extra post says whether there's another page
+        for post in self.newest(before):
+            if len(page) == limit:
+                return page, post_key(page[-1])
+            page.append(post)
+
+        return page, None
+
+    def newest(self, before):
+        recent = self.recent
+
+        # a ring that isn't full holds every post there is
+        if (before is not None and len(recent) == self.capacity and
+                before <= post_key(recent[0])):
+            raise PastTimeline('the timeline only goes back {} posts'.format(
+                self.capacity))
+
+        for post in reversed(recent):
+            if before is not None and post_key(post) >= before:
+                continue
+            if self.is_live(post):
+                yield post
@@ -1,26 +1,188 @@
+import os
+import sys
+from functools import wraps
 
-from flask import Flask, jsonify, request, make_response
+from flask import Flask, current_app, request
 from flask_restful import Resource, Api
-from models import TodoListContainer
+from flask_restful.utils import unpack
+from werkzeug.local import LocalProxy
+from werkzeug.wrappers import Response as ResponseBase
 
-app = Flask(__name__)
-api = Api(app)
+# the modules both APIs share are in shared/, at the top of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from encoding import json_response, output_json
+from shared.pagination import page_args, page_headers
+from shared import bulk
+from shared import expand
+from shared import fields
+from shared import metrics
+from models import ITEM_FIELDS, LIST_FIELDS, LIST_RELATIONS
+from store import DEFAULTS, TodoStore
+
+api = Api()
+api.representations['application/json'] = output_json
 
 api_url = '/api/v1/'
-todo_data = TodoListContainer('lists.json')
+
+
+def create_app(config=None):
+    '''
+    Builds an app over its own lists, config overrides store.DEFAULTS
+
+    Nothing is read until the store loads, see shared/startup.py
+    '''
+    app = Flask(__name__)
+    app.config.update(DEFAULTS)
+    app.config.update(config or {})
+
+    store = TodoStore(app.config)
+    app.extensions['todo'] = store
+
+    api.init_app(app)
+
+    # installed first so requests held back while loading are timed too
+    app.extensions['metrics'] = metrics.from_config(app.config)
+    app.extensions['metrics'].install(app)
+    store.startup.ungated.update(metrics.Metrics.endpoints)
+
+    fields.install(app)
+    expand.install(app)
+
+    store.startup.install(app, api_url)
+    return app
+
+
+# the global objects used to access the backend
+todo_data = LocalProxy(lambda: current_app.extensions['todo'].todo)
+persister = LocalProxy(lambda: current_app.extensions['todo'].persister)
+responses = LocalProxy(lambda: current_app.extensions['todo'].responses)
+
+
+# requests can be served from many threads at once, each one locks what
+# it touches (see shared/locking.py): a request under
+# todolists/<list_id> locks that list and its items, anything else the
+# whole container.
+# Every write bumps the versions of what it changed before unlocking,
+# and GETs are answered with ETags and from the response cache (see
+# shared/cache.py), with what they read locked
+def subtree(kwargs):
+    # the path a request under todolists/<list_id> reads or writes
+    if kwargs.get('list_id') is None:
+        return ()
+    return (kwargs['list_id'],)
+
+
+def reads(func):
+    @wraps(func)
+    def locked(*args, **kwargs):
+        with todo_data.locks.reading(kwargs.get('list_id')):
+            return func(*args, **kwargs)
+    return locked
+
+
+def writes(func):
+    @wraps(func)
+    def locked(*args, **kwargs):
+        with todo_data.locks.writing(kwargs.get('list_id')):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                responses.versions.bump(subtree(kwargs))
+    return locked
+
+
+def writes_all(func):
+    @wraps(func)
+    def locked(*args, **kwargs):
+        with todo_data.locks.writing():
+            try:
+                return func(*args, **kwargs)
+            finally:
+                responses.versions.bump(shared=True)
+    return locked
+
+
+def as_response(result):
+    # what a Resource returned, as flask_restful would send it
+    if isinstance(result, ResponseBase):
+        return result
+
+    data, code, headers = unpack(result)
+    return api.make_response(data, code, headers=headers)
+
+
+def cached(func):
+    # goes before the lock decorator so it runs with the lock held
+    @wraps(func)
+    def get(*args, **kwargs):
+        return responses.serve(subtree(kwargs),
+                               lambda: as_response(func(*args, **kwargs)))
+    return get
+
+
+subtree_locks = {'get': [cached, reads], 'post': [writes], 'put': [writes],
+                 'patch': [writes], 'delete': [writes]}
+
+
+def takes_batch(func):
+    # parses a bulk write's objects before its list is locked, they're
+    # passed on as batch (see shared/bulk.py)
+    @wraps(func)
+    def parsed(*args, **kwargs):
+        try:
+            batch = bulk.items()
+        except ValueError as error:
+            return json_response({'error': str(error)}, 400)
+        return func(*args, batch=batch, **kwargs)
+    return parsed
+
+
+bulk_writes = {'post': [writes, takes_batch]}
+
+
+def shaped(table, relations=None):
+    '''
+    How models are turned into dicts for this request, whole or just
+    the keys fields= asks for
+
+    Endpoints that pass the models' relations table also embed what
+    expand= asks for, they must hold the lock of the list it's in
+    '''
+    tree = fields.requested()
+    embed = expand.requested() if relations else None
+
+    if embed is not None:
+        embedder = expand.Embedder(embed, relations)
+
+        if tree is None:
+            return embedder
+        return lambda model: fields.project(embedder(model), tree)
+
+    if tree is None:
+        return lambda model: model.create_dict()
+    return fields.compile(tree, table)
 
 
 class TodoListResource(Resource):
+    method_decorators = subtree_locks
+
     def get(self):
         # return the lists that match the query params
         # the query params are optional
         name = request.args.get('name')
         description = request.args.get('description')
 
+        try:
+            after, limit = page_args(request.args)
+        except ValueError:
+            return None, 400
+
         # search_list handles validating the query params
         # if both are none, all the lists are provided
-        basic_todolists = todo_data.search_lists(name, description)
-        return make_response(jsonify(basic_todolists), 201)
+        basic_todolists, next_id = todo_data.search_lists(
+            name, description, after, limit, shaped(LIST_FIELDS))
+        return json_response(basic_todolists, 201, page_headers(next_id))
 
     def post(self):
         # create a new list from JSON provided by user
@@ -30,14 +192,17 @@ class TodoListResource(Resource):
             return None, 400
 
         new_list = todo_data.add_list(content['name'], content['description'])
+        persister.mark_dirty()
 
-        return make_response(jsonify(new_list.create_dict()), 201)
+        return json_response(shaped(LIST_FIELDS)(new_list), 201)
 
 
 api.add_resource(TodoListResource, api_url + 'todolists')
 
 
 class SingleTodoListResource(Resource):
+    # deleting a list changes which lists exist
+    method_decorators = dict(subtree_locks, delete=[writes_all])
 
     def get(self, list_id):
         # Return the info for a specific list
@@ -45,7 +210,7 @@ class SingleTodoListResource(Resource):
 
         if not todo:
             return None, 404
-        return make_response(jsonify(todo.create_dict()), 200)
+        return json_response(shaped(LIST_FIELDS, LIST_RELATIONS)(todo), 200)
 
     def put(self, list_id):
         # Update the list information
@@ -65,8 +230,9 @@ class SingleTodoListResource(Resource):
         # update the model
         todolist.name = name
         todolist.description = description
+        persister.mark_dirty()
 
-        return make_response(jsonify(todolist.create_dict()), 200)
+        return json_response(shaped(LIST_FIELDS)(todolist), 200)
 
     def patch(self, list_id):
         # update todolist with partial information
@@ -84,11 +250,13 @@ class SingleTodoListResource(Resource):
             todolist.name = name
         if description:
             todolist.description = description
+        persister.mark_dirty()
 
-        return make_response(jsonify(todolist.create_dict()), 200)
+        return json_response(shaped(LIST_FIELDS)(todolist), 200)
 
     def delete(self, list_id):
         if todo_data.delete_list(list_id):
+            persister.mark_dirty()
             return None, 204
 
         return None, 404
@@ -98,6 +266,7 @@ api.add_resource(SingleTodoListResource, api_url + 'todolists/<int:list_id>')
 
 
 class TodoItemResource(Resource):
+    method_decorators = subtree_locks
 
     def get(self, list_id):
         # Get all todo items for a given list
@@ -106,8 +275,15 @@ class TodoItemResource(Resource):
         if not todolist:
             return None, 400
 
-        todo_items = map(lambda item: item.create_dict(), todolist.items)
-        return make_response(jsonify(list(todo_items)), 200)
+        try:
+            after, limit = page_args(request.args)
+        except ValueError:
+            return None, 400
+
+        todo_items, next_id = todolist.items.page(after, limit)
+
+        todo_items = map(shaped(ITEM_FIELDS), todo_items)
+        return json_response(list(todo_items), 200, page_headers(next_id))
 
     def post(self, list_id):
         # create a new todo item with user's JSON
@@ -123,15 +299,50 @@ class TodoItemResource(Resource):
             return None, 400
 
         new_item = todolist.add_item(task)
+        persister.mark_dirty()
 
-        return make_response(jsonify(new_item.create_dict()), 201)
+        return json_response(shaped(ITEM_FIELDS)(new_item), 201)
 
 
 api.add_resource(TodoItemResource, api_url +
                  'todolists/<int:list_id>/todoitems')
 
 
+def check_item(data):
+    task = data.get('task')
+
+    if not task or not isinstance(task, str):
+        return 'task is required'
+
+
+class BulkTodoItemResource(Resource):
+    method_decorators = bulk_writes
+
+    def post(self, list_id, batch):
+        todolist = todo_data.find_list(list_id)
+
+        if not todolist:
+            return None, 404
+
+        results = bulk.rejected(batch, check_item)
+
+        if results:
+            return json_response(results, 400)
+
+        new_items = [todolist.add_item(data['task']) for data in batch]
+        persister.mark_dirty()
+
+        shape = shaped(ITEM_FIELDS)
+        return json_response([{'item': shape(item), 'status': 201}
+                              for item in new_items], 201)
+
+
+api.add_resource(BulkTodoItemResource, api_url +
+                 'todolists/<int:list_id>/todoitems/bulk')
+
+
 class SingleTodoItemResource(Resource):
+    method_decorators = subtree_locks
 
     def get(self, list_id, item_id):
         # return the specific todo item
@@ -140,7 +351,7 @@ class SingleTodoItemResource(Resource):
         if not item:
             return None, 404
 
-        return make_response(jsonify(item.create_dict()), 200)
+        return json_response(shaped(ITEM_FIELDS)(item), 200)
 
     def put(self, list_id, item_id):
         # update all info on a task (i.e. task, is_finished)
@@ -160,8 +371,9 @@ class SingleTodoItemResource(Resource):
         # update all info
         item.task = task
         item.is_finished = is_finished
+        persister.mark_dirty()
 
-        return make_response(jsonify(item.create_dict()), 200)
+        return json_response(shaped(ITEM_FIELDS)(item), 200)
 
     def patch(self, list_id, item_id):
         # update either task name or finished state
@@ -181,8 +393,9 @@ class SingleTodoItemResource(Resource):
             item.task = task
         if isinstance(is_finished, bool):
             item.is_finished = is_finished
+        persister.mark_dirty()
 
-        return make_response(jsonify(item.create_dict()), 200)
+        return json_response(shaped(ITEM_FIELDS)(item), 200)
 
     def delete(self, list_id, item_id):
         # delete the item from the list
@@ -192,6 +405,7 @@ class SingleTodoItemResource(Resource):
             return None, 404
 
         if todolist.delete_item(item_id):
+            persister.mark_dirty()
             return None, 204
 
         return None, 404
@@ -200,4 +414,8 @@ class SingleTodoItemResource(Resource):
 api.add_resource(SingleTodoItemResource, api_url +
                  'todolists/<int:list_id>/todoitems/<int:item_id>')
 
-app.run(debug=True)
+if __name__ == '__main__':
+    create_app({
+        'TODO_PATH': os.environ.get('TODO_PATH', 'lists.json'),
+        'TODO_LOAD': 'background',
+    }).run(debug=True)
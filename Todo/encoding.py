@@ -0,0 +1,15 @@
+from flask import Response
+
+from shared.encoding import dumps, loads, output_json  # noqa: F401
+
+'''
+Response encoding for the API
+
+Responses are encoded with dumps (see shared/encoding.py), which uses
+orjson when it's installed and the standard library otherwise.
+'''
+
+
+def json_response(data, status=200, headers=None):
+    return Response(dumps(data) + b'\n', status=status, headers=headers,
+                    mimetype='application/json')
@@ -1,10 +1,20 @@
 import json
+import threading
+from array import array
 from datetime import datetime
 from abc import ABC, abstractmethod
+from bisect import bisect_right
+from operator import attrgetter
+from shared.locking import StoreLocks
+from shared.metrics import counts_lookup
+from shared.expand import Relation
 
 
 class Model(ABC):
 
+    # models are slotted so each one costs as little memory as possible
+    __slots__ = ()
+
     @abstractmethod
     def print_model(self):
         pass
@@ -21,12 +31,113 @@ class Model(ABC):
         return int(id_as_str)
 
 
+# held while a lazily loaded collection loads, so readers in other
+# threads wait for it instead of seeing it half loaded
+LOAD_LOCK = threading.Lock()
+
+
+class IndexedCollection:
+    '''
+    An ordered collection of models indexed by id
+
+    Iterating yields the models in insertion order, so the JSON
+    returned for a list's items stays in the order they were added.
+    Finding and deleting go through the index, so PATCHing an item
+    costs the same no matter how long the list has lived.
+
+    Collections read from a snapshot start out unloaded, loader
+    decodes the models the first time they're needed.
+    '''
+
+    __slots__ = ('index', 'order', 'loader', 'length')
+
+    def __init__(self, loader=None, length=0):
+        self.index = {}
+        self.order = array('q')
+        self.loader = loader
+        self.length = length
+
+    def load(self):
+        if self.loader:
+            with LOAD_LOCK:
+                if self.loader:
+                    for model in self.loader():
+                        self.index[model.id] = model
+                        self.order.append(model.id)
+
+                    self.loader = None
+
+    def append(self, model):
+        self.load()
+        self.index[model.id] = model
+        self.order.append(model.id)
+
+    def find(self, model_id):
+        self.load()
+        return self.index.get(model_id)
+
+    def remove(self, model_id):
+        self.load()
+
+        if self.index.pop(model_id, None) is None:
+            return False
+
+        # deleted ids stay in order until they're most of it
+        if len(self.order) > 2 * len(self.index) + 16:
+            self.order = array('q', self.index)
+        return True
+
+    def page(self, after=None, limit=None, where=None):
+        '''
+        Returns up to limit models with ids after the id after, and
+        the id to continue from, or None if this was the last page
+
+        ids only ever go up, so order is sorted and finding where a
+        page starts is a binary search, however deep the page is.
+        where optionally filters which models count.
+        '''
+        self.load()
+
+        # compacting replaces order, a reader keeps the one it started on
+        order = self.order
+        start = 0 if after is None else bisect_right(order, after)
+        page = []
+
+        for i in range(start, len(order)):
+            model = self.index.get(order[i])
+
+            if model is None or (where and not where(model)):
+                continue
+            if limit is not None and len(page) == limit:
+                # a limit of 0 leaves nothing to continue from
+                return page, page[-1].id if page else after
+
+            page.append(model)
+
+        return page, None
+
+    def __contains__(self, model_id):
+        self.load()
+        return model_id in self.index
+
+    def __iter__(self):
+        self.load()
+        return iter(self.index.values())
+
+    def __len__(self):
+        if self.loader:
+            return self.length
+        return len(self.index)
+
+
 class TodoList(Model):
 
+    __slots__ = ('name', 'description', 'items', 'id', 'next_item_id')
+
     def __init__(self, name, description, id):
         self.name = name
         self.description = description
-        self.items = []
+        self.items = IndexedCollection()
         self.id = id
         self.next_item_id = 0
 
@@ -39,27 +150,22 @@ class TodoList(Model):
 
         print(' ')
 
+    @counts_lookup
     def find_item(self, item_id):
-        for item in self.items:
-            if item.id == item_id:
-                return item
-
-        return None
+        return self.items.find(item_id)
 
     def delete_item(self, item_id):
-        for i in range(len(self.items)):
-            if self.items[i].id == item_id:
-                del self.items[i]
-                return True
+        return self.items.remove(item_id)
 
-        return False
-
-    def add_item(self, task):
+    def add_item(self, task, item_id=None):
         if not task:
             return
 
-        new_item = TodoItem(task, self.next_item_id)
-        self.next_item_id += 1
+        if item_id is None:
+            item_id = self.next_item_id
+        self.next_item_id = max(self.next_item_id, item_id + 1)
+
+        new_item = TodoItem(task, item_id)
 
         self.items.append(new_item)
         return new_item
@@ -72,9 +178,18 @@ class TodoList(Model):
 
         return list_dict
 
+    def create_save_dict(self):
+        list_dict = self.create_dict()
+        list_dict['nextItemID'] = self.next_item_id
+        list_dict['items'] = [item.create_dict() for item in list(self.items)]
+
+        return list_dict
+
 
 class TodoItem(Model):
 
+    __slots__ = ('task', 'is_finished', 'id')
+
     def __init__(self, task, id):
         self.task = task
         self.is_finished = False
@@ -95,31 +210,42 @@ class TodoItem(Model):
 
 class TodoListContainer:
 
-    def __init__(self, filepath):
+    def __init__(self, filepath=None):
         self.next_list_id = 0
+        self.todolists = IndexedCollection()
+
+        # what a request locks, a list's subtree is keyed by its id
+        # see shared/locking.py
+        self.locks = StoreLocks()
+
+        # an empty container can be filled from a snapshot instead
+        if filepath:
+            self.load(filepath)
 
+    def load(self, filepath):
         # load the data from json
         with open(filepath, 'r') as f:
             todolists_dict = json.load(f)
 
-        self.todolists = []
-
+        # ids and finished states are only in files this container
+        # saved itself, hand written files just have names and tasks
         for todolist in todolists_dict['lists']:
-            new_list = self.add_list(todolist['name'], todolist['description'])
+            new_list = self.add_list(todolist['name'], todolist['description'],
+                                     todolist.get('id'))
 
             for task in todolist['items']:
-                new_list.add_item(task['task'])
+                new_item = new_list.add_item(task['task'], task.get('id'))
+                new_item.is_finished = task.get('isFinished', False)
 
-        # for debugging
-        for todolist in self.todolists:
-            todolist.print_model()
+            new_list.next_item_id = todolist.get('nextItemID',
+                                                 new_list.next_item_id)
 
-    def find_list(self, list_id):
-        for todo in self.todolists:
-            if todo.id == list_id:
-                return todo
+        self.next_list_id = todolists_dict.get('nextListID',
+                                               self.next_list_id)
 
-        return None
+    @counts_lookup
+    def find_list(self, list_id):
+        return self.todolists.find(list_id)
 
     def find_list_item(self, list_id, item_id):
         todolist = self.find_list(list_id)
@@ -130,31 +256,73 @@ class TodoListContainer:
         # either returns the item, or None if not found
         return todolist.find_item(item_id)
 
-    def add_list(self, name, description):
+    def add_list(self, name, description, list_id=None):
         if not name or not description:
             return None
 
-        new_list = TodoList(name, description, self.next_list_id)
-        self.next_list_id += 1
+        if list_id is None:
+            list_id = self.next_list_id
+        self.next_list_id = max(self.next_list_id, list_id + 1)
+
+        new_list = TodoList(name, description, list_id)
 
         self.todolists.append(new_list)
 
         return new_list
 
     def delete_list(self, list_id):
-        for i in range(len(self.todolists)):
-            if self.todolists[i].id == list_id:
-                del self.todolists[i]
-                return True
-
-        return False
-
-    def search_lists(self, name, description):
-        results = []
-
-        for todolist in self.todolists:
-            if ((name is None or todolist.name == name) and
-                    (description is None or todolist.description == description)):
-                results.append(todolist.create_dict())
-
-        return results
+        return self.todolists.remove(list_id)
+
+    def search_lists(self, name, description, after=None, limit=None,
+                     shape=None):
+        # returns a page of matching lists, as dicts made by shape
+        # (create_dict by default), and the id to continue from
+        def matches(todolist):
+            return ((name is None or todolist.name == name) and
+                    (description is None or todolist.description == description))
+
+        todolists, next_id = self.todolists.page(after, limit, matches)
+
+        if shape is None:
+            shape = TodoList.create_dict
+
+        return [shape(todolist) for todolist in todolists], next_id
+
+    def create_save_dict(self):
+        # the same layout as lists.json, plus what's needed to reload
+        # the lists exactly (ids, counters and finished states)
+        # each list is locked only while it's saved, so saving from the
+        # write-behind thread just holds up requests to that list
+        with self.locks.reading():
+            next_list_id = self.next_list_id
+            todolists = list(self.todolists)
+
+        return {
+            'nextListID': next_list_id,
+            'lists': [self.save_list(todolist) for todolist in todolists]
+        }
+
+    def save_list(self, todolist):
+        with self.locks.reading(todolist.id):
+            return todolist.create_save_dict()
+
+
+# the keys of each model's JSON, key -> function building its value
+# a request with fields= builds only the ones it asks for (see
+# shared/fields.py), they must give what create_dict does
+LIST_FIELDS = {
+    'id': attrgetter('id'),
+    'name': attrgetter('name'),
+    'description': attrgetter('description'),
+}
+
+ITEM_FIELDS = {
+    'id': attrgetter('id'),
+    'task': attrgetter('task'),
+    'isFinished': attrgetter('is_finished'),
+}
+
+# what expand= can embed in each model (see shared/expand.py)
+LIST_RELATIONS = {
+    'items': Relation(attrgetter('items')),
+}
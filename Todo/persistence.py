@@ -0,0 +1,113 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+from snapshot import write_snapshot
+
+'''
+Write-behind persistence for the todo lists
+
+Requests only mark the container dirty, a background thread does the
+writing. Once no edits have come in for quiet_period seconds, or
+max_dirty edits have piled up, the whole container is written to a
+temp file and renamed over the real one. A burst of edits turns into
+one write, and a crash mid-write never leaves a half written file.
+
+binary saves a snapshot (see snapshot.py) instead of JSON. The store
+reads quiet_period and max_dirty from TODO_QUIET_PERIOD and
+TODO_MAX_DIRTY in its config (see store.py).
+'''
+
+
+class WriteBehind:
+
+    def __init__(self, container, filepath, quiet_period=1.0, max_dirty=1000,
+                 binary=False):
+        self.container = container
+        self.filepath = filepath
+        self.binary = binary
+        self.quiet_period = quiet_period
+        self.max_dirty = max_dirty
+
+        self.changed = threading.Condition()
+        self.dirty = 0
+        self.last_change = None
+        self.closed = False
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def mark_dirty(self):
+        # this is all a request pays for, no disk I/O
+        with self.changed:
+            self.dirty += 1
+            self.last_change = time.monotonic()
+
+            if self.dirty >= self.max_dirty:
+                self.changed.notify()
+            elif self.dirty == 1:
+                # wake the writer so it starts the quiet period timer
+                self.changed.notify()
+
+    def run(self):
+        while True:
+            with self.changed:
+                while not self.closed and not self.ready():
+                    self.changed.wait(self.time_left())
+
+                if self.closed:
+                    return
+
+                self.dirty = 0
+
+            self.write()
+
+    def ready(self):
+        if not self.dirty:
+            return False
+        if self.dirty >= self.max_dirty:
+            return True
+        return time.monotonic() - self.last_change >= self.quiet_period
+
+    def time_left(self):
+        if not self.dirty:
+            return None
+        return max(0, self.quiet_period -
+                   (time.monotonic() - self.last_change))
+
+    def write(self):
+        if self.binary:
+            write_snapshot(self.container, self.filepath)
+            return
+
+        data = self.container.create_save_dict()
+        tmp_path = self.filepath + '.tmp'
+
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, self.filepath)
+
+    def close(self):
+        # flushes anything still dirty, safe to call more than once
+        with self.changed:
+            if self.closed:
+                return
+            self.closed = True
+            pending = self.dirty
+            self.dirty = 0
+            self.changed.notify()
+
+        # a closed persister doesn't need flushing at exit, and the
+        # hook would keep it and its container alive until then
+        atexit.unregister(self.close)
+
+        self.thread.join()
+
+        if pending:
+            self.write()
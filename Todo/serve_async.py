@@ -0,0 +1,44 @@
+import asyncio
+import os
+import sys
+
+# the modules both APIs share are in shared/, at the top of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from TodoListAPI import create_app
+from shared.asgi import ASGIApp, serve
+
+'''
+Serves the todo API from asyncio instead of a thread per connection
+
+    python serve_async.py
+
+or with any ASGI server, e.g. uvicorn serve_async:application
+
+Requests are run on worker threads and connections wait on the event
+loop (see shared/asgi.py). Saving was already off the request path, changes
+only mark the write-behind persister dirty, so all that's left is
+flushing it on shutdown without blocking the loop.
+'''
+
+
+app = create_app()
+store = app.extensions['todo']
+
+
+async def startup():
+    # loads on a worker thread, requests get a 503 until it's done
+    store.startup.start()
+
+
+async def shutdown():
+    if store.persister:
+        await asyncio.get_running_loop().run_in_executor(
+            None, store.persister.close)
+
+
+application = ASGIApp(app, startup=startup, shutdown=shutdown)
+
+
+if __name__ == '__main__':
+    serve(application)
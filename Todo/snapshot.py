@@ -0,0 +1,158 @@
+import mmap
+import os
+import struct
+import sys
+
+# the modules both APIs share are in shared/, at the top of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import TodoListContainer, TodoList, TodoItem, IndexedCollection
+
+'''
+Binary snapshots of the todo lists
+
+Instead of parsing lists.json and building every item on boot, a
+container can be memory mapped from a snapshot. Loading reads only
+the header, the lists and each list's items are decoded the first
+time they're used.
+
+All numbers are little endian, strings are a u32 byte length followed
+by UTF-8:
+
+    header  magic, u32 next list id, u32 list count,
+            u64 offset of the list table
+    lists   u64 offset per list, in insertion order
+    list    u32 id, name, description, u32 next item id,
+            u32 item count, u32 byte size of the items
+    items   u32 id, u8 is finished, task
+
+Convert lists.json with:
+    python snapshot.py lists.json lists.snapshot
+'''
+
+MAGIC = b'TODOSNP1'
+
+HEADER = struct.Struct('<8sIIQ')
+ITEM = struct.Struct('<IB')
+U32 = struct.Struct('<I')
+U64 = struct.Struct('<Q')
+
+
+def encode_str(value):
+    data = value.encode('utf-8')
+    return U32.pack(len(data)) + data
+
+
+def write_snapshot(container, path):
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'wb') as f:
+        f.write(bytes(HEADER.size))
+        offset = HEADER.size
+        list_offsets = []
+
+        with container.locks.reading():
+            next_list_id = container.next_list_id
+            todolists = list(container.todolists)
+
+        # each list is locked only while it's encoded, see
+        # create_save_dict in models.py
+        for todolist in todolists:
+            with container.locks.reading(todolist.id):
+                record = encode_list(todolist)
+
+            list_offsets.append(offset)
+            f.write(record)
+            offset += len(record)
+
+        for list_offset in list_offsets:
+            f.write(U64.pack(list_offset))
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, next_list_id, len(list_offsets), offset))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+
+def encode_list(todolist):
+    items = b''.join(
+        ITEM.pack(item.id, item.is_finished) + encode_str(item.task)
+        for item in todolist.items)
+
+    return b''.join([
+        U32.pack(todolist.id),
+        encode_str(todolist.name),
+        encode_str(todolist.description),
+        U32.pack(todolist.next_item_id),
+        U32.pack(len(todolist.items)),
+        U32.pack(len(items)),
+        items])
+
+
+def is_snapshot(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_snapshot(container, path):
+    f = open(path, 'rb')
+    snapshot = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    f.close()
+
+    magic, next_list_id, num_lists, lists_offset = \
+        HEADER.unpack_from(snapshot, 0)
+
+    if magic != MAGIC:
+        raise ValueError('{} is not a todo snapshot'.format(path))
+
+    container.next_list_id = next_list_id
+    container.todolists = IndexedCollection(
+        loader=lambda: [
+            read_list(snapshot, U64.unpack_from(
+                snapshot, lists_offset + 8 * i)[0])
+            for i in range(num_lists)],
+        length=num_lists)
+
+
+def read_str(snapshot, offset):
+    length = U32.unpack_from(snapshot, offset)[0]
+    start = offset + 4
+    return snapshot[start:start + length].decode('utf-8'), start + length
+
+
+def read_list(snapshot, offset):
+    list_id = U32.unpack_from(snapshot, offset)[0]
+    name, offset = read_str(snapshot, offset + 4)
+    description, offset = read_str(snapshot, offset)
+    next_item_id, num_items, size = struct.unpack_from('<III', snapshot,
+                                                       offset)
+    start = offset + 12
+
+    def load_items():
+        items = []
+        item_offset = start
+
+        for _ in range(num_items):
+            item_id, is_finished = ITEM.unpack_from(snapshot, item_offset)
+            task, item_offset = read_str(snapshot, item_offset + ITEM.size)
+
+            item = TodoItem(task, item_id)
+            item.is_finished = bool(is_finished)
+            items.append(item)
+
+        return items
+
+    todolist = TodoList(name, description, list_id)
+    todolist.next_item_id = next_item_id
+    todolist.items = IndexedCollection(loader=load_items, length=num_items)
+    return todolist
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: python snapshot.py lists.json out.snapshot')
+        sys.exit(1)
+
+    write_snapshot(TodoListContainer(sys.argv[1]), sys.argv[2])
@@ -0,0 +1,56 @@
+from models import TodoListContainer
+from persistence import WriteBehind
+from snapshot import is_snapshot, load_snapshot
+from shared.startup import Startup
+from shared import cache
+
+'''
+Everything one app serves: the todo lists and their persister
+
+Building a TodoStore doesn't read anything, load does, on a background
+thread (see shared/startup.py). A binary snapshot is mapped instead of parsed
+(see snapshot.py), so workers forked from one server share its pages
+through the OS page cache.
+'''
+
+DEFAULTS = {
+    'TODO_PATH': 'lists.json',
+    'TODO_LOAD': 'lazy',
+    'TODO_QUIET_PERIOD': 1.0,
+    'TODO_MAX_DIRTY': 1000,
+    'METRICS_PROFILE': '',
+    'METRICS_PROFILE_EVERY': 100,
+    'RESPONSE_CACHE_ENTRIES': 4096,
+    'RESPONSE_CACHE_BYTES': 64 * 1024 * 1024,
+}
+
+
+class TodoStore:
+
+    def __init__(self, config):
+        self.config = config
+        self.path = config['TODO_PATH']
+        self.todo = TodoListContainer()
+
+        # started once the lists are loaded
+        self.persister = None
+
+        # ETags and encoded GET responses, kept current by every write
+        self.responses = cache.from_config(config)
+
+        self.startup = Startup(self.load, config['TODO_LOAD'])
+
+    def load(self, startup):
+        binary = is_snapshot(self.path)
+
+        with startup.phase('lists'):
+            if binary:
+                load_snapshot(self.todo, self.path)
+            else:
+                self.todo.load(self.path)
+
+        # changes are written back to the same file in the background
+        self.persister = WriteBehind(
+            self.todo, self.path,
+            quiet_period=float(self.config['TODO_QUIET_PERIOD']),
+            max_dirty=int(self.config['TODO_MAX_DIRTY']), binary=binary)
@@ -0,0 +1,487 @@
+'''
+Drives every resource of both APIs against generated datasets
+
+For each dataset size the data is generated once (see
+generate_data.py) and kept in benchmarks/data. Each app is then run in
+a process of its own, loading that data the way it does when serving,
+and every method of every resource is called through the Flask test
+client, one request after another. Reported per request type:
+requests per second, p50 and p99 latency and any unexpected statuses,
+plus how long the load took and the peak RSS of the process.
+
+Results are saved to benchmarks/results, and a saved run can be
+compared with this one to spot regressions.
+
+Run from the repo root:
+    python benchmarks/bench_api.py
+    python benchmarks/bench_api.py --sizes small,large --requests 200
+    python benchmarks/bench_api.py --compare benchmarks/results/<run>.json
+
+Replicas (internal/replicas/<id>) only exist in sharded mode so aren't
+driven.
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate_data
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.join(here, '..')
+
+# dataset name -> users, everything else scales with it
+SIZES = {
+    'small': 1000,
+    'medium': 20000,
+    'large': 200000,
+    'xlarge': 2000000,
+}
+
+SEED = 0
+
+# objects per request in the bulk write scenarios
+BATCH = 100
+
+# a change slower than this is flagged when comparing runs
+REGRESSION = 0.10
+
+
+def percentile(ordered, fraction):
+    return ordered[int(fraction * (len(ordered) - 1))]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == 'darwin':
+        return peak / (1 << 20)
+    return peak / (1 << 10)
+
+
+def run_scenarios(client, scenarios, requests):
+    '''
+    Each scenario makes (method, url, json body, expected status) and
+    optionally request headers, what it does to get there isn't timed.
+    Returns the stats of each
+    '''
+    results = {}
+
+    for name, make in scenarios:
+        latencies = []
+        errors = 0
+
+        for _ in range(requests):
+            method, url, body, expected, *headers = make()
+
+            start = time.perf_counter()
+            response = client.open(url, method=method, json=body,
+                                   headers=headers[0] if headers else None)
+            latencies.append(time.perf_counter() - start)
+
+            if response.status_code != expected:
+                errors += 1
+
+        latencies.sort()
+        results[name] = {
+            'requests': requests,
+            'per_second': round(requests / sum(latencies), 1),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'errors': errors,
+        }
+
+    return results
+
+
+def polled(client, target):
+    # a client asking again whether what it fetched has changed
+    etag = client.get(target).headers['ETag']
+    return 'GET', target, None, 304, {'If-None-Match': etag}
+
+
+def wait_until_loaded(startup):
+    startup.start()
+
+    while not startup.ready.wait(0.1):
+        if startup.error:
+            raise SystemExit(startup.error)
+
+    return startup.phases
+
+
+def blog_scenarios(app, rng):
+    from api import api_url
+
+    client = app.test_client()
+    blog = app.extensions['blog'].blog
+
+    def url(path, *args):
+        return api_url + path.format(*args)
+
+    def created(path, body, *args):
+        # something made just to be read, changed or deleted
+        return client.post(url(path, *args), json=body).get_json()
+
+    # the requests go to the users doing the most, like real traffic
+    num_users = blog.next_user_id
+    posts = []
+
+    while len(posts) < 200:
+        user = blog.find_user(generate_data.skewed(rng, num_users))
+
+        if user and len(user.posts):
+            post = rng.choice(list(user.posts))
+            posts.append((user.id, post.id))
+
+    def user_id():
+        return rng.choice(posts)[0]
+
+    def post():
+        return rng.choice(posts)
+
+    def new_user():
+        return {'name': 'bench', 'about': 'benchmarking',
+                'profileImage': 'image', 'socialMedia': []}
+
+    def new_post():
+        return {'title': 'bench ' + generate_data.sentence(rng, 3),
+                'content': generate_data.sentence(rng, 20)}
+
+    def new_comment():
+        return {'userID': user_id(), 'content': 'bench comment'}
+
+    def fresh_post():
+        uid = user_id()
+        return uid, created('users/{}/posts', new_post(), uid)['postID']
+
+    def fresh_comment():
+        uid, pid = post()
+        comment = created('users/{}/posts/{}/comments', new_comment(),
+                          uid, pid)
+        return uid, pid, comment['commentID']
+
+    def liked_post():
+        # a post and someone who liked it
+        uid, pid = fresh_post()
+        client.post(url('users/{}/posts/{}/likes', uid, pid),
+                    json={'userID': uid})
+        return uid, pid
+
+    def liked_comment():
+        uid, pid, cid = fresh_comment()
+        liker = user_id()
+        client.post(url('users/{}/posts/{}/comments/{}/likes', uid, pid,
+                        cid), json={'userID': liker})
+        return uid, pid, cid, liker
+
+    def word():
+        return generate_data.WORDS[generate_data.skewed(
+            rng, len(generate_data.WORDS))]
+
+    def deleted_user():
+        return created('users', new_user())['id']
+
+    def like_post():
+        # the API takes the post's owner as the liker
+        uid, pid = fresh_post()
+        return 'POST', url('users/{}/posts/{}/likes', uid, pid), \
+            {'userID': uid}, 201
+
+    def post_like(method, expected):
+        def make():
+            uid, pid = liked_post()
+            return method, url('users/{}/posts/{}/likes/{}', uid, pid, uid), \
+                None, expected
+        return make
+
+    scenarios = [
+        ('GET users', lambda: ('GET', url('users?limit=20'), None, 200)),
+        ('POST users', lambda: ('POST', url('users'), new_user(), 201)),
+        ('GET user', lambda: ('GET', url('users/{}', user_id()), None, 200)),
+        ('PUT user', lambda: ('PUT', url('users/{}', user_id()), new_user(),
+                              200)),
+        ('PATCH user', lambda: ('PATCH', url('users/{}', user_id()),
+                                {'about': 'patched'}, 200)),
+        ('DELETE user', lambda: ('DELETE', url('users/{}', deleted_user()),
+                                 None, 204)),
+        ('GET posts', lambda: ('GET', url('users/{}/posts', user_id()),
+                               None, 200)),
+        ('GET posts ids', lambda: ('GET', url('users/{}/posts?fields=postID',
+                                              user_id()), None, 200)),
+        ('POST posts', lambda: ('POST', url('users/{}/posts', user_id()),
+                                new_post(), 201)),
+        ('POST posts bulk', lambda: ('POST', url('users/{}/posts/bulk',
+                                                 user_id()),
+                                     [new_post() for _ in range(BATCH)],
+                                     201)),
+        ('GET liked', lambda: ('GET', url('users/{}/liked?limit=20',
+                                          user_id()), None, 200)),
+        ('GET search', lambda: ('GET', url('posts/search?q={}+{}', word(),
+                                           word()), None, 200)),
+        ('GET timeline', lambda: ('GET', url('timeline?limit=20'), None,
+                                  200)),
+        ('GET timeline ids', lambda: ('GET', url(
+            'timeline?limit=20&fields=postID,title,user.id'), None, 200)),
+        ('GET top posts', lambda: ('GET', url('leaderboard/posts'), None,
+                                   200)),
+        ('GET user top posts', lambda: ('GET', url(
+            'users/{}/leaderboard/posts', user_id()), None, 200)),
+        ('GET top comments', lambda: ('GET', url('leaderboard/comments'),
+                                      None, 200)),
+        ('GET user top comments', lambda: ('GET', url(
+            'users/{}/leaderboard/comments', user_id()), None, 200)),
+        ('GET post', lambda: ('GET', url('users/{}/posts/{}', *post()),
+                              None, 200)),
+        ('GET post expanded', lambda: ('GET', url(
+            'users/{}/posts/{}?expand=comments,likes,comments.likes',
+            *post()), None, 200)),
+        ('GET post polled', lambda: polled(client, url('users/{}/posts/{}',
+                                                       *post()))),
+        ('GET timeline polled', lambda: polled(client,
+                                               url('timeline?limit=20'))),
+        ('PUT post', lambda: ('PUT', url('users/{}/posts/{}', *post()),
+                              new_post(), 201)),
+        ('PATCH post', lambda: ('PATCH', url('users/{}/posts/{}', *post()),
+                                {'content': 'patched'}, 201)),
+        ('DELETE post', lambda: ('DELETE', url('users/{}/posts/{}',
+                                               *fresh_post()), None, 204)),
+        ('GET likes', lambda: ('GET', url('users/{}/posts/{}/likes?limit=20',
+                                          *post()), None, 200)),
+        ('POST likes', like_post),
+        ('GET like', post_like('GET', 200)),
+        ('DELETE like', post_like('DELETE', 204)),
+        ('GET comments', lambda: ('GET', url(
+            'users/{}/posts/{}/comments?limit=20', *post()), None, 200)),
+        ('GET comments polled', lambda: polled(client, url(
+            'users/{}/posts/{}/comments?limit=20', *post()))),
+        ('POST comments', lambda: ('POST', url('users/{}/posts/{}/comments',
+                                               *post()), new_comment(), 201)),
+        ('GET comment', lambda: ('GET', url('users/{}/posts/{}/comments/{}',
+                                            *fresh_comment()), None, 200)),
+        ('PUT comment', lambda: ('PUT', url('users/{}/posts/{}/comments/{}',
+                                            *fresh_comment()),
+                                 {'content': 'put'}, 200)),
+        ('PATCH comment', lambda: ('PATCH', url(
+            'users/{}/posts/{}/comments/{}', *fresh_comment()),
+            {'content': 'patched'}, 200)),
+        ('DELETE comment', lambda: ('DELETE', url(
+            'users/{}/posts/{}/comments/{}', *fresh_comment()), None, 204)),
+        ('GET comment likes', lambda: ('GET', url(
+            'users/{}/posts/{}/comments/{}/likes', *liked_comment()[:3]),
+            None, 200)),
+        ('POST comment likes', lambda: ('POST', url(
+            'users/{}/posts/{}/comments/{}/likes', *fresh_comment()),
+            {'userID': user_id()}, 201)),
+        ('GET comment like', lambda: ('GET', url(
+            'users/{}/posts/{}/comments/{}/likes/{}', *liked_comment()),
+            None, 200)),
+        ('DELETE comment like', lambda: ('DELETE', url(
+            'users/{}/posts/{}/comments/{}/likes/{}', *liked_comment()),
+            None, 204)),
+    ]
+    return client, scenarios
+
+
+def todo_scenarios(app, rng):
+    from TodoListAPI import api_url
+
+    client = app.test_client()
+    todo = app.extensions['todo'].todo
+
+    def url(path, *args):
+        return api_url + path.format(*args)
+
+    def created(path, body, *args):
+        return client.post(url(path, *args), json=body).get_json()
+
+    lists = [todolist.id for todolist in todo.todolists]
+
+    def list_id():
+        return rng.choice(lists)
+
+    def new_list():
+        return {'name': 'bench', 'description': 'benchmarking'}
+
+    def new_item():
+        return {'task': generate_data.sentence(rng, 3)}
+
+    def fresh_list():
+        return created('todolists', new_list())['id']
+
+    def fresh_item():
+        lid = list_id()
+        return lid, created('todolists/{}/todoitems', new_item(), lid)['id']
+
+    scenarios = [
+        ('GET lists', lambda: ('GET', url('todolists?limit=20'), None, 201)),
+        ('POST lists', lambda: ('POST', url('todolists'), new_list(), 201)),
+        ('GET list', lambda: ('GET', url('todolists/{}', list_id()), None,
+                              200)),
+        ('PUT list', lambda: ('PUT', url('todolists/{}', list_id()),
+                              new_list(), 200)),
+        ('PATCH list', lambda: ('PATCH', url('todolists/{}', list_id()),
+                                {'description': 'patched'}, 200)),
+        ('DELETE list', lambda: ('DELETE', url('todolists/{}', fresh_list()),
+                                 None, 204)),
+        ('GET items', lambda: ('GET', url('todolists/{}/todoitems?limit=20',
+                                          list_id()), None, 200)),
+        ('GET items polled', lambda: polled(client, url(
+            'todolists/{}/todoitems?limit=20', list_id()))),
+        ('POST items', lambda: ('POST', url('todolists/{}/todoitems',
+                                            list_id()), new_item(), 201)),
+        ('POST items bulk', lambda: ('POST', url(
+            'todolists/{}/todoitems/bulk', list_id()),
+            [new_item() for _ in range(BATCH)], 201)),
+        ('GET item', lambda: ('GET', url('todolists/{}/todoitems/{}',
+                                         *fresh_item()), None, 200)),
+        ('PUT item', lambda: ('PUT', url('todolists/{}/todoitems/{}',
+                                         *fresh_item()),
+                              {'task': 'put', 'isFinished': True}, 200)),
+        ('PATCH item', lambda: ('PATCH', url('todolists/{}/todoitems/{}',
+                                             *fresh_item()),
+                                {'isFinished': True}, 200)),
+        ('DELETE item', lambda: ('DELETE', url('todolists/{}/todoitems/{}',
+                                               *fresh_item()), None, 204)),
+    ]
+    return client, scenarios
+
+
+def bench_app(name, dataset, requests):
+    # runs in its own process, so peak RSS is this app's alone
+    os.chdir(tempfile.mkdtemp(prefix='bench_' + name))
+
+    if name == 'blog':
+        sys.path.insert(0, os.path.join(root, 'Blog'))
+        from api import create_app
+
+        app = create_app({
+            'BLOG_USERS': os.path.join(dataset, 'users.json'),
+            'BLOG_POSTS': os.path.join(dataset, 'posts.json'),
+        })
+        store = app.extensions['blog']
+        make_scenarios = blog_scenarios
+    else:
+        sys.path.insert(0, os.path.join(root, 'Todo'))
+        import shutil
+        from TodoListAPI import create_app
+
+        # the lists are saved back to the file they came from
+        shutil.copy(os.path.join(dataset, 'lists.json'), 'lists.json')
+        app = create_app()
+        store = app.extensions['todo']
+        make_scenarios = todo_scenarios
+
+    phases = wait_until_loaded(store.startup)
+    client, scenarios = make_scenarios(app, random.Random(SEED))
+
+    return {
+        'load': phases,
+        'scenarios': run_scenarios(client, scenarios, requests),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def dataset_path(size):
+    path = os.path.join(here, 'data', '{}-{}'.format(size, SEED))
+
+    if not os.path.exists(os.path.join(path, 'lists.json')):
+        print('generating the {} dataset...'.format(size), flush=True)
+        generate_data.generate(path, SIZES[size], SEED)
+
+    return path
+
+
+def run(sizes, requests):
+    results = {}
+
+    for size in sizes:
+        dataset = dataset_path(size)
+
+        for name in ('blog', 'todo'):
+            print('running {} on {}...'.format(name, size), flush=True)
+            output = subprocess.run(
+                [sys.executable, __file__, '--app', name, dataset,
+                 str(requests)],
+                check=True, stdout=subprocess.PIPE).stdout
+            results['{}/{}'.format(name, size)] = json.loads(
+                output.splitlines()[-1])
+
+    return results
+
+
+def report(results, baseline=None):
+    for key, result in results.items():
+        print('\n{}  load {}s  peak RSS {} MB'.format(
+            key, result['load']['total'], result['peak_rss_mb']))
+        print('  {:<24}{:>10}{:>10}{:>10}{:>8}'.format(
+            'request', 'req/s', 'p50 ms', 'p99 ms', 'errors'))
+
+        before = (baseline or {}).get(key, {}).get('scenarios', {})
+
+        for name, stats in result['scenarios'].items():
+            line = '  {:<24}{per_second:>10}{p50_ms:>10}{p99_ms:>10}' \
+                '{errors:>8}'.format(name, **stats)
+
+            if name in before:
+                change = stats['p50_ms'] / before[name]['p50_ms'] - 1
+                line += '  {:+.0%}'.format(change)
+                if change > REGRESSION:
+                    line += ' slower'
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', default='small,medium',
+                        help='comma separated, from ' + ', '.join(SIZES))
+    parser.add_argument('--requests', type=int, default=500,
+                        help='requests of each type')
+    parser.add_argument('--compare', help='a saved run to compare with')
+    parser.add_argument('--app', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.app:
+        name, dataset, requests = args.app
+        result = bench_app(name, dataset, int(requests))
+
+        # on a line of its own, after anything the app printed
+        print('\n' + json.dumps(result))
+        return
+
+    sizes = args.sizes.split(',')
+    for size in sizes:
+        if size not in SIZES:
+            parser.error('unknown size {!r}'.format(size))
+
+    results = run(sizes, args.requests)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    report(results, baseline)
+
+    os.makedirs(os.path.join(here, 'results'), exist_ok=True)
+    path = os.path.join(here, 'results',
+                        time.strftime('%Y%m%d-%H%M%S') + '.json')
+
+    with open(path, 'w') as f:
+        json.dump({'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'requests': args.requests,
+                   'results': results}, f, indent=2)
+
+    print('\nsaved to', os.path.relpath(path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+'''
+Measures the CPU cost of encoding large listing responses
+
+Compares the old path, building dicts and encoding them with the
+standard library like jsonify, against splicing the models' encoded
+fragments with encode_list, for the bodies of UsersResource.get and
+PostLikesResource.get.
+
+Run from the repo root:
+    python benchmarks/bench_encoding.py
+'''
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'Blog'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bench_lookups import build_store  # noqa: E402
+from encoding import encode_list  # noqa: E402
+
+
+def stdlib(objects):
+    return json.dumps([obj.build_dict() for obj in objects],
+                      sort_keys=True).encode('utf-8')
+
+
+def spliced(objects):
+    return encode_list(obj.create_json() for obj in objects)
+
+
+def per_call(func, objects, number=20):
+    return timeit.timeit(lambda: func(objects), number=number) / number * 1000
+
+
+def main():
+    print('{:>18} {:>8} | {:>10} {:>10}'.format(
+        'endpoint', 'objects', 'stdlib', 'spliced'))
+
+    for num_users in [1000, 10000]:
+        blog = build_store(num_users, 1, 0, 0)
+        users = list(blog.users)
+
+        # one post liked by every user
+        post = users[0].find_post(0)
+        for user in users:
+            post.add_like(user)
+        likes = list(post.likes)
+
+        for name, objects in [('UsersResource', users),
+                              ('PostLikesResource', likes)]:
+            print('{:>18} {:>8} | {:>8.2f}ms {:>8.2f}ms'.format(
+                name, len(objects), per_call(stdlib, objects),
+                per_call(spliced, objects)))
+
+
+if __name__ == '__main__':
+    main()
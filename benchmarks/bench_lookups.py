@@ -0,0 +1,109 @@
+'''
+Measures how lookup latency in the Blog models changes as the dataset grows
+
+Builds stores of increasing size and times find_user, find_post,
+find_comment and find_like against a plain linear scan over the same
+objects, which is how the lookups used to work.
+
+Run from the repo root:
+    python benchmarks/bench_lookups.py
+'''
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'Blog'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from models import BlogUsers  # noqa: E402
+
+
+def build_store(num_users, posts_per_user, comments_per_post, likes_per_text):
+    blog = BlogUsers()
+
+    for i in range(num_users):
+        blog.add_user('user {}'.format(i), 'about', 'image')
+
+    users = list(blog.users)
+    for user in users:
+        for _ in range(posts_per_user):
+            post = user.add_post('content', 'title')
+
+            for liker in users[:likes_per_text]:
+                post.add_like(liker)
+
+            for _ in range(comments_per_post):
+                comment = post.add_comment(user, 'comment')
+
+                for liker in users[:likes_per_text]:
+                    comment.add_like(liker)
+
+    return blog
+
+
+def linear_find(objects, obj_id):
+    for obj in objects:
+        if obj.id == obj_id:
+            return obj
+
+    return None
+
+
+def time_per_call(func, number):
+    return timeit.timeit(func, number=number) / number * 1e6
+
+
+def main():
+    random.seed(0)
+    number = 2000
+
+    print('{:>8} {:>8} {:>8} | {:>10} {:>10} {:>10} {:>10} | {:>12}'.format(
+        'users', 'posts/u', 'likes/t', 'find_user', 'find_post',
+        'find_comm', 'find_like', 'linear_user'))
+
+    for num_users, posts_per_user, likes_per_text in [
+            (100, 10, 10), (1000, 10, 20), (10000, 5, 20)]:
+        blog = build_store(num_users, posts_per_user, 2, likes_per_text)
+        users = list(blog.users)
+
+        def lookup_ids():
+            user_id = random.randrange(num_users)
+            post_id = random.randrange(posts_per_user)
+            like_id = random.randrange(likes_per_text)
+            return user_id, post_id, like_id
+
+        ids = [lookup_ids() for _ in range(number)]
+        it = iter(ids * 5)
+
+        def find_user():
+            blog.find_user(next(it)[0])
+
+        def find_post():
+            user_id, post_id, _ = next(it)
+            blog.find_post(user_id, post_id)
+
+        def find_comment():
+            user_id, post_id, _ = next(it)
+            blog.find_comment(user_id, post_id, 1)
+
+        def find_like():
+            user_id, post_id, like_id = next(it)
+            blog.find_post(user_id, post_id).find_like(like_id)
+
+        def linear_user():
+            linear_find(users, next(it)[0])
+
+        results = [time_per_call(f, number) for f in
+                   (find_user, find_post, find_comment, find_like)]
+        it = iter(ids)
+        baseline = time_per_call(linear_user, number)
+
+        print('{:>8} {:>8} {:>8} | {:>8.2f}us {:>8.2f}us {:>8.2f}us '
+              '{:>8.2f}us | {:>10.2f}us'.format(
+                  num_users, posts_per_user, likes_per_text,
+                  *results, baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+'''
+Measures how much memory each like, comment and todo item costs
+
+Builds a large number of each with tracemalloc running and reports
+the bytes allocated per object, including its share of the indexes
+that hold it.
+
+Run from the repo root:
+    python benchmarks/bench_memory.py
+'''
+import importlib.util
+import os
+import sys
+import tracemalloc
+
+root = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, os.path.join(root, 'Blog'))
+sys.path.insert(0, root)
+
+from models import BlogUsers  # noqa: E402
+
+# both apps call their models module "models"
+spec = importlib.util.spec_from_file_location(
+    'todo_models', os.path.join(root, 'Todo', 'models.py'))
+todo_models = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(todo_models)
+
+COUNT = 100000
+
+
+def measure(setup, build):
+    # only what build allocates is counted, not what setup made
+    state = setup()
+
+    tracemalloc.start()
+    kept = build(state)
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    del kept
+    return allocated / COUNT
+
+
+def setup_blog():
+    blog = BlogUsers()
+    users = [blog.add_user('user', 'about', 'image') for _ in range(COUNT)]
+    return users, users[0].add_post('content', 'title')
+
+
+def build_likes(state):
+    users, post = state
+
+    for user in users:
+        post.add_like(user)
+    return post
+
+
+def build_comments(state):
+    users, post = state
+    return [post.add_comment(users[0], 'comment') for _ in range(COUNT)]
+
+
+def setup_todo():
+    return todo_models.TodoList('list', 'description', 0)
+
+
+def build_items(todolist):
+    for _ in range(COUNT):
+        todolist.add_item('task')
+    return todolist
+
+
+def main():
+    for name, setup, build in [('like', setup_blog, build_likes),
+                               ('comment', setup_blog, build_comments),
+                               ('item', setup_todo, build_items)]:
+        print('{:>10} {:>10.1f} bytes'.format(name, measure(setup, build)))
+
+
+if __name__ == '__main__':
+    main()
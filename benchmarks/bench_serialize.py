@@ -0,0 +1,97 @@
+'''
+Measures what repeat reads cost with the create_dict memo
+
+Serializes every user, post and comment of a store twice: once cold,
+right after every object has been touched, and once warm, when
+nothing changed since the last read and the memoized dicts are reused.
+
+Likes aren't memoized, they're stored as columns (see LikeColumns in
+models.py) and a Like is only built to be serialized, so they cost the
+same every time. They're timed separately, as how much of a full
+serialization the memo can't help with.
+
+Each time is the best of REPEATS runs.
+
+Run from the repo root:
+    python benchmarks/bench_serialize.py
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'Blog'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bench_lookups import build_store  # noqa: E402
+
+
+REPEATS = 5
+
+
+def serialize_models(blog):
+    # the memoized models
+    for user in blog.users:
+        user.create_dict()
+
+        for post in user.posts:
+            post.create_dict()
+
+            for comment in post.comments:
+                comment.create_dict()
+
+
+def serialize_likes(blog):
+    for user in blog.users:
+        for post in user.posts:
+            for like in post.likes:
+                like.create_dict()
+
+            for comment in post.comments:
+                for like in comment.likes:
+                    like.create_dict()
+
+
+def invalidate(blog):
+    # a new version on every user invalidates everything below it
+    for user in blog.users:
+        user.touch()
+
+
+def timed(func, blog, before=None):
+    best = None
+
+    for _ in range(REPEATS):
+        if before:
+            before(blog)
+
+        start = time.perf_counter()
+        func(blog)
+        elapsed = (time.perf_counter() - start) * 1000
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main():
+    print('{:>8} {:>10} | {:>10} {:>10} | {:>8} {:>10}'.format(
+        'users', 'models', 'cold', 'warm', 'likes', 'any read'))
+
+    for num_users in [100, 1000, 5000]:
+        blog = build_store(num_users, 5, 2, 10)
+        models = num_users * (1 + 5 * (1 + 2))
+        likes = num_users * 5 * (10 + 2 * 10)
+
+        cold = timed(serialize_models, blog, invalidate)
+
+        serialize_models(blog)
+        warm = timed(serialize_models, blog)
+
+        like_time = timed(serialize_likes, blog)
+
+        print('{:>8} {:>10} | {:>8.1f}ms {:>8.1f}ms | {:>8} {:>8.1f}ms'.format(
+            num_users, models, cold, warm, likes, like_time))
+
+
+if __name__ == '__main__':
+    main()
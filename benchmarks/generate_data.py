@@ -0,0 +1,180 @@
+'''
+Generates synthetic users.json, posts.json and lists.json
+
+The files have the same layout as the small hand written ones in Blog
+and Todo, just far bigger, so the apps load them the normal way.
+Activity is skewed the way it is on real sites: a few users write most
+of the posts and get most of the likes, and most posts get a handful
+of likes while a few get thousands. The same seed always gives the
+same files.
+
+Each element is written as soon as it's made, so memory stays flat
+however many users are asked for.
+
+Run from the repo root:
+    python benchmarks/generate_data.py 100000 data/
+'''
+import argparse
+import json
+import os
+import random
+import time
+
+WORDS = '''
+    quarantine stonks tiktok golden age market crash recipe bread garden
+    travel camera coffee running music guitar python code review release
+    weekend movie book summer winter city beach mountain bike dog cat
+    photo news election science space rocket game console update design
+    startup money budget health sleep workout pasta pizza tea podcast
+    interview career remote office learning history art museum concert
+'''.split()
+
+NETWORKS = ['Instagram', 'Twitter', 'Facebook', 'LinkedIn', 'TikTok']
+
+# how lopsided activity is, a pick's chance falls off as id ** (1/SKEW - 1)
+SKEW = 3.0
+
+# the tail of the per post counts, lower means a few posts get far more
+TAIL = 1.5
+
+
+def skewed(rng, n):
+    # an id below n, low ids are picked far more often than high ones
+    return int(n * rng.random() ** SKEW)
+
+
+def heavy(rng, mean, cap):
+    # a count with the given mean, usually small but sometimes huge
+    count = mean * (TAIL - 1) * (rng.paretovariate(TAIL) - 1)
+    return min(int(count), cap)
+
+
+def sentence(rng, words):
+    return ' '.join(WORDS[skewed(rng, len(WORDS))]
+                    for _ in range(words)).capitalize()
+
+
+def write_array(f, elements):
+    # one compact element per line, as the streaming loader reads them
+    count = 0
+    f.write('[\n')
+
+    for element in elements:
+        if count:
+            f.write(',\n')
+        f.write(json.dumps(element, separators=(',', ':')))
+        count += 1
+
+    f.write('\n]')
+    return count
+
+
+def make_users(rng, num_users):
+    for user_id in range(num_users):
+        yield {
+            'name': 'User {}'.format(user_id),
+            'about': sentence(rng, 6),
+            'profileImage': 'https://img.example.com/{}.png'.format(user_id),
+            'socialMedia': [
+                {'network': network,
+                 'url': '{}.com/user{}'.format(network.lower(), user_id),
+                 'icon': 'https://img.example.com/{}.png'.format(
+                     network.lower())}
+                for network in rng.sample(NETWORKS, rng.randint(0, 2))],
+        }
+
+
+def likes(rng, num_users, mean):
+    # liking twice does nothing, so repeats are dropped
+    likers = {skewed(rng, num_users)
+              for _ in range(heavy(rng, mean, num_users))}
+    return [{'userID': user_id} for user_id in likers]
+
+
+def make_posts(rng, num_users, posts_per_user, likes_per_post,
+               comments_per_post, likes_per_comment):
+    for _ in range(num_users * posts_per_user):
+        yield {
+            'title': sentence(rng, rng.randint(3, 8)),
+            'content': sentence(rng, rng.randint(10, 60)),
+            'userID': skewed(rng, num_users),
+            'likes': likes(rng, num_users, likes_per_post),
+            'comments': [
+                {'userID': skewed(rng, num_users),
+                 'content': sentence(rng, rng.randint(2, 20)),
+                 'likes': likes(rng, num_users, likes_per_comment)}
+                for _ in range(heavy(rng, comments_per_post, 10000))],
+        }
+
+
+def make_lists(rng, num_lists, items_per_list):
+    for _ in range(num_lists):
+        yield {
+            'name': sentence(rng, 2),
+            'description': sentence(rng, 8),
+            'items': [{'task': sentence(rng, rng.randint(1, 5))}
+                      for _ in range(heavy(rng, items_per_list, 100000))],
+        }
+
+
+def generate(out, num_users, seed=0, posts_per_user=2, likes_per_post=5,
+             comments_per_post=2, likes_per_comment=1, num_lists=None,
+             items_per_list=20):
+    '''
+    Writes users.json, posts.json and lists.json to the directory out,
+    returns how many of each top level element were written
+    '''
+    os.makedirs(out, exist_ok=True)
+
+    if num_lists is None:
+        num_lists = max(num_users // 10, 1)
+
+    # each file has its own generator, so changing how one is made
+    # doesn't change the others
+    counts = {}
+
+    with open(os.path.join(out, 'users.json'), 'w') as f:
+        counts['users'] = write_array(
+            f, make_users(random.Random(seed), num_users))
+
+    with open(os.path.join(out, 'posts.json'), 'w') as f:
+        counts['posts'] = write_array(
+            f, make_posts(random.Random(seed + 1), num_users, posts_per_user,
+                          likes_per_post, comments_per_post,
+                          likes_per_comment))
+
+    # the todo file is one object holding the lists
+    with open(os.path.join(out, 'lists.json'), 'w') as f:
+        f.write('{"lists":')
+        counts['lists'] = write_array(
+            f, make_lists(random.Random(seed + 2), num_lists, items_per_list))
+        f.write('}')
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('users', type=int)
+    parser.add_argument('out')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--posts-per-user', type=int, default=2)
+    parser.add_argument('--likes-per-post', type=int, default=5)
+    parser.add_argument('--comments-per-post', type=int, default=2)
+    parser.add_argument('--likes-per-comment', type=int, default=1)
+    parser.add_argument('--lists', type=int)
+    parser.add_argument('--items-per-list', type=int, default=20)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = generate(args.out, args.users, args.seed, args.posts_per_user,
+                      args.likes_per_post, args.comments_per_post,
+                      args.likes_per_comment, args.lists,
+                      args.items_per_list)
+
+    print('{users} users, {posts} posts and {lists} todo lists'.format(
+        **counts), 'in {:.1f}s'.format(time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
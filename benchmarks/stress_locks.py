@@ -0,0 +1,210 @@
+'''
+Hammers the stores from many threads to check the locking loses nothing
+
+Threads race to like the same posts, comment on them, delete likes and
+add todo items, while other threads page through what's being written
+and save the todo lists like the write-behind thread does. Every
+thread takes the same locks the APIs do (see shared/locking.py). At the
+end the stores must hold exactly what the threads report doing, and each
+like must have been added once however many threads tried.
+
+The thread switch interval is shortened so races that would be rare
+in a real server happen constantly.
+
+Run from the repo root:
+    python benchmarks/stress_locks.py
+'''
+import importlib.util
+import os
+import random
+import sys
+import threading
+import time
+
+root = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, os.path.join(root, 'Blog'))
+sys.path.insert(0, root)
+
+from models import BlogUsers  # noqa: E402
+from leaderboard import LikesLeaderboards  # noqa: E402
+
+# both apps call their models module "models"
+spec = importlib.util.spec_from_file_location(
+    'todo_models', os.path.join(root, 'Todo', 'models.py'))
+todo_models = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(todo_models)
+
+THREADS = 16
+ROUNDS = 2000
+NUM_USERS = 200
+NUM_POSTS = 20
+
+
+def run_threads(workers):
+    errors = []
+
+    def guarded(worker):
+        try:
+            worker()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=guarded, args=(worker,))
+               for worker in workers]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+
+def stress_blog():
+    blog = BlogUsers()
+    leaderboards = LikesLeaderboards(blog)
+    locks = blog.locks
+
+    users = [blog.add_user('user', 'about', 'image')
+             for _ in range(NUM_USERS)]
+    posts = [users[i].add_post('content', 'title')
+             for i in range(NUM_POSTS)]
+
+    # what each thread saw succeed, checked against the store after
+    added = [[] for _ in range(THREADS)]
+    deleted = [[] for _ in range(THREADS)]
+    commented = [0] * THREADS
+
+    def writer(n):
+        rng = random.Random(n)
+
+        def work():
+            for _ in range(ROUNDS):
+                post = rng.choice(posts)
+                liker = rng.choice(users)
+
+                with locks.writing(post.user.id):
+                    action = rng.random()
+
+                    if action < 0.6:
+                        if post.add_like(liker):
+                            added[n].append((post, liker.id))
+                    elif action < 0.8:
+                        if post.delete_like(liker.id):
+                            deleted[n].append((post, liker.id))
+                    else:
+                        post.add_comment(liker, 'comment')
+                        commented[n] += 1
+        return work
+
+    def reader():
+        rng = random.Random()
+
+        for _ in range(ROUNDS):
+            post = rng.choice(posts)
+
+            with locks.reading(post.user.id):
+                likes, _ = post.likes.page(None, 50)
+                comments, _ = post.comments.page(None, 50)
+                post.create_json()
+
+            with locks.index(leaderboards):
+                leaderboards.top_posts(5)
+
+    run_threads([writer(n) for n in range(THREADS)] +
+                [reader for _ in range(THREADS // 4)])
+
+    # replaying every success in order must give the final likes
+    # a like added twice or a lost delete breaks the count
+    net = {}
+    for events, change in [(added, 1), (deleted, -1)]:
+        for thread_events in events:
+            for post, user_id in thread_events:
+                key = (post, user_id)
+                net[key] = net.get(key, 0) + change
+
+    for (post, user_id), count in net.items():
+        if count not in (0, 1):
+            raise AssertionError('user {} liked post {} {} more times than '
+                                 'they unliked it'.format(user_id, post.id,
+                                                          count))
+
+    likes = sum(net.values())
+    stored = sum(len(post.likes) for post in posts)
+    if likes != stored:
+        raise AssertionError('{} likes added but {} stored'.format(
+            likes, stored))
+
+    comments = sum(len(post.comments) for post in posts)
+    if comments != sum(commented):
+        raise AssertionError('{} comments added but {} stored'.format(
+            sum(commented), comments))
+
+    for post in posts:
+        ids = [comment.id for comment in post.comments]
+        if len(set(ids)) != len(ids):
+            raise AssertionError('comment ids handed out twice')
+
+    top = leaderboards.top_posts(NUM_POSTS)
+    if [len(post.likes) for post in top] != \
+            sorted((len(post.likes) for post in posts), reverse=True):
+        raise AssertionError('leaderboard out of step with the likes')
+
+    return likes, comments
+
+
+def stress_todo():
+    container = todo_models.TodoListContainer()
+    locks = container.locks
+    todolists = [container.add_list('list', 'description')
+                 for _ in range(4)]
+    added = [0] * THREADS
+
+    def writer(n):
+        rng = random.Random(n)
+
+        def work():
+            for _ in range(ROUNDS):
+                todolist = rng.choice(todolists)
+
+                with locks.writing(todolist.id):
+                    todolist.add_item('task')
+                    added[n] += 1
+        return work
+
+    def saver():
+        # what the write-behind thread does, while the lists change
+        for _ in range(20):
+            container.create_save_dict()
+
+    run_threads([writer(n) for n in range(THREADS)] + [saver])
+
+    items = sum(len(todolist.items) for todolist in todolists)
+    if items != sum(added):
+        raise AssertionError('{} items added but {} stored'.format(
+            sum(added), items))
+
+    for todolist in todolists:
+        ids = [item.id for item in todolist.items]
+        if len(set(ids)) != len(ids):
+            raise AssertionError('item ids handed out twice')
+
+    return items
+
+
+def main():
+    sys.setswitchinterval(1e-6)
+
+    start = time.perf_counter()
+    likes, comments = stress_blog()
+    items = stress_todo()
+    elapsed = time.perf_counter() - start
+
+    print('{} threads, {} likes, {} comments and {} todo items, '
+          'nothing lost ({:.1f}s)'.format(THREADS, likes, comments, items,
+                                          elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+'''
+What the blog and todo APIs have in common
+
+Each API's directory is on sys.path when it runs, and its entry points
+(api.py, TodoListAPI.py, router.py, serve_async.py, snapshot.py) add
+the top of the repo too, so both import these as shared.<module>. The
+modules here don't know about either API's models, the models list
+what the modules need in tables (see the end of each models.py).
+'''
@@ -0,0 +1,436 @@
+import asyncio
+import io
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import unquote
+
+from shared.encoding import dumps
+
+'''
+Serving either API from asyncio
+
+ASGIApp wraps a Flask app as an ASGI application. Connections are
+coroutines on the event loop, but the Flask app itself runs on a pool
+of worker threads: the resources take the store's locks, which can be
+held for a long time (the blog compacting its journal into a snapshot,
+an index or a list read from a snapshot decoded on first use), and
+waiting on them on the loop would stall every connection. Anything
+else that has to wait, like the blog's journal reaching the disk, goes
+in the async after_request hook, which is passed the request's WSGI
+environ and awaited before the response is sent. If it raises, the
+response is replaced with a 500.
+
+serve runs an ASGI app with uvicorn when it's installed and with the
+small HTTP/1.1 server below otherwise. Either way a connection kept
+open between requests is just a coroutine waiting on its socket, so
+thousands of mostly idle clients cost very little.
+
+A request body can be sent with a Content-Length or chunked, and is
+at most MAX_BODY bytes. A longer one gets a 413 without the app
+seeing it, under uvicorn too.
+'''
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+# how long a kept alive connection can sit idle before it's closed
+KEEP_ALIVE = 75
+
+# the most a request's line and headers can take up
+MAX_HEAD = 64 * 1024
+
+# the most a request's body can take up, bulk writes are the biggest
+MAX_BODY = 16 * 1024 * 1024
+
+# threads running requests, the most that can wait on a lock at once
+WORKERS = 32
+
+
+class ASGIApp:
+
+    def __init__(self, wsgi_app, after_request=None, startup=None,
+                 shutdown=None, workers=WORKERS):
+        self.wsgi_app = wsgi_app
+        self.after_request = after_request
+        self.startup = startup
+        self.shutdown = shutdown
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                if self.startup:
+                    await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.shutdown:
+                    await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        chunks = []
+        size = 0
+
+        while True:
+            message = await receive()
+            chunk = message.get('body', b'')
+            size += len(chunk)
+
+            if size > MAX_BODY:
+                await send({'type': 'http.response.start', 'status': 413,
+                            'headers': [(b'connection', b'close')]})
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+
+            chunks.append(chunk)
+
+            if not message.get('more_body'):
+                break
+
+        env = environ(scope, b''.join(chunks))
+
+        status, headers, content = await asyncio.get_running_loop() \
+            .run_in_executor(self.executor, self.call_wsgi, env)
+
+        if self.after_request:
+            try:
+                await self.after_request(env)
+            except Exception as error:
+                # whatever it waited for didn't happen, so the response
+                # the app built can't be sent
+                traceback.print_exc()
+                status = 500
+                headers = [(b'content-type', b'application/json')]
+                content = dumps({'message': str(error)}) + b'\n'
+
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    def call_wsgi(self, env):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'),
+                                    value.encode('latin-1'))
+                                   for name, value in headers]
+
+        result = self.wsgi_app(env, start_response)
+
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        return response['status'], response['headers'], content
+
+
+def environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+
+    env = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope['http_version'],
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+
+        # the body is passed whole, so its length is the one above
+        # and a chunked one has already been decoded
+        if name == 'CONTENT_TYPE':
+            env['CONTENT_TYPE'] = value
+        elif name not in ('CONTENT_LENGTH', 'TRANSFER_ENCODING'):
+            key = 'HTTP_' + name
+            env[key] = env[key] + ',' + value if key in env else value
+
+    return env
+
+
+def serve(app, host='127.0.0.1', port=5000):
+    if uvicorn:
+        uvicorn.run(app, host=host, port=port)
+    else:
+        try:
+            asyncio.run(run_server(app, host, port))
+        except KeyboardInterrupt:
+            # shutdown already ran as the server was cancelled
+            pass
+
+
+async def run_server(app, host, port):
+    lifespan = Lifespan(app)
+    await lifespan.start()
+
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(app, reader, writer),
+        host, port, limit=MAX_HEAD)
+    print(' * Serving on http://{}:{}'.format(host, port))
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await lifespan.stop()
+
+
+class Lifespan:
+    # runs the app's startup and shutdown, what uvicorn would do
+
+    def __init__(self, app):
+        self.app = app
+        self.events = asyncio.Queue()
+        self.task = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self.app(
+            {'type': 'lifespan', 'asgi': {'version': '3.0'}},
+            self.events.get, self.sent))
+        await self.events.put({'type': 'lifespan.startup'})
+        await self.events.join()
+
+    async def stop(self):
+        await self.events.put({'type': 'lifespan.shutdown'})
+        await self.task
+
+    async def sent(self, message):
+        # startup is complete once the app answers it
+        self.events.task_done()
+
+
+async def handle_connection(app, reader, writer):
+    server = writer.get_extra_info('sockname')[:2]
+    client = writer.get_extra_info('peername')[:2]
+
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                              KEEP_ALIVE)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                    asyncio.TimeoutError, ConnectionError):
+                return
+
+            request = parse_head(head)
+
+            if request is None:
+                writer.write(simple_response(400))
+                return
+
+            method, target, version, headers = request
+            fields = dict(headers)
+
+            try:
+                body = await read_body(reader, fields)
+            except BodyError as error:
+                writer.write(simple_response(error.status))
+                return
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                    ConnectionError):
+                return
+
+            connection = fields.get(b'connection', b'').lower()
+            keep_alive = (connection != b'close' if version == '1.1'
+                          else connection == b'keep-alive')
+
+            path, _, query = target.partition('?')
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': version,
+                'method': method,
+                'scheme': 'http',
+                'path': unquote(path),
+                'raw_path': path.encode('latin-1'),
+                'query_string': query.encode('latin-1'),
+                'root_path': '',
+                'headers': headers,
+                'server': server,
+                'client': client,
+            }
+
+            response = Response(writer, keep_alive)
+            await app(scope, Request(body).receive, response.send)
+            await writer.drain()
+
+            if not keep_alive:
+                return
+    finally:
+        writer.close()
+
+
+def parse_head(head):
+    lines = head.decode('latin-1').split('\r\n')
+
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        return None
+
+    if not version.startswith('HTTP/'):
+        return None
+
+    headers = []
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers.append((name.strip().lower().encode('latin-1'),
+                            value.strip().encode('latin-1')))
+
+    return method, target, version[5:], headers
+
+
+class BodyError(Exception):
+    # a body that can't be read, answered with status and closed
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+async def read_body(reader, fields):
+    '''
+    Reads the body the head in fields announced, raises BodyError if
+    it's longer than MAX_BODY or sent in a way that isn't supported
+    '''
+    encoding = fields.get(b'transfer-encoding')
+
+    if encoding is None:
+        try:
+            length = int(fields.get(b'content-length', 0))
+        except ValueError:
+            raise BodyError(400)
+
+        if length < 0:
+            raise BodyError(400)
+        if length > MAX_BODY:
+            raise BodyError(413)
+        return await reader.readexactly(length)
+
+    if encoding.lower() != b'chunked':
+        raise BodyError(501)
+
+    chunks = []
+    size = 0
+
+    while True:
+        line = await reader.readuntil(b'\r\n')
+
+        try:
+            # extensions after a ; are allowed and ignored
+            length = int(line.split(b';', 1)[0].strip(), 16)
+        except ValueError:
+            raise BodyError(400)
+
+        if length < 0:
+            raise BodyError(400)
+        if not length:
+            break
+
+        size += length
+        if size > MAX_BODY:
+            raise BodyError(413)
+
+        chunks.append(await reader.readexactly(length))
+
+        if await reader.readexactly(2) != b'\r\n':
+            raise BodyError(400)
+
+    # trailers aren't used, they end at an empty line
+    trailers = 0
+
+    while True:
+        line = await reader.readuntil(b'\r\n')
+        if line == b'\r\n':
+            break
+
+        trailers += len(line)
+        if trailers > MAX_HEAD:
+            raise BodyError(431)
+
+    return b''.join(chunks)
+
+
+def simple_response(status):
+    phrase = HTTPStatus(status).phrase
+    return 'HTTP/1.1 {} {}\r\ncontent-length: 0\r\nconnection: close\r\n' \
+        '\r\n'.format(status, phrase).encode('latin-1')
+
+
+class Request:
+
+    def __init__(self, body):
+        self.body = body
+
+    async def receive(self):
+        return {'type': 'http.request', 'body': self.body,
+                'more_body': False}
+
+
+class Response:
+
+    def __init__(self, writer, keep_alive):
+        self.writer = writer
+        self.keep_alive = keep_alive
+        self.status = None
+        self.headers = None
+        self.body = []
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+            self.headers = message.get('headers', [])
+            return
+
+        self.body.append(message.get('body', b''))
+
+        if not message.get('more_body'):
+            self.write()
+
+    def write(self):
+        body = b''.join(self.body)
+        lines = ['HTTP/1.1 {} {}'.format(self.status,
+                                         HTTPStatus(self.status).phrase)]
+
+        for name, value in self.headers:
+            if name != b'content-length':
+                lines.append('{}: {}'.format(name.decode('latin-1'),
+                                             value.decode('latin-1')))
+
+        lines.append('content-length: {}'.format(len(body)))
+        if not self.keep_alive:
+            lines.append('connection: close')
+
+        head = '\r\n'.join(lines) + '\r\n\r\n'
+        self.writer.write(head.encode('latin-1') + body)
@@ -0,0 +1,77 @@
+from flask import request
+
+from shared.encoding import loads
+
+'''
+Bulk writes, many objects created in one request
+
+    POST users/0/posts/bulk
+    POST todolists/3/todoitems/bulk
+
+takes what the single object endpoint takes, many times over: a JSON
+array of objects, or NDJSON (Content-Type application/x-ndjson) with
+one object per line, which can be streamed as it's produced. A batch
+holds at most MAX_ITEMS objects.
+
+Every object is checked before any is created, and a batch with a bad
+one creates nothing. Its response is a 400 with one result per object
+in the order sent, {"status": 400, "error": ...} for the bad ones and
+{"status": 424} for those left out because of them. Otherwise the
+whole batch is created with its subtree locked once, and saved the
+way the app saves any change: the blog journals it with one fsync,
+the todo API's write-behind persister saves it with the rest. The
+response is a 201 with {"status": 201, "item": ...} for each, what
+the single endpoint would have sent.
+'''
+
+NDJSON = 'application/x-ndjson'
+MAX_ITEMS = 10000
+
+
+def items():
+    '''
+    The current request's objects, raises ValueError if its body isn't
+    an array or NDJSON of objects, or holds more than MAX_ITEMS
+    '''
+    if request.mimetype == NDJSON:
+        parsed = []
+
+        for number, line in enumerate(request.stream, 1):
+            if not line.strip():
+                continue
+            if len(parsed) == MAX_ITEMS:
+                raise ValueError('more than {} items'.format(MAX_ITEMS))
+
+            try:
+                parsed.append(loads(line))
+            except ValueError:
+                raise ValueError('line {} is not JSON'.format(number))
+    else:
+        try:
+            parsed = loads(request.get_data())
+        except ValueError:
+            raise ValueError('the body is not JSON')
+
+        if not isinstance(parsed, list):
+            raise ValueError('the body is not an array')
+        if len(parsed) > MAX_ITEMS:
+            raise ValueError('more than {} items'.format(MAX_ITEMS))
+
+    if not all(isinstance(item, dict) for item in parsed):
+        raise ValueError('every item has to be an object')
+
+    return parsed
+
+
+def rejected(batch, check):
+    '''
+    Checks each object in order, check returns why one is bad or None.
+    Returns the per object results if any is bad, otherwise None
+    '''
+    errors = [check(item) for item in batch]
+
+    if not any(errors):
+        return None
+
+    return [{'status': 400, 'error': error} if error else {'status': 424}
+            for error in errors]
@@ -0,0 +1,172 @@
+import random
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+
+'''
+Conditional GETs and a cache of encoded responses
+
+Every write bumps version counters for what it changed, and a GET's
+strong ETag is built from the counters of what it read, so a client
+polling with If-None-Match gets a bodyless 304 without the request
+finding or encoding anything. Clients that don't send it are served
+the body encoded the last time, while its ETag is still current.
+
+What a request reads is named by its subtree path, from the top level
+object down, like (user_id, post_id) or (list_id,). A read depends on
+the counter of its own path, which a write bumps along with those of
+every path above it, so a comment on a post changes the post's
+responses and the user's but not those of their other posts. Reads
+with an empty path, over the whole store or an index of it, depend on
+every write.
+
+Writes reaching outside their subtree (deleting a top level object,
+like a user or a todo list, or changing a blog user, whose name is
+embedded in what they wrote under others' posts) bump a shared counter
+every subtree read also depends on. Those are rare, and drop
+everything cached.
+
+The per path counters are striped like the subtree locks, so there's
+no counter to create or clean up per path. Paths sharing a stripe only
+make each other's ETags change a little more often than they need to.
+
+The counters start from zero whenever the server does, so ETags also
+have a random epoch, otherwise a tag from before a restart could match
+different data after it.
+'''
+
+
+class Versions:
+
+    def __init__(self, stripes=4096):
+        self.lock = threading.Lock()
+        self.epoch = '{:08x}'.format(random.getrandbits(32))
+
+        # bumped by every write, and by those reaching outside a subtree
+        self.every = 0
+        self.shared = 0
+        self.paths = [0] * stripes
+
+    def stripe(self, path):
+        return hash(path) % len(self.paths)
+
+    def bump(self, path=(), shared=False):
+        # after a write under path, while it's still locked
+        with self.lock:
+            self.every += 1
+
+            if shared:
+                self.shared += 1
+
+            for end in range(1, len(path) + 1):
+                self.paths[self.stripe(path[:end])] += 1
+
+    def etag(self, path=()):
+        # for a read under path, while it's locked
+        if not path:
+            return '{}-{}'.format(self.epoch, self.every)
+
+        return '{}-{}-{}'.format(self.epoch, self.shared,
+                                 self.paths[self.stripe(path)])
+
+
+class ResponseCache:
+    '''
+    The encoded bodies of recent successful responses to GETs, by URL,
+    with the ETag each was built under
+
+    Holds at most max_entries bodies of max_bytes in all, dropping the
+    least recently used. A body whose ETag is out of date is never
+    sent, and is replaced the next time its URL is built.
+    '''
+
+    def __init__(self, max_entries=4096, max_bytes=64 * 1024 * 1024):
+        self.versions = Versions()
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, etag):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, etag, status, body, headers):
+        if len(body) > self.max_bytes or not self.max_entries:
+            return
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+
+            if old is not None:
+                self.size -= len(old[2])
+
+            self.entries[key] = (etag, status, body, headers)
+            self.size += len(body)
+
+            while (len(self.entries) > self.max_entries or
+                   self.size > self.max_bytes):
+                _, (_, _, dropped, _) = self.entries.popitem(last=False)
+                self.size -= len(dropped)
+
+    def serve(self, path, build):
+        '''
+        Answers the current GET, which reads under path, from its
+        If-None-Match or the cache if it can, otherwise calls build
+        for a response and caches it. Must be called with path locked
+        '''
+        etag = self.versions.etag(path)
+
+        if request.if_none_match.contains(etag):
+            self.not_modified += 1
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        key = request.full_path
+        entry = self.get(key, etag)
+
+        if entry is not None:
+            _, status, body, headers = entry
+            response = Response(body, status, headers)
+            response.set_etag(etag)
+            return response
+
+        response = build()
+
+        # errors aren't worth keeping, and can't be revalidated
+        if not 200 <= response.status_code < 300:
+            return response
+
+        if not response.is_streamed:
+            headers = [(name, value) for name, value in response.headers
+                       if name != 'Content-Length']
+            self.put(key, etag, response.status_code, response.get_data(),
+                     headers)
+
+        response.set_etag(etag)
+        return response
+
+
+def from_config(config):
+    return ResponseCache(int(config['RESPONSE_CACHE_ENTRIES']),
+                         int(config['RESPONSE_CACHE_BYTES']))
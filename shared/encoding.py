@@ -0,0 +1,39 @@
+import json
+
+from flask import Response
+
+'''
+JSON encoding both APIs build on
+
+dumps uses orjson when it's installed and the standard library
+otherwise. Keys are sorted, which is what jsonify did, so responses
+look the same either way.
+'''
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson:
+    def dumps(data):
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+else:
+    def dumps(data):
+        return json.dumps(data, sort_keys=True,
+                          separators=(',', ':')).encode('utf-8')
+
+
+# for request bodies parsed one object at a time, like bulk writes
+if orjson:
+    loads = orjson.loads
+else:
+    loads = json.loads
+
+
+def output_json(data, code, headers=None):
+    # replaces flask_restful's representation for data returned
+    # straight from a Resource
+    return Response(dumps(data) + b'\n', status=code, headers=headers,
+                    mimetype='application/json')
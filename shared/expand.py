@@ -0,0 +1,131 @@
+from itertools import islice
+
+from flask import g, request
+
+'''
+Embedding related models, ?expand= returns a tree in one response
+
+    users/0/posts/3?expand=comments,likes,comments.likes
+    todolists/3?expand=items
+
+is a comma separated list of relations to embed, a dotted one embeds
+into each of the models its first part embeds. Without it, showing a
+post with its comments and all their likes takes one request per
+comment, with it the whole tree is built in one pass over the models.
+
+Each model lists what can be embedded in it in a relations table,
+name -> Relation (see the end of each models.py). Names a model
+doesn't have are left out, like fields= keys.
+
+The tree is limited so one request can't serialize the whole store:
+a relation can be at most MAX_DEPTH deep, anything deeper is a 400,
+each relation embeds at most PAGE of its models, in the order its
+list endpoint sends them, and a response embeds at most MAX_EMBEDDED
+models in all. Next to each embedded list, <relation>Truncated (like
+itemsTruncated) says whether any of its models were left out, the
+rest are paged through the list endpoints. With fields=, it has to be
+asked for like any other key.
+'''
+
+ARG = 'expand'
+MAX_DEPTH = 3
+PAGE = 100
+MAX_EMBEDDED = 5000
+
+# appended to a relation's name for the key saying it was cut short
+TRUNCATED = 'Truncated'
+
+
+class Relation:
+    '''
+    Models embedded in another, children returns them in order and
+    relations is their own relations table
+    '''
+
+    def __init__(self, children, relations=None):
+        self.children = children
+        self.relations = relations or {}
+
+
+class Embedder:
+    # builds trees for one request, sharing its MAX_EMBEDDED between them
+
+    def __init__(self, tree, relations):
+        self.tree = tree
+        self.relations = relations
+        self.left = MAX_EMBEDDED
+
+    def __call__(self, model):
+        return self.embed(model, self.tree, self.relations)
+
+    def embed(self, model, tree, relations):
+        # the memoized dicts are shared, so embedding goes in a copy
+        data = dict(model.create_dict())
+
+        for name, subtree in tree.items():
+            relation = relations.get(name)
+
+            if relation is None:
+                continue
+
+            embedded = []
+            truncated = False
+
+            # one past the page tells whether there were more
+            for child in islice(relation.children(model), PAGE + 1):
+                if len(embedded) == PAGE or not self.left:
+                    truncated = True
+                    break
+
+                self.left -= 1
+                embedded.append(self.embed(child, subtree,
+                                           relation.relations))
+
+            data[name] = embedded
+            data[name + TRUNCATED] = truncated
+
+        return data
+
+
+def parse(value):
+    '''
+    Turns expand= into a tree, relation -> what's embedded in each of
+    its models. Raises ValueError if a relation is empty or too deep
+    '''
+    tree = {}
+
+    for path in value.split(','):
+        names = path.strip().split('.')
+
+        if not all(names):
+            raise ValueError('empty relation in {!r}'.format(path))
+        if len(names) > MAX_DEPTH:
+            raise ValueError('{!r} is nested too deep'.format(path))
+
+        node = tree
+        for name in names:
+            node = node.setdefault(name, {})
+
+    return tree
+
+
+def install(app):
+    app.before_request(check_expand)
+
+
+def check_expand():
+    g.expand = None
+    value = request.args.get(ARG)
+
+    if value is None:
+        return None
+
+    try:
+        g.expand = parse(value)
+    except ValueError:
+        return '', 400
+
+
+def requested():
+    # the current request's tree, None if it didn't ask to expand
+    return g.get('expand')
@@ -0,0 +1,133 @@
+from flask import g, request
+
+'''
+Sparse fieldsets, ?fields= picks the keys a response has
+
+    users/0/posts?fields=postID,title,user.name
+    todolists/0/todoitems?fields=id,task
+
+is a comma separated list of keys, a dotted key picks keys of a nested
+object, like a post's user, or of each object in a nested list, like
+the items expand= embeds. Keys an object doesn't
+have are left out, and without fields= responses are whole as before.
+
+Each model lists the keys of its JSON in a fields table, key ->
+function building that key's value from the model (see the end of
+each models.py). compile turns the keys a request asked for into one
+function that builds only those, once per request, so a list endpoint
+doesn't compute or encode what nobody asked for, like the content of
+every post.
+
+Responses that aren't built from a fields table, like those embedding
+what expand= asks for, are cut down to the requested keys after
+they're built, with project.
+'''
+
+ARG = 'fields'
+
+
+class Nested:
+    '''
+    A key holding another model, or a list of them if many
+
+    get returns it from the parent, fields is its fields table and
+    whole builds its whole dict
+    '''
+
+    def __init__(self, get, fields, whole, many=False):
+        self.get = get
+        self.fields = fields
+        self.whole = whole
+        self.many = many
+
+    def __call__(self, obj):
+        value = self.get(obj)
+
+        if self.many:
+            return [self.whole(model) for model in value]
+        return self.whole(value)
+
+    def project(self, build):
+        # the key with only the nested keys build makes
+        get = self.get
+
+        if self.many:
+            return lambda obj: [build(model) for model in get(obj)]
+        return lambda obj: build(get(obj))
+
+
+def parse(value):
+    '''
+    Turns fields= into a tree, key -> the keys picked from its value,
+    or None for all of them. Raises ValueError if a key is empty
+    '''
+    tree = {}
+
+    for path in value.split(','):
+        keys = path.strip().split('.')
+
+        if not all(keys):
+            raise ValueError('empty key in {!r}'.format(path))
+
+        node = tree
+        for key in keys[:-1]:
+            if key in node and node[key] is None:
+                # the whole value was asked for already
+                break
+            node = node.setdefault(key, {})
+        else:
+            node[keys[-1]] = None
+
+    return tree
+
+
+def compile(tree, fields):
+    # a function building just the keys in tree from a model
+    parts = []
+
+    for key, subtree in tree.items():
+        field = fields.get(key)
+
+        if field is None:
+            continue
+
+        if subtree is not None and isinstance(field, Nested):
+            field = field.project(compile(subtree, field.fields))
+        parts.append((key, field))
+
+    return lambda obj: {key: field(obj) for key, field in parts}
+
+
+def project(data, tree):
+    # cuts already built dicts and lists down to the keys in tree
+    if isinstance(data, list):
+        return [project(value, tree) for value in data]
+
+    if not isinstance(data, dict):
+        return data
+
+    return {key: data[key] if subtree is None else
+            project(data[key], subtree)
+            for key, subtree in tree.items() if key in data}
+
+
+def install(app):
+    app.before_request(check_fields)
+
+
+def check_fields():
+    g.fields = None
+    value = request.args.get(ARG)
+
+    if value is None:
+        return None
+
+    try:
+        g.fields = parse(value)
+    except ValueError:
+        return '', 400
+
+
+def requested():
+    # the current request's tree, None if it didn't ask for fields
+    return g.get('fields')
@@ -0,0 +1,135 @@
+import threading
+from contextlib import contextmanager
+
+'''
+Locking so the store can be used from many threads at once
+
+The store is split into subtrees, everything under one top level
+object (a user and their posts, or a todo list and its items). A
+request that only touches one subtree locks just that subtree, for
+reading or for writing, so reads run in parallel and writes to
+different subtrees don't wait on each other. Adding or deleting a
+top level object locks the whole store.
+
+Subtree locks are striped, a fixed number of locks shared by hashing
+the subtree's key, so there's no lock to create or clean up per user.
+Two subtrees on the same stripe just occasionally wait on each other.
+
+Indexes over the whole store (search, timelines, etc.) are shared by
+every subtree, so they have one lock of their own, taken while they're
+notified of a change and while they're read.
+
+None of these locks are reentrant, a thread holding one mustn't try
+to take it again.
+'''
+
+
+class RWLock:
+    '''
+    Any number of readers or one writer
+
+    Writers waiting for the lock hold off new readers, so a steady
+    stream of reads can't keep a write waiting forever.
+    '''
+
+    def __init__(self):
+        self.changed = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    def acquire_read(self):
+        with self.changed:
+            while self.writer or self.waiting_writers:
+                self.changed.wait()
+            self.readers += 1
+
+    def release_read(self):
+        with self.changed:
+            self.readers -= 1
+
+            if not self.readers:
+                self.changed.notify_all()
+
+    def acquire_write(self):
+        with self.changed:
+            self.waiting_writers += 1
+
+            while self.writer or self.readers:
+                self.changed.wait()
+
+            self.waiting_writers -= 1
+            self.writer = True
+
+    def release_write(self):
+        with self.changed:
+            self.writer = False
+            self.changed.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class StoreLocks:
+
+    def __init__(self, stripes=64):
+        self.store = RWLock()
+        self.subtrees = [RWLock() for _ in range(stripes)]
+
+        # reentrant since a change can set off more changes, like
+        # deleting a user deleting their likes
+        self.indexes = threading.RLock()
+
+    def subtree(self, key):
+        return self.subtrees[hash(key) % len(self.subtrees)]
+
+    @contextmanager
+    def reading(self, key=None):
+        # the subtree under key, or with no key just the store's
+        # structure (which top level objects exist)
+        with self.store.read():
+            if key is None:
+                yield
+            else:
+                with self.subtree(key).read():
+                    yield
+
+    @contextmanager
+    def writing(self, key=None):
+        # the subtree under key, or with no key the whole store
+        if key is None:
+            with self.store.write():
+                yield
+        else:
+            with self.store.read(), self.subtree(key).write():
+                yield
+
+    @contextmanager
+    def index(self, index):
+        '''
+        Reads an index over the whole store
+
+        An index that builds itself on first use is built with the
+        whole store locked, otherwise a write landing mid build could
+        be added to it twice.
+        '''
+        if not index.built:
+            with self.store.write():
+                if not index.built:
+                    index.build()
+
+        with self.store.read(), self.indexes:
+            yield index
@@ -0,0 +1,219 @@
+import cProfile
+import io
+import itertools
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from flask import Response, g, request
+
+'''
+Per route latency, response size and model lookup histograms
+
+Metrics.install times every request an app serves and counts the model
+lookups it makes (the find_* methods in each models.py are wrapped with
+counts_lookup), and serves them in the Prometheus text format at
+GET /metrics, labelled by route and method. The route is the URL rule
+the request matched, so /users/1 and /users/2 (or /todolists/1 and
+/todolists/2) are the same route.
+
+Profiling is off unless routes are listed in METRICS_PROFILE. One in
+every METRICS_PROFILE_EVERY requests to those routes then runs under
+cProfile, and GET /metrics/profile?route=<rule> shows where their time
+went, summed over every sampled request.
+'''
+
+# upper bounds, a request goes in the first bucket it fits
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576)
+LOOKUP_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# the lookups made by the request on each thread
+lookups = threading.local()
+
+
+def counts_lookup(func):
+    @wraps(func)
+    def counted(*args, **kwargs):
+        lookups.count = getattr(lookups, 'count', 0) + 1
+        return func(*args, **kwargs)
+    return counted
+
+
+def from_config(config):
+    # METRICS_PROFILE is a list of routes or a comma separated string
+    profile = config.get('METRICS_PROFILE') or ()
+
+    if isinstance(profile, str):
+        profile = [route for route in profile.split(',') if route]
+
+    return Metrics(profile, int(config.get('METRICS_PROFILE_EVERY', 100)))
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # the last count is for everything past the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = itertools.accumulate(self.counts)
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+
+        for bound, count in zip(bounds, cumulative):
+            yield '{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound,
+                                                      count)
+        yield '{}_sum{{{}}} {}'.format(name, labels, self.sum)
+        yield '{}_count{{{}}} {}'.format(name, labels, sum(self.counts))
+
+
+class Family:
+    # one histogram per route and method
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.histograms = {}
+
+    def observe(self, labels, value):
+        histogram = self.histograms.get(labels)
+
+        if histogram is None:
+            histogram = self.histograms[labels] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def lines(self):
+        yield '# HELP {} {}'.format(self.name, self.description)
+        yield '# TYPE {} histogram'.format(self.name)
+
+        for (route, method), histogram in sorted(self.histograms.items()):
+            labels = 'route="{}",method="{}"'.format(escape(route), method)
+            yield from histogram.lines(self.name, labels)
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n',
+                                                                    '\\n')
+
+
+class Metrics:
+
+    # the endpoints install adds, they aren't held back while loading
+    endpoints = ('metrics', 'metrics_profile')
+
+    def __init__(self, profile=(), profile_every=100):
+        self.lock = threading.Lock()
+
+        self.latency = Family('http_request_duration_seconds',
+                              'Time spent handling a request.',
+                              LATENCY_BUCKETS)
+        self.size = Family('http_response_size_bytes',
+                           'Size of a response body.', SIZE_BUCKETS)
+        self.lookup_counts = Family('model_lookups_per_request',
+                                    'Model find_* calls made by a request.',
+                                    LOOKUP_BUCKETS)
+
+        # route -> sampled requests so far and their summed profile
+        self.profiled = {route: [0, None] for route in profile}
+        self.profile_every = profile_every
+
+    def install(self, app):
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_response)
+        app.add_url_rule('/metrics/profile', 'metrics_profile',
+                         self.profile_response)
+
+    def start(self):
+        lookups.count = 0
+        route = route_of(request)
+
+        if route in self.profiled and self.sampled(route):
+            profiler = cProfile.Profile()
+
+            # newer Pythons only run one profiler at a time, a request
+            # sampled while another is being profiled goes without
+            try:
+                profiler.enable()
+                g.profiler = profiler
+            except ValueError:
+                pass
+
+        g.started = time.perf_counter()
+
+    def sampled(self, route):
+        with self.lock:
+            sample = self.profiled[route]
+            sample[0] += 1
+            return (sample[0] - 1) % self.profile_every == 0
+
+    def finish(self, response):
+        elapsed = time.perf_counter() - g.pop('started', time.perf_counter())
+        profiler = g.pop('profiler', None)
+        labels = route_of(request), request.method
+
+        if profiler:
+            profiler.disable()
+
+        size = response.calculate_content_length() or 0
+
+        with self.lock:
+            self.latency.observe(labels, elapsed)
+            self.size.observe(labels, size)
+            self.lookup_counts.observe(labels, getattr(lookups, 'count', 0))
+
+            if profiler:
+                sample = self.profiled[labels[0]]
+                if sample[1] is None:
+                    sample[1] = pstats.Stats(profiler)
+                else:
+                    sample[1].add(profiler)
+
+        return response
+
+    def metrics_response(self):
+        with self.lock:
+            lines = [line for family in (self.latency, self.size,
+                                         self.lookup_counts)
+                     for line in family.lines()]
+        return Response('\n'.join(lines) + '\n', 200,
+                        {'Content-Type': CONTENT_TYPE})
+
+    def profile_response(self):
+        route = request.args.get('route')
+
+        if route not in self.profiled:
+            return Response('not a profiled route\n', 404,
+                            {'Content-Type': CONTENT_TYPE})
+
+        out = io.StringIO()
+
+        with self.lock:
+            sampled, stats = self.profiled[route]
+
+            if stats is None:
+                out.write('no requests sampled yet\n')
+            else:
+                out.write('{} requests, 1 in {} sampled\n'.format(
+                    sampled, self.profile_every))
+                stats.stream = out
+                stats.sort_stats('cumulative').print_stats(30)
+
+        return Response(out.getvalue(), 200, {'Content-Type': CONTENT_TYPE})
+
+
+def route_of(request):
+    # unmatched URLs all share one route, so 404s can't grow the labels
+    return request.url_rule.rule if request.url_rule else 'unmatched'
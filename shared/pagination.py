@@ -0,0 +1,78 @@
+import base64
+import json
+
+'''
+Keyset pagination for the list endpoints
+
+Every list endpoint takes an optional limit and cursor in the query
+string. A page holds up to limit objects, and if there are more, the
+X-Next-Cursor header holds the cursor for the next page. Cursors are
+opaque to the client, they encode the key of the last object sent so
+the next page starts right after it, no matter how deep it is or
+what was added or deleted in between.
+
+Without a limit or cursor the whole list is returned as before.
+'''
+
+MAX_LIMIT = 1000
+CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(key):
+    # keys are an id, or a tuple of ints like a blog like's or post's
+    if not isinstance(key, tuple):
+        key = (key,)
+
+    data = json.dumps(key, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    # raises ValueError for anything that isn't one of our cursors
+    padding = '=' * (-len(cursor) % 4)
+
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (TypeError, ValueError):
+        key = None
+
+    if (not isinstance(key, list) or len(key) != size or
+            not all(type(value) is int for value in key)):
+        raise ValueError('invalid cursor')
+
+    return key[0] if size == 1 else tuple(key)
+
+
+def parse_limit(value):
+    # a page size from the query string, ValueError unless it's positive
+    limit = int(value)
+
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_LIMIT)
+
+
+def page_args(args, size=1):
+    '''
+    Reads limit and cursor from the query string
+
+    Returns (after, limit), either can be None. size is how many ints
+    are in the cursor's key. Raises ValueError if either is invalid,
+    which the endpoints turn into a 400.
+    '''
+    limit = args.get('limit')
+    cursor = args.get('cursor')
+
+    if limit is not None:
+        limit = parse_limit(limit)
+    elif cursor is not None:
+        limit = MAX_LIMIT
+
+    after = decode_cursor(cursor, size) if cursor is not None else None
+    return after, limit
+
+
+def page_headers(next_key):
+    if next_key is None:
+        return {}
+    return {CURSOR_HEADER: encode_cursor(next_key)}
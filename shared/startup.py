@@ -0,0 +1,140 @@
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+from flask import request
+from shared.encoding import output_json
+
+'''
+Loading an app's data after it starts instead of when it's imported
+
+create_app doesn't touch the data, so the app can be imported, and a
+preforking server can fork its workers before anything is loaded. The
+load then runs on a background thread in each worker, either started
+straight away or by the first request, depending on the load mode:
+
+    eager       load before create_app returns
+    background  start loading when create_app returns
+    lazy        start loading on the first request
+
+Until it's done every request gets a 503 with Retry-After, except the
+endpoints in ungated and GET <api_url>ready, which reports whether the
+app is ready, how long each phase of the load took and, while a phase
+reports it, how far through it the load is, for load balancers and for
+tuning startup.
+
+If the load fails, eager mode raises its exception from create_app,
+and otherwise every request, ready included, gets a 500 saying why.
+'''
+
+LOAD_MODES = ('eager', 'background', 'lazy')
+
+
+class Startup:
+
+    def __init__(self, load, mode='lazy'):
+        if mode not in LOAD_MODES:
+            raise ValueError('unknown load mode {!r}'.format(mode))
+
+        # load(startup) does the work, timing its phases with phase
+        self.load = load
+        self.mode = mode
+
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.started = False
+
+        # set once the load is over, whether it worked or not
+        self.done = threading.Event()
+        self.failure = None
+        self.error = None
+
+        # endpoints served while loading, besides ready
+        self.ungated = {'ready'}
+
+        # phase name -> seconds, in the order they ran
+        self.phases = {}
+
+        # what the running phase last said about how far it's got
+        self.progress = None
+
+    def install(self, app, api_url):
+        app.before_request(self.check_ready)
+        app.add_url_rule(api_url + 'ready', 'ready', self.status_response)
+
+        if self.mode == 'eager':
+            self.start()
+            self.done.wait()
+
+            if self.failure is not None:
+                raise self.failure
+        elif self.mode == 'background':
+            self.start()
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        start = time.perf_counter()
+
+        try:
+            self.load(self)
+        except Exception as e:
+            self.failure = e
+            self.error = traceback.format_exc()
+            traceback.print_exc()
+            return
+        else:
+            self.phases['total'] = round(time.perf_counter() - start, 3)
+            self.ready.set()
+        finally:
+            self.done.set()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        yield
+        self.phases[name] = round(time.perf_counter() - start, 3)
+        self.progress = None
+
+    def report(self, **progress):
+        # a long phase calls this now and then, it's shown by ready
+        self.progress = progress
+
+    def status(self):
+        status = {'ready': self.ready.is_set(), 'phases': dict(self.phases),
+                  'failed': self.failure is not None}
+
+        progress = self.progress
+        if progress is not None:
+            status['progress'] = progress
+
+        if self.error:
+            status['error'] = self.error.splitlines()[-1]
+        return status
+
+    def status_response(self):
+        self.start()
+
+        if self.ready.is_set():
+            return output_json(self.status(), 200)
+        if self.failure is not None:
+            return output_json(self.status(), 500)
+        return output_json(self.status(), 503)
+
+    def check_ready(self):
+        if self.ready.is_set() or request.endpoint in self.ungated:
+            return None
+
+        self.start()
+
+        # there's no point retrying after a load that failed
+        if self.failure is not None:
+            return output_json(self.status(), 500)
+        return output_json(self.status(), 503, {'Retry-After': '1'})